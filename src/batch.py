@@ -0,0 +1,523 @@
+# vim: set fileencoding=utf-8 :
+"""
+batch.py: vectorised versions of the damage calculations in calc.py
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+
+from contextlib import suppress
+
+import numpy as np
+
+from . import static
+from .static import (
+    COMBO_EFFECTIVENESS,
+    DEFAULT_LEVEL,
+    NO_TYPE,
+    PHYSICAL,
+    STAT_CONSTS,
+    STATUS,
+    TYPE_IDS,
+    Stats,
+    lookup_attack,
+)
+from .temtem import TemTem
+from .util import MAX_STAT_TVS, MAX_TOTAL_TVS
+
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import logging
+log = logging.getLogger(__name__)
+
+# EFFECTIVENESS[attack type id, type_combo(target types)] = effectiveness
+EFFECTIVENESS = np.array(COMBO_EFFECTIVENESS)
+# Every possible number of TVs in one stat
+TV_RANGE = np.arange(MAX_STAT_TVS + 1)
+# In min_hp_tvs(), for TVs where no amount of HP is enough
+NOT_SURVIVABLE = MAX_STAT_TVS + 1
+MAX_SVS = 50
+
+# Stats in the order of the stat axis of arrays below, and their constants
+STAT_ORDER = tuple(Stats)
+STAT_IDS = {stat: i for i, stat in enumerate(STAT_ORDER)}
+_STAT_CONSTS = np.array([
+    (*STAT_CONSTS[stat][:2], STAT_CONSTS[stat][2], stat == Stats.HP) for stat in STAT_ORDER
+], dtype=np.int64)
+
+# The stats of every species at DEFAULT_LEVEL, as
+# table[species id, stat id, sv, tv], cached on disk (when
+# static.USE_CACHE) as it takes a while to build. See level_stat_table().
+STAT_TABLE_PATH = os.path.join('data', f'stat_table_{DEFAULT_LEVEL}.npz')
+_STAT_TABLE = None
+
+
+def tem_arrays(tems: Iterable[TemTem]) -> Dict[str, np.ndarray]:
+    """
+    Collect the live stats etc. of tems into the arrays calc_damage_batch()
+    expects, for use either as attackers or as targets.
+    """
+    tems = list(tems)
+    return {
+        'level': np.array([tem.level for tem in tems], dtype=np.int64),
+        'atk': np.array([tem.Atk for tem in tems], dtype=np.int64),
+        'spa': np.array([tem.SpA for tem in tems], dtype=np.int64),
+        'spe': np.array([tem.Spe for tem in tems], dtype=np.int64),
+        'df': np.array([tem.Def for tem in tems], dtype=np.int64),
+        'spd': np.array([tem.SpD for tem in tems], dtype=np.int64),
+        'types': np.array([
+            [TYPE_IDS[t] if t else NO_TYPE for t in tem.types] for tem in tems
+        ], dtype=np.int64).reshape(len(tems), 2),
+        'type_combo': np.array([tem.type_combo for tem in tems], dtype=np.int64),
+        'nullified': np.array([tem.nullified for tem in tems], dtype=bool),
+    }
+
+
+def attack_arrays(attacks: Iterable[Any]) -> Dict[str, np.ndarray]:
+    """
+    Collect attacks (names or Attacks) into the arrays calc_damage_batch()
+    expects. None is treated as a status move, for padding movesets.
+    """
+    attacks = [
+        lookup_attack(attack) if isinstance(attack, str) else attack
+        for attack in attacks
+    ]
+    return {
+        'damage': np.array(
+            [attack.damage if attack is not None else 0 for attack in attacks], dtype=np.int64
+        ),
+        'attack_class': np.array(
+            [attack.class_id if attack is not None else STATUS for attack in attacks],
+            dtype=np.int64,
+        ),
+        'attack_type': np.array(
+            [attack.type_id if attack is not None else 0 for attack in attacks], dtype=np.int64
+        ),
+        'hks': np.array([
+            attack is not None and attack.name == 'Hyperkinetic Strike'
+            for attack in attacks
+        ], dtype=bool),
+    }
+
+
+def calc_damage_batch(
+    attackers: Dict[str, np.ndarray],
+    targets: Dict[str, np.ndarray],
+    attacks: Dict[str, np.ndarray],
+    modifiers: Any = 1.0,
+) -> np.ndarray:
+    """
+    Vectorised calc.calc_damage(): returns damage[attacker, target, attack].
+
+    attackers and targets are as returned by tem_arrays(), and attacks as
+    returned by attack_arrays(). The attack arrays can either have shape (M,),
+    in which case every attacker uses every attack, or shape (A, M), giving
+    each attacker its own attacks. modifiers must broadcast to (A, T, M).
+
+    This matches calc_damage exactly, including its float rounding, so the
+    operations below are deliberately done in the same order.
+    """
+    def attacker_col(arr):
+        return arr.reshape(-1, 1, 1)
+
+    def target_col(arr):
+        return arr.reshape(1, -1, 1)
+
+    def attack_col(arr):
+        return arr.reshape(-1, 1, arr.shape[-1]) if arr.ndim == 2 else arr.reshape(1, 1, -1)
+
+    attack_class = attack_col(attacks['attack_class'])
+    attack_type = attack_col(attacks['attack_type'])
+    physical = attack_class == PHYSICAL
+
+    atk = np.where(physical, attacker_col(attackers['atk']), attacker_col(attackers['spa']))
+    df = np.where(physical, target_col(targets['df']), target_col(targets['spd']))
+    level = attacker_col(attackers['level'])
+
+    damage = (level * attack_col(attacks['damage']) * atk) / (200 * df) + 7
+
+    eff = EFFECTIVENESS[attack_type, target_col(targets['type_combo'])]
+    damage *= np.where(target_col(targets['nullified']), 1.0, eff)
+    damage *= modifiers
+
+    attacker_types = attackers['types']
+    stab = np.where(
+        (attack_type == attacker_col(attacker_types[:, 0]))
+        | (attack_type == attacker_col(attacker_types[:, 1])),
+        1.5,
+        1.0,
+    )
+
+    # See calc_damage for the details of Hyperkinetic Strike
+    hks = attack_col(attacks['hks'])
+    hks_damage = (damage + (level * 59 * attacker_col(attackers['spe'])) / (200 * df)) * stab
+    damage = np.where(hks, np.trunc(hks_damage), np.rint(damage * stab))
+
+    return np.where(attack_class == STATUS, 0, damage).astype(np.int64)
+
+
+def damage_matrix(
+    attackers: Iterable[TemTem], targets: Iterable[TemTem], modifiers: Any = 1.0
+) -> np.ndarray:
+    """
+    damage[attacker, target, move] for each attacker's own moves, in the order
+    of attacker.moves. Attackers with fewer moves are padded with zeros.
+    """
+    attackers = list(attackers)
+    n_moves = max((len(tem.moves) for tem in attackers), default=0)
+    movesets = [
+        list(tem.moves) + [None] * (n_moves - len(tem.moves)) for tem in attackers
+    ]
+    attacks = {
+        key: arr.reshape(len(attackers), n_moves)
+        for key, arr in attack_arrays(
+            move for moveset in movesets for move in moveset
+        ).items()
+    }
+    return calc_damage_batch(tem_arrays(attackers), tem_arrays(targets), attacks, modifiers)
+
+
+def _stat_formula(stat_ids, base, sv, tv, level):
+    # temtem.calc_stat() on arrays, with the float operations in the same
+    # order so the results are identical
+    c0, c1, c2, is_hp = (_STAT_CONSTS[stat_ids, i] for i in range(4))
+    val1 = ((1.5 * base + sv + tv / 5) * level) // c0
+    val2 = (sv * base * level) // c1
+    return (val1 + val2 + (c2 + is_hp * level)).astype(np.int64)
+
+
+def species_data() -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    (species names, base_stats[species id, stat id]) for every species in
+    static.TEMTEM_DATA, where a species' id is its index in names, from
+    static.static_tables() (so shared between processes when static data is).
+    """
+    tables = static.static_tables()
+    return tables.species, tables.base_stats
+
+
+def species_ids(species: Any) -> np.ndarray:
+    """ Species ids for a name or array of names """
+    names, _ = species_data()
+    ids = {name: i for i, name in enumerate(names)}
+    return np.vectorize(ids.__getitem__, otypes=[np.int64])(species)
+
+
+def calc_stats_batch(species: Any, stat: Any, sv: Any, tv: Any, level: Any) -> np.ndarray:
+    """
+    Vectorised temtem.calc_stat() for species (ids or names), stats (Stats
+    or stat ids), SVs, TVs and levels, which broadcast together. The results
+    are exactly those of calc_stat().
+    """
+    species, stat = np.asarray(species), np.asarray(stat)
+    if species.dtype.kind in 'UO':
+        species = species_ids(species)
+    if stat.dtype.kind == 'O':
+        stat = np.vectorize(STAT_IDS.__getitem__, otypes=[np.int64])(stat)
+    _, base_stats = species_data()
+    return _stat_formula(stat, base_stats[species, stat], sv, tv, level)
+
+
+def _build_stat_table(base_stats, level):
+    table = np.empty((len(base_stats), len(STAT_ORDER), MAX_SVS + 1, len(TV_RANGE)), np.int16)
+    stat_ids = np.arange(len(STAT_ORDER)).reshape(-1, 1, 1)
+    svs = np.arange(MAX_SVS + 1).reshape(1, -1, 1)
+    for species, base in enumerate(base_stats):
+        # A species at a time, to keep the temporary arrays small
+        table[species] = _stat_formula(stat_ids, base.reshape(-1, 1, 1), svs, TV_RANGE, level)
+    return table
+
+
+def _read_stat_table(path, base_stats):
+    with np.load(path) as cached:
+        if np.array_equal(cached['base_stats'], base_stats):
+            return cached['table']
+    return None
+
+
+def _write_stat_table(path, base_stats, table):
+    # As static._write_cache(), via a temporary file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, base_stats=base_stats, table=table)
+        os.replace(tmp_path, path)
+    except OSError as err:
+        log.warning('Unable to write stat table %s: %r', path, err)
+        with suppress(OSError):
+            os.remove(tmp_path)
+
+
+def level_stat_table(path: str = STAT_TABLE_PATH) -> np.ndarray:
+    """
+    The stats of every species at DEFAULT_LEVEL, for every SV and TV, as
+    table[species id, stat id, sv, tv] (see species_data() and STAT_ORDER).
+
+    It's built once per process, and with static.USE_CACHE, cached at path
+    until the base stats in temtem.yaml change.
+
+    Unlike static.static_tables(), it isn't put in shared memory by
+    static.share_static_data(): it's only built when asked for, and the
+    simulator's workers never use it. Forked workers share the pages of the
+    parent's table, and spawned workers that need it read it from the cache.
+    """
+    global _STAT_TABLE
+    if _STAT_TABLE is not None:
+        return _STAT_TABLE
+
+    _, base_stats = species_data()
+    table = None
+    if static.USE_CACHE:
+        try:
+            table = _read_stat_table(path, base_stats)
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            log.warning('Ignoring unreadable stat table %s: %r', path, err)
+    if table is None:
+        table = _build_stat_table(base_stats, DEFAULT_LEVEL)
+        if static.USE_CACHE:
+            _write_stat_table(path, base_stats, table)
+    _STAT_TABLE = table
+    return table
+
+
+def stat_table(tem: TemTem, stat: Stats) -> np.ndarray:
+    """
+    Vectorised temtem.calc_stat(): tem's unboosted stat for every number of
+    TVs in TV_RANGE, i.e. table[tvs] = stat.
+    """
+    base, sv, level = tem.base_stats[stat], tem.svs[stat], tem.level
+    if level == DEFAULT_LEVEL and _STAT_TABLE is not None and 0 <= sv <= MAX_SVS:
+        names, base_stats = species_data()
+        if tem.species in names:
+            species = names.index(tem.species)
+            if base_stats[species, STAT_IDS[stat]] == base:
+                return _STAT_TABLE[species, STAT_IDS[stat], sv].astype(np.int64)
+    return _stat_formula(STAT_IDS[stat], base, sv, TV_RANGE, level)
+
+
+def _live_stat_table(tem, stat):
+    # As TemTem._live_stat(), for each value of stat_table()
+    res = stat_table(tem, stat)
+    if (boost := tem.boosts[stat]) > 0:
+        res = res * ((2 + boost) / 2)
+    elif boost:
+        res = res * (2 / (2 - boost))
+    return np.maximum(1, res.astype(np.int64))
+
+
+def min_hp_tvs(
+    target: TemTem, attacker: TemTem, attack: Any, modifiers: float = 1.0, hits: int = 1
+) -> Tuple[Stats, np.ndarray]:
+    """
+    The fewest HP TVs target needs to survive `hits` hits of attack from
+    attacker, for every number of TVs in the defending stat the attack uses.
+
+    Returns (Stats.Def or Stats.SpD, min_hp[defending stat tvs]), with
+    NOT_SURVIVABLE where no HP TVs are enough. The target's other TVs, and
+    its current boosts, are kept as they are.
+    """
+    attacks = attack_arrays([attack])
+    stat = Stats.Def if attacks['attack_class'][0] == PHYSICAL else Stats.SpD
+    defence = _live_stat_table(target, stat)
+    n = len(TV_RANGE)
+    targets = {
+        'df': defence,
+        'spd': defence,
+        'type_combo': np.full(n, target.type_combo, dtype=np.int64),
+        'nullified': np.full(n, target.nullified, dtype=bool),
+    }
+    damage = calc_damage_batch(tem_arrays([attacker]), targets, attacks, modifiers)[0, :, 0]
+    # Surviving means taking less damage than max HP, which rises with TVs
+    return stat, np.searchsorted(stat_table(target, Stats.HP), hits * damage, side='right')
+
+
+def survival_thresholds(
+    target: TemTem, threats: Iterable[Sequence[Any]], hits: int = 1
+) -> Dict[Stats, np.ndarray]:
+    """
+    The fewest HP TVs target needs to survive every one of threats, each
+    (attacker, attack) or (attacker, attack, modifiers), as
+    {Stats.Def: min_hp[def tvs], Stats.SpD: min_hp[spd tvs]}.
+
+    Together these describe the whole region of HP x Def x SpD TVs that
+    survives: it's every (hp, df, spd) with hp >= both min_hp[Def][df] and
+    min_hp[SpD][spd]. See survives() and cheapest_survival().
+    """
+    thresholds = {
+        Stats.Def: np.zeros(len(TV_RANGE), dtype=np.int64),
+        Stats.SpD: np.zeros(len(TV_RANGE), dtype=np.int64),
+    }
+    for threat in threats:
+        stat, min_hp = min_hp_tvs(target, *threat, hits=hits)
+        np.maximum(thresholds[stat], min_hp, out=thresholds[stat])
+    return thresholds
+
+
+def survives(thresholds: Dict[Stats, np.ndarray], hp: Any, df: Any, spd: Any) -> np.ndarray:
+    """
+    Whether each combination of HP, Def and SpD TVs (which broadcast
+    together) is in the region from survival_thresholds().
+    """
+    return (
+        (np.asarray(hp) >= thresholds[Stats.Def][df])
+        & (np.asarray(hp) >= thresholds[Stats.SpD][spd])
+    )
+
+
+def cheapest_survival(
+    thresholds: Dict[Stats, np.ndarray], budget: int = MAX_TOTAL_TVS
+) -> Optional[Tuple[int, int, int]]:
+    """
+    The (hp, df, spd) TVs in the region from survival_thresholds() with the
+    fewest TVs in total (then the most HP), or None if nothing within budget
+    survives.
+    """
+    min_hp = np.maximum(
+        thresholds[Stats.Def].reshape(-1, 1), thresholds[Stats.SpD].reshape(1, -1)
+    )
+    total = np.where(
+        min_hp < NOT_SURVIVABLE,
+        min_hp + TV_RANGE.reshape(-1, 1) + TV_RANGE.reshape(1, -1),
+        np.iinfo(np.int64).max,
+    )
+    df, spd = np.unravel_index(
+        np.lexsort(((-min_hp).ravel(), total.ravel()))[0], total.shape
+    )
+    if total[df, spd] > budget:
+        return None
+    return int(min_hp[df, spd]), int(df), int(spd)
+
+
+# Tests
+def test_calc_damage_batch():
+    from .calc import calc_damage
+    from .static import Statuses
+    from .temtem import SAMPLE_SETS, gen_tems
+    from .test_data import GYALIS_TEM, KINU_TEM, VOLAREND_TEM
+
+    def known_moves(tem):
+        try:
+            return all(lookup_attack(move) for move in tem.moves)
+        except KeyError:
+            return False
+
+    with open(SAMPLE_SETS, 'r') as fp:
+        tems = [GYALIS_TEM, KINU_TEM, VOLAREND_TEM, *filter(known_moves, gen_tems(fp))]
+
+    KINU_TEM.apply_status(Statuses.burned, 2)
+    try:
+        for modifiers in (1.0, 1.1):
+            damage = damage_matrix(tems, tems, modifiers)
+            for i, attacker in enumerate(tems):
+                for j, target in enumerate(tems):
+                    for k, move in enumerate(attacker.moves):
+                        assert damage[i, j, k] == calc_damage(
+                            attacker, target, move, modifiers
+                        )
+    finally:
+        KINU_TEM.remove_status(Statuses.burned)
+
+
+def test_survival_thresholds():
+    from .calc import calc_damage
+    from .temtem import calc_stat
+    from .test_data import GYALIS_TEM, KINU_TEM, VOLAREND_TEM
+
+    for stat in Stats:
+        assert stat_table(VOLAREND_TEM, stat).tolist() == [
+            calc_stat(stat, VOLAREND_TEM.base_stats[stat], VOLAREND_TEM.svs[stat], tvs, 48)
+            for tvs in TV_RANGE
+        ]
+
+    target = TemTem(
+        'Kinu', ['Beta Burst'], 'Protector', tvs={'HP': 0, 'Def': 0, 'SpD': 0}, level=48
+    )
+    threats = [(GYALIS_TEM, 'Crystal Bite', 1.2), (VOLAREND_TEM, 'Blizzard')]
+    thresholds = survival_thresholds(target, threats)
+
+    def brute_force(hp, df, spd):
+        target.tvs.update({Stats.HP: hp, Stats.Def: df, Stats.SpD: spd})
+        target._calc_stats()
+        return all(calc_damage(attacker, target, *rest) < target.max_hp
+                   for attacker, *rest in threats)
+
+    for hp, df, spd in [(0, 0, 0), (500, 500, 500), (200, 100, 300), (100, 500, 40)]:
+        assert survives(thresholds, hp, df, spd) == brute_force(hp, df, spd)
+    for df in range(0, 501, 100):
+        for spd in range(0, 501, 100):
+            min_hp = max(thresholds[Stats.Def][df], thresholds[Stats.SpD][spd])
+            if min_hp < NOT_SURVIVABLE:
+                assert brute_force(min_hp, df, spd)
+            if 0 < min_hp:
+                assert not brute_force(min(min_hp, NOT_SURVIVABLE) - 1, df, spd)
+
+    hp, df, spd = cheapest_survival(thresholds)
+    assert brute_force(hp, df, spd)
+    assert not brute_force(hp - 1, df, spd) if hp else True
+    totals = TV_RANGE.reshape(-1, 1, 1) + TV_RANGE.reshape(1, -1, 1) + TV_RANGE
+    feasible = survives(thresholds, TV_RANGE.reshape(-1, 1, 1), TV_RANGE.reshape(1, -1, 1),
+                        TV_RANGE.reshape(1, 1, -1))
+    assert totals[feasible].min() == hp + df + spd
+    assert cheapest_survival(thresholds, budget=hp + df + spd - 1) is None
+
+    # KINU_TEM can't survive 10 hits whatever its TVs
+    assert cheapest_survival(survival_thresholds(KINU_TEM, threats, hits=10)) is None
+
+
+def test_stat_table(tmp_path, monkeypatch):
+    import random
+    import sys
+    from .temtem import calc_stat
+
+    names, base_stats = species_data()
+    rolls = random.Random(0)
+    cases = [
+        (rolls.randrange(len(names)), rolls.choice(STAT_ORDER), rolls.randint(0, MAX_SVS),
+         rolls.randint(0, MAX_STAT_TVS), rolls.randint(1, 100))
+        for _ in range(2000)
+    ]
+    species, stats, svs, tvs, levels = (np.array(values, dtype=object) for values in zip(*cases))
+    expected = [
+        calc_stat(stat, base_stats[i, STAT_IDS[stat]], sv, tv, level)
+        for i, stat, sv, tv, level in cases
+    ]
+    assert calc_stats_batch(species.astype(np.int64), stats, svs, tvs, levels).tolist() == expected
+    assert calc_stats_batch(
+        np.array([names[i] for i in species]), [STAT_IDS[stat] for stat in stats],
+        svs.astype(np.int64), tvs.astype(np.int64), levels.astype(np.int64),
+    ).tolist() == expected
+
+    # Build a table for a few species, cache it, and read it back
+    module = sys.modules[__name__]
+    monkeypatch.setattr(static, 'USE_CACHE', True)
+    monkeypatch.setattr(module, 'species_data', lambda: (names[:3], base_stats[:3]))
+    monkeypatch.setattr(module, '_STAT_TABLE', None)
+    path = str(tmp_path / 'stats.npz')
+    table = level_stat_table(path)
+    assert table.shape == (3, len(STAT_ORDER), MAX_SVS + 1, MAX_STAT_TVS + 1)
+    for i, stat, sv, tv, _ in cases[:200]:
+        if i < 3:
+            assert table[i, STAT_IDS[stat], sv, tv] == calc_stat(
+                stat, base_stats[i, STAT_IDS[stat]], sv, tv, DEFAULT_LEVEL
+            )
+    assert np.array_equal(_read_stat_table(path, base_stats[:3]), table)
+    assert _read_stat_table(path, base_stats[:3] + 1) is None
+
+    tem = TemTem(names[1], [], '', svs={'Def': 20}, tvs={'Def': 100}, level=DEFAULT_LEVEL)
+    assert stat_table(tem, Stats.Def)[100] == tem.stats[Stats.Def]
@@ -0,0 +1,360 @@
+# vim: set fileencoding=utf-8 :
+"""
+bench.py: benchmarks for the paths we care about being fast
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+Run from the repository root:
+    python -m src.bench [--save] [--compare] [--threshold 0.15] [benchmark ...]
+
+--save stores the results as the baseline, and --compare reports the change
+from the baseline, flagging anything slower by more than the threshold (and
+exiting with status 1 if there are any).
+"""
+
+import json
+import os
+import sys
+import timeit
+
+from . import static
+from .static import Stats, lookup_attack
+from .temtem import SAMPLE_SETS, TemTem, gen_tems, split_importables
+
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+BASELINE = os.path.join('data', 'bench_baseline.json')
+DEFAULT_THRESHOLD = 0.15  # fractional slowdown that counts as a regression
+REPEAT = 5
+USAGE = __doc__.split('Run from the repository root:')[1]
+
+# {name: setup function}. Setup functions return (function to time, number of
+# operations each call does), so results can be given as ops/sec.
+BENCHMARKS: Dict[str, Callable[[], Tuple[Callable[[], None], int]]] = {}
+
+
+def benchmark(setup):
+    BENCHMARKS[setup.__name__] = setup
+    return setup
+
+
+def _sample_tems():
+    with open(SAMPLE_SETS, 'r') as fp:
+        tems = list(gen_tems(fp))
+
+    def known_moves(tem):
+        try:
+            return all(lookup_attack(move) for move in tem.moves)
+        except KeyError:
+            return False
+
+    return [tem for tem in tems if known_moves(tem)]
+
+
+def _sample_battle():
+    from .sim import Battle
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    teams = [
+        list(gen_tems(f'{GYALIS_IMPORT}\n{KINU_IMPORT}')),
+        list(gen_tems(f'{KINU_IMPORT}\n{GYALIS_IMPORT}')),
+    ]
+    for team in teams:
+        team[0].ally, team[1].ally = team[1], team[0]
+    return Battle(teams, [[0, 1], [0, 1]], 0)
+
+
+@benchmark
+def calc_damage():
+    from .calc import calc_damage
+
+    tems = _sample_tems()
+    cases = [
+        (attacker, target, move)
+        for attacker in tems for target in tems for move in attacker.moves
+    ]
+
+    def run():
+        for attacker, target, move in cases:
+            calc_damage(attacker, target, move)
+    return run, len(cases)
+
+
+@benchmark
+def n_hko():
+    from .calc import n_hko
+
+    tems = _sample_tems()
+    cases = [
+        (attacker, target, move)
+        for attacker in tems for target in tems for move in attacker.moves
+    ]
+
+    def run():
+        for attacker, target, move in cases:
+            n_hko(attacker, target, move)
+    return run, len(cases)
+
+
+@benchmark
+def temtem_init():
+    '''
+    TemTem(), with the arguments from_importable() passes it
+    '''
+    with open(SAMPLE_SETS, 'r') as fp:
+        args = [TemTem.parse_importable(lines) for _, lines in split_importables(fp)]
+
+    def run():
+        for tem_args in args:
+            TemTem(*tem_args)
+    return run, len(args)
+
+
+@benchmark
+def calc_stats():
+    tems = _sample_tems()
+
+    def run():
+        for tem in tems:
+            tem._calc_stats()
+    return run, len(tems)
+
+
+@benchmark
+def from_importable():
+    with open(SAMPLE_SETS, 'r') as fp:
+        importables = [
+            importable for importable in fp.read().split('\n\n') if importable.strip()
+        ]
+
+    def run():
+        for importable in importables:
+            TemTem.from_importable(importable)
+    return run, len(importables)
+
+
+@benchmark
+def optimise_tvs():
+    from .util import optimise_tvs
+
+    tems = _sample_tems()
+    initial_tvs = [dict(tem.tvs) for tem in tems]
+
+    def run():
+        # Includes resetting each tem, since optimising is a no-op the second time
+        for tem, tvs in zip(tems, initial_tvs):
+            tem.tvs = {stat: tvs[stat] for stat in Stats}
+            tem._calc_stats()
+            optimise_tvs(tem)
+    return run, len(tems)
+
+
+@benchmark
+def lookup_attack_cold():
+    def run():
+        saved = static.ATTACK_DATA, static.ATTACK_RESOLUTION
+        static.ATTACK_DATA = None
+        try:
+            lookup_attack('Crystal Bite')
+        finally:
+            static.ATTACK_DATA, static.ATTACK_RESOLUTION = saved
+    return run, 1
+
+
+@benchmark
+def lookup_attack_warm():
+    static.load_attack_data()
+    names = list(static.ATTACK_DATA)
+
+    def run():
+        for name in names:
+            lookup_attack(name)
+    return run, len(names)
+
+
+@benchmark
+def turn_effects():
+    '''
+    The start and end of turn phases of Battle.process_turn
+    '''
+    battle = _sample_battle()
+    initial_state = battle.snapshot()
+
+    def run():
+        battle.restore(initial_state)
+        for side, slot in battle._active_tems_by_speed():
+            battle.active_tem(side, slot).start_turn()
+        for side, slot in battle._active_tems_by_speed():
+            battle.active_tem(side, slot).end_turn(active=True)
+    return run, 1
+
+
+@benchmark
+def process_turn():
+    '''
+    A whole turn, with every tem using its first move on the tem opposite
+    '''
+    from .sim import Choice, other
+
+    battle = _sample_battle()
+    initial_state = battle.snapshot()
+    choices = [
+        [
+            Choice('attack', list(battle.active_tem(side, slot).moves)[0], [(other(side), slot)])
+            for slot in (0, 1)
+        ]
+        for side in (0, 1)
+    ]
+
+    def run():
+        battle.restore(initial_state)
+        battle.process_turn(choices)
+    return run, 1
+
+
+def time_benchmark(name: str, repeat: int = REPEAT) -> float:
+    ''' ops/sec for the named benchmark, from the best of `repeat` runs '''
+    run, ops = BENCHMARKS[name]()
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    return number * ops / min(timer.repeat(repeat, number))
+
+
+def run_benchmarks(
+    names: Optional[Iterable[str]] = None, repeat: int = REPEAT
+) -> Dict[str, Dict[str, object]]:
+    '''
+    {name: {'ops_per_sec': ops/sec}}, or {name: {'error': repr of exception}}
+    for benchmarks that fail, so one broken path doesn't stop the rest.
+    '''
+    results = {}
+    for name in names or BENCHMARKS:
+        try:
+            results[name] = {'ops_per_sec': time_benchmark(name, repeat)}
+        except Exception as err:
+            results[name] = {'error': repr(err)}
+    return results
+
+
+def compare(results, baseline, threshold: float = DEFAULT_THRESHOLD):
+    '''
+    {name: (change from baseline as a fraction, whether it's a regression)}
+    for the benchmarks that ran and have a baseline.
+    '''
+    changes = {}
+    for name, result in results.items():
+        old = baseline.get(name, {}).get('ops_per_sec')
+        new = result.get('ops_per_sec')
+        if old and new:
+            change = new / old - 1
+            changes[name] = (change, change < -threshold)
+    return changes
+
+
+def load_baseline(path: str = BASELINE):
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def save_baseline(results, path: str = BASELINE):
+    with open(path, 'w') as fp:
+        json.dump(results, fp, indent=4, sort_keys=True)
+
+
+def main(argv):
+    save = '--save' in argv
+    do_compare = '--compare' in argv
+    threshold = DEFAULT_THRESHOLD
+    if '--threshold' in argv:
+        idx = argv.index('--threshold')
+        try:
+            threshold = float(argv[idx + 1])
+        except (IndexError, ValueError):
+            print(f'--threshold needs a number\n{USAGE}', file=sys.stderr)
+            return 2
+        del argv[idx:idx + 2]
+    names = [arg for arg in argv if not arg.startswith('--')]
+    if unknown := [name for name in names if name not in BENCHMARKS]:
+        print(f'Unknown benchmarks: {", ".join(unknown)}', file=sys.stderr)
+        return 2
+
+    baseline = None
+    if do_compare:
+        try:
+            baseline = load_baseline()
+        except FileNotFoundError:
+            print(
+                f'No baseline to compare with at {BASELINE}, run with --save first',
+                file=sys.stderr,
+            )
+            return 2
+
+    results = run_benchmarks(names)
+    changes = {}
+    if baseline is not None:
+        changes = compare(results, baseline, threshold)
+
+    for name, result in results.items():
+        if 'error' in result:
+            print(f'{name:20} failed: {result["error"]}')
+            continue
+        line = f'{name:20} {result["ops_per_sec"]:14,.0f} ops/sec'
+        if name in changes:
+            change, regressed = changes[name]
+            line += f'  {change:+7.1%}' + ('  REGRESSION' if regressed else '')
+        print(line)
+
+    if save:
+        save_baseline(results)
+    return int(any(regressed for _, regressed in changes.values()))
+
+
+# Tests
+def test_benchmarks():
+    for setup in BENCHMARKS.values():
+        run, ops = setup()
+        assert ops > 0
+        run()
+
+
+def test_compare():
+    baseline = {'a': {'ops_per_sec': 100.0}, 'b': {'ops_per_sec': 100.0}, 'c': {'error': ''}}
+    results = {
+        'a': {'ops_per_sec': 80.0},
+        'b': {'ops_per_sec': 95.0},
+        'c': {'ops_per_sec': 1.0},
+        'd': {'ops_per_sec': 1.0},
+    }
+    changes = compare(results, baseline, threshold=0.1)
+    assert changes.keys() == {'a', 'b'}
+    assert changes['a'][1] and not changes['b'][1]
+
+
+def test_compare_without_baseline(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)  # BASELINE is relative, so there's none here
+    assert main(['--compare']) == 2
+    assert 'run with --save first' in capsys.readouterr().err
+    for argv in (['--threshold'], ['--threshold', 'calc_damage']):
+        assert main(argv) == 2
+        assert '--threshold needs a number' in capsys.readouterr().err
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    if any(arg in ('-h', '--help') for arg in argv):
+        print(USAGE)
+        sys.exit(0)
+    sys.exit(main(argv))
@@ -19,9 +19,12 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 from .static import (
+    COMBO_EFFECTIVENESS,
+    PHYSICAL,
+    STATUS,
     Statuses,
     Types,
-    TYPE_EFFECTIVENESS,
+    TYPE_IDS,
     lookup_attack,
 )
 from .temtem import TemTem
@@ -46,22 +49,23 @@ def calc_damage(
     if isinstance(attack, str):
         attack = lookup_attack(attack)
 
-    if (cls := attack['class']) == 'Status':
+    if (cls := attack.class_id) == STATUS:
         return 0
-    elif cls == 'Physical':
+    elif cls == PHYSICAL:
         atk = attacker.Atk
         df = target.Def
     else:
         atk = attacker.SpA
         df = target.SpD
 
-    damage = (attacker.level * attack['damage'] * atk) / (200 * df) + 7
-    damage *= effectiveness(attack['type'], target)
+    damage = (attacker.level * attack.damage * atk) / (200 * df) + 7
+    if not target.nullified:
+        damage *= COMBO_EFFECTIVENESS[attack.type_id][target.type_combo]
     damage *= modifiers
 
-    stab = 1.5 if attack['type'] in attacker.types else 1.0
+    stab = 1.5 if attack.type in attacker.types else 1.0
 
-    if attack['name'] == 'Hyperkinetic Strike':
+    if attack.name == 'Hyperkinetic Strike':
         # Currently modifiers above here in the code aren't included in the
         # game, but this is a bug. I'm informed the move should also use ceil
         # rather than floor, and 64 for the base damge of this part.
@@ -78,13 +82,7 @@ def effectiveness(attack_type: Types, target: TemTem) -> float:
     if target.nullified:
         return 1.0
 
-    return (
-        TYPE_EFFECTIVENESS[attack_type][target.types[0]]
-        * (
-            TYPE_EFFECTIVENESS[attack_type][target.types[1]]
-            if target.types[1] else 1.0
-        )
-    )
+    return COMBO_EFFECTIVENESS[TYPE_IDS[attack_type]][target.type_combo]
 
 
 def n_hko(
@@ -21,6 +21,13 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 from .static import Statuses, Stats
 
 
+# Outcome flags, returned by Effect.apply_outcome() instead of raising the
+# exceptions below, which are slow when simulating lots of battles.
+STATUS_PREVENTED = 1  # DontApplyStatus
+UNAFFECTED = 2  # Unaffected
+REDIRECT_TO_ALLY = 4  # RedirectAttack('ally')
+
+
 class DontApplyStatus(Exception):
     pass
 
@@ -35,6 +42,70 @@ class Unaffected(Exception):
     pass
 
 
+# Effects on a tem's current HP and stamina, either as a fraction of its
+# maximum or an absolute amount. A plain Stats.HP or Stats.Sta could mean
+# either, so isn't accepted.
+HP_FRACTION = 'HP fraction'
+HP_AMOUNT = 'HP amount'
+STA_FRACTION = 'Sta fraction'
+STA_AMOUNT = 'Sta amount'
+_HP_STA_EFFECTS = {
+    HP_FRACTION: (Stats.HP, True),
+    HP_AMOUNT: (Stats.HP, False),
+    STA_FRACTION: (Stats.Sta, True),
+    STA_AMOUNT: (Stats.Sta, False),
+}
+
+
+def _apply_effect(tem, effect, count):
+    """
+    Returns whether a status was prevented (or removed).
+    """
+    from .gear import NoGear
+    if effect in _HP_STA_EFFECTS:
+        stat, fraction = _HP_STA_EFFECTS[effect]
+        top = tem.max_hp if stat == Stats.HP else tem.max_sta
+        amount = round(count * top) if fraction else count
+        if stat == Stats.HP:
+            tem.take_damage(-amount)
+        else:
+            tem.Sta = max(0, min(top, tem.Sta + amount))
+
+    elif effect in (Stats.HP, Stats.Sta):
+        raise ValueError(
+            f'Effect {effect!r} must be an {effect.name} fraction or {effect.name} amount'
+        )
+
+    elif isinstance(effect, Stats):
+        tem.apply_boost(effect, count)
+
+    elif isinstance(effect, Statuses):
+        if count < 1:  # remove this status
+            if tem.remove_status(effect) and effect == Statuses.asleep:
+                tem.apply_status(Statuses.alerted, 2)
+            return True
+        else:
+            tem.apply_status(effect, count)
+
+    else:
+        # Unusual effects, handling e.g. strangle
+        if effect == 'trait counter':
+            tem.trait_counter = count
+        elif effect == 'remove gear':
+            tem.gear = NoGear
+        elif effect == 'overexerted':
+            tem.overexerted = 2  # equal to "used up all its stamina this turn"
+        elif effect == 'clear boosts':
+            tem.clear_boosts()
+        elif effect == 'remove statuses':
+            for status in list(tem.statuses):
+                tem.remove_status(status)
+        else:
+            raise NotImplementedError(f'Effect {effect!r}')
+
+    return False
+
+
 class Effect:
     def __init__(
         self,
@@ -44,12 +115,16 @@ class Effect:
         ally={},
         opposing_team={},
         damage=1,
+        outcome=0,
     ):
         self.attacker = attacker
         self.target = target
         self.ally = ally
         self.opposing_team = opposing_team
         self.damage = damage
+        # Handlers return an Effect with UNAFFECTED or REDIRECT_TO_ALLY set
+        # rather than raising Unaffected or RedirectAttack
+        self.outcome = outcome
 
     def __repr__(self):
         res = ''
@@ -63,9 +138,11 @@ class Effect:
                 res += f' {name}: {str(var)}'
         if self.damage != 1:
             res += f' damage: {self.damage}'
+        if self.outcome:
+            res += f' outcome: {self.outcome}'
         return f'<Effect{res}>'
 
-    def apply(
+    def apply_outcome(
         self,
         attacker=None,
         target=None,
@@ -73,61 +150,49 @@ class Effect:
         opposing_team=None,
         damage=1,
     ):
-        from contextlib import suppress
-
-        def apply_effect(tem, effect, count):
-            from .gear import NoGear
-            if effect in Stats:
-                tem.apply_boost(effect, count)
-
-            elif effect in Statuses:
-                if count < 1:  # remove this status
-                    with suppress(KeyError):
-                        del tem.statuses[effect]
-                        if effect == Statuses.asleep:
-                            tem.apply_status(Statuses.alerted, 2)
-                            # The above doesn't trigger if tem wasn't asleep
-                            # due to the KeyError
-                    raise DontApplyStatus()
-                else:
-                    if effect in (Stats.HP, Stats.Sta):
-                        raise NotImplementedError()
-                    tem.apply_status(effect, count)
-
-            else:
-                # Unusual effects, handling e.g. strangle
-                if effect == 'trait counter':
-                    tem.trait_counter = count
-                elif effect == 'remove gear':
-                    tem.gear = NoGear
-                elif effect == 'overexerted':
-                    tem.overexerted = 2  # equal to "used up all its stamina this turn"
-                elif effect == 'clear boosts':
-                    tem.clear_boosts()
-                else:
-                    raise NotImplementedError()
-
-        no_status = False
+        """
+        Apply the effect, returning (damage, outcome flags) rather than
+        raising exceptions like apply() does.
+        """
+        outcome = self.outcome
         for effects, tem in (
             (self.attacker, attacker),
             (self.target, target),
             (self.ally, ally),
         ):
+            if tem is None:  # e.g. no ally
+                continue
             for effect, count in effects.items():
-                try:
-                    apply_effect(tem, effect, count)
-                except DontApplyStatus:
-                    no_status = True
+                if _apply_effect(tem, effect, count):
+                    outcome |= STATUS_PREVENTED
 
         if self.opposing_team:
             for tem in opposing_team:
-                for effect, count in effects.items():
-                    apply_effect(tem, effect, count)
+                if tem is None:
+                    continue
+                for effect, count in self.opposing_team.items():
+                    _apply_effect(tem, effect, count)
 
-        if no_status:
-            raise DontApplyStatus()
+        return damage * self.damage, outcome
 
-        return damage * self.damage
+    def apply(
+        self,
+        attacker=None,
+        target=None,
+        ally=None,
+        opposing_team=None,
+        damage=1,
+    ):
+        damage, outcome = self.apply_outcome(
+            attacker=attacker,
+            target=target,
+            ally=ally,
+            opposing_team=opposing_team,
+            damage=damage,
+        )
+        if outcome:
+            raise_outcome(outcome)
+        return damage
 
     def prevents_status(self, status):
         try:
@@ -136,10 +201,28 @@ class Effect:
             return False
 
 
+def raise_outcome(outcome):
+    """
+    Raise the exception that the old, exception-based API used for outcome.
+    """
+    if outcome & UNAFFECTED:
+        raise Unaffected()
+    if outcome & REDIRECT_TO_ALLY:
+        raise RedirectAttack('ally')
+    if outcome & STATUS_PREVENTED:
+        raise DontApplyStatus()
+
+
 no_effect = Effect()
+unaffected = Effect(outcome=UNAFFECTED)
+redirect_to_ally = Effect(outcome=REDIRECT_TO_ALLY)
 
 
 class EffectHandler:
+    # The names of the callbacks below that a subclass overrides, filled in
+    # by register_hooks(). The battle engine only calls these.
+    hooks = frozenset()
+
     # callback functions
     @staticmethod
     def on_switch_in(target):
@@ -198,6 +281,28 @@ class EffectHandler:
         return no_effect
 
 
+# The names of all EffectHandler callbacks, and {callback: handlers that
+# override it} for every registered handler.
+HOOKS = tuple(
+    name for name, value in vars(EffectHandler).items() if isinstance(value, staticmethod)
+)
+HOOK_HANDLERS = {hook: set() for hook in HOOKS}
+
+
+def register_hooks(cls):
+    """
+    Record which callbacks cls overrides, so that calls to the rest can be
+    skipped entirely. This is done when traits and gear are registered with
+    @trait and @gear.
+    """
+    cls.hooks = frozenset(
+        hook for hook in HOOKS if getattr(cls, hook) is not getattr(EffectHandler, hook)
+    )
+    for hook in cls.hooks:
+        HOOK_HANDLERS[hook].add(cls)
+    return cls
+
+
 class Trait(EffectHandler):
     # Defined for both readability and isinstance()
     pass
@@ -216,3 +321,61 @@ def string_to_class_name(inpt):
     if not inpt:
         return ''
     return inpt.replace(' ', '').replace('-', '').replace("'", '')
+
+
+# Tests
+def test_register_hooks():
+    from .gear import FireChip, NoGear
+    from .traits import Aerobic, NoTrait
+
+    assert len(HOOKS) == 14
+    assert FireChip.hooks == {'on_attack'}
+    assert Aerobic.hooks == {'on_attack', 'on_turn_end'}
+    assert NoGear.hooks == NoTrait.hooks == frozenset()
+    assert Aerobic in HOOK_HANDLERS['on_turn_end']
+    assert FireChip not in HOOK_HANDLERS['on_turn_end']
+
+
+def test_apply_outcome():
+    from pytest import raises
+    from .static import Types
+    from .temtem import TemTem
+    from .test_data import KINU_IMPORT
+    from .traits import Friendship, WaterCustodian
+
+    kinu = TemTem.from_importable(KINU_IMPORT)
+    cure_burn = Effect(target={Statuses.burned: -1}, damage=0.5)
+    assert cure_burn.apply_outcome(target=kinu, damage=2) == (1, STATUS_PREVENTED)
+    with raises(DontApplyStatus):
+        cure_burn.apply(target=kinu)
+    assert Effect(target={Stats.Spe: 1}).apply(target=kinu) == 1
+
+    kinu.ally = kinu
+    assert Friendship.on_hit(kinu, kinu, {}).outcome == UNAFFECTED
+    with raises(Unaffected):
+        unaffected.apply()
+    with raises(RedirectAttack):
+        redirect_to_ally.apply()
+    assert WaterCustodian.on_ally_hit(kinu, kinu, {'type': Types.water}) is redirect_to_ally
+
+
+def test_hp_sta_effects():
+    from pytest import raises
+    from .static import lookup_attack
+    from .temtem import TemTem
+    from .test_data import KINU_IMPORT
+
+    kinu = TemTem.from_importable(KINU_IMPORT)
+    kinu.take_damage(kinu.max_hp - 1)
+    Effect(target={HP_AMOUNT: 1}).apply(target=kinu)
+    assert kinu.HP == 2
+    Effect(target={HP_FRACTION: 1}).apply(target=kinu)  # an int fraction is still a fraction
+    assert kinu.HP == kinu.max_hp
+    Effect(target={STA_AMOUNT: -5}).apply(target=kinu)
+    assert kinu.Sta == kinu.max_sta - 5
+    with raises(ValueError):
+        Effect(target={Stats.HP: 1}).apply(target=kinu)
+
+    # attacks.yaml gives fractions, unless marked as an amount
+    assert lookup_attack('Autodestruction').effects.attacker == {HP_FRACTION: -1}
+    assert lookup_attack('Willpower Drain').effects.target == {STA_AMOUNT: -23}
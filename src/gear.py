@@ -20,7 +20,15 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from .static import Statuses, Stats, Types
 from .calc import effectiveness
-from .effects import Effect, Gear, no_effect, string_to_class_name
+from .effects import (
+    HP_AMOUNT,
+    STA_AMOUNT,
+    Effect,
+    Gear,
+    no_effect,
+    register_hooks,
+    string_to_class_name,
+)
 from .temtem import TemTem
 
 from typing import Type, Dict, Any
@@ -34,7 +42,7 @@ _ALL_GEAR = {}
 def gear(cls: Type[Gear]) -> Type[Gear]:
     global _ALL_GEAR
     _ALL_GEAR[cls.__name__] = cls
-    return cls
+    return register_hooks(cls)
 
 
 def lookup_gear(name: str, /) -> Gear:
@@ -84,7 +92,7 @@ class Pillow(Gear):
     @staticmethod
     def on_turn_start(target: TemTem) -> Effect:
         if target.asleep:
-            return Effect(target={Stats.HP: target.max_hp // 10})
+            return Effect(target={HP_AMOUNT: target.max_hp // 10})
         return no_effect
 
 
@@ -146,7 +154,7 @@ class RockShield(Gear):
 class Sweatband(Gear):
     @staticmethod
     def on_turn_start(target: TemTem) -> Effect:
-        return Effect(target={Stats.Sta: int(target.max_sta * 0.15)})
+        return Effect(target={STA_AMOUNT: int(target.max_sta * 0.15)})
 
 
 @gear
@@ -253,7 +261,7 @@ class Drill(Gear):
 class BatonPass(Gear):
     @staticmethod
     def on_switch_in(target: TemTem) -> Effect:
-        return Effect(target={Stats.HP: target.max_hp // 10})
+        return Effect(target={HP_AMOUNT: target.max_hp // 10})
 
 # TODO: hopeless tonic
 
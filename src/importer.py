@@ -0,0 +1,96 @@
+# vim: set fileencoding=utf-8 :
+"""
+importer.py: stream large numbers of sets in
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from .temtem import TemTem, TemTemBase, log_import_error, split_importables
+
+from typing import Callable, Iterable, Iterator, List, Type
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def import_sets(
+    inpt: Iterable[str],
+    tem_class: Type[TemTemBase] = TemTem,
+    on_error: Callable[[int, List[str], Exception], None] = log_import_error,
+) -> Iterator[TemTemBase]:
+    '''
+    Like gen_tems(), but reports sets that can't be parsed to on_error(line
+    number, lines, exception) rather than just logging them.
+
+    inpt is read lazily, e.g. an open file, and tems are yielded as they're
+    parsed, so memory use doesn't grow with the size of the input as long as
+    the caller doesn't keep the tems.
+
+    Sets aren't parsed in worker processes: building a tem is most of the
+    work, and tems built elsewhere don't share this process's movesets,
+    strings and base stats. Rebuilding them here from what a worker sends
+    back costs about half as much as parsing them, so a pool was slower than
+    this at every size tried.
+    '''
+    if isinstance(inpt, str):
+        inpt = inpt.split('\n')
+    for line_no, lines in split_importables(inpt):
+        try:
+            tem = tem_class.from_importable(lines)
+        except Exception as err:
+            on_error(line_no, lines, err)
+        else:
+            yield tem
+
+
+def import_file(path: str, **kwargs) -> Iterator[TemTemBase]:
+    '''
+    import_sets() on the file at path. Takes the same keyword arguments.
+    '''
+    with open(path, 'r') as fp:
+        yield from import_sets(fp, **kwargs)
+
+
+# Tests
+def test_import_sets():
+    from .static import lookup_temtem_data
+    from .temtem import CompactTemTem, SAMPLE_SETS, _moveset_index, gen_tems
+
+    with open(SAMPLE_SETS, 'r') as fp:
+        lines = fp.read().split('\n')
+    # Break a set part way through the file
+    broken_at = lines.index('', len(lines) // 2) + 1
+    lines[broken_at] = 'Notatem'
+    with_error = '\n'.join(lines)
+
+    expected = list(gen_tems(with_error))
+    errors = []
+    tems = list(import_sets(with_error, on_error=lambda *error: errors.append(error)))
+    assert tems == expected
+    assert [(line_no, lines[0]) for line_no, lines, _ in errors] == [
+        (broken_at + 1, 'Notatem')
+    ]
+
+    compact = list(import_file(SAMPLE_SETS, tem_class=CompactTemTem))
+    assert all(isinstance(tem, CompactTemTem) for tem in compact)
+    with open(SAMPLE_SETS, 'r') as fp:
+        assert compact == list(gen_tems(fp))
+    # They share this process's movesets and base stats
+    assert all(
+        tem._moves is _moveset_index(tem.moves)
+        and tem.base_stats is lookup_temtem_data(tem.species)['Stats']
+        for tem in compact
+    )
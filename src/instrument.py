@@ -0,0 +1,257 @@
+# vim: set fileencoding=utf-8 :
+"""
+instrument.py: count and time calls in the battle engine
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+
+from collections import defaultdict
+from functools import wraps
+from time import perf_counter
+
+from typing import Callable, Dict, List, Optional, TextIO, Tuple
+
+
+class Profiler:
+    '''
+    Records call counts and cumulative time for the parts of the engine that
+    usually dominate a slow simulation:
+     - every trait and gear hook, named 'hook.<hook>.<trait or gear class>'
+     - 'Effect.apply_outcome' (which Effect.apply uses), 'calc_damage',
+        'TemTem.start_turn' and 'TemTem.end_turn' (including statuses)
+     - each phase of a turn (start, actions and end), named 'phase.<phase>',
+        for battles given this profiler with Battle.start_profile()
+
+    Nothing is instrumented until enable(), which wraps the functions above,
+    and disable() puts back the originals, so there's no cost otherwise. Use
+    it as a context manager to do both:
+
+        with Profiler() as profiler:
+            battle.start_profile(profiler)
+            ...
+        print(profiler.dump())
+
+    Times are inclusive, e.g. TemTem.end_turn includes the hooks it calls.
+    Only one profiler can be enabled at a time.
+    '''
+
+    _enabled = None  # the currently enabled profiler, if any
+
+    def __init__(self):
+        # {name: [calls, seconds]}
+        self.counters: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self._patches: List[Tuple[object, str, Optional[object]]] = []
+        self._phase = None
+        self._phase_start = 0.0
+        self._handler_kinds: Dict[str, str] = {}  # {handler name: 'trait' or 'gear'}
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def record(self, name: str, seconds: float, calls: int = 1):
+        counter = self.counters[name]
+        counter[0] += calls
+        counter[1] += seconds
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        ''' func, but recording its calls under name '''
+        counter = self.counters[name]
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += perf_counter() - start
+
+        return timed
+
+    def _patch(self, owner, attr, name, static=False):
+        original = owner.__dict__.get(attr)
+        func = getattr(owner, attr)
+        wrapped = self.wrap(name, func)
+        setattr(owner, attr, staticmethod(wrapped) if static else wrapped)
+        self._patches.append((owner, attr, original))
+
+    def enable(self):
+        from . import calc
+        from .effects import HOOK_HANDLERS, Effect, Trait
+        from .temtem import TemTemBase
+
+        if Profiler._enabled is not None:
+            raise RuntimeError('Another Profiler is already enabled')
+        Profiler._enabled = self
+
+        for hook, handlers in HOOK_HANDLERS.items():
+            for handler in handlers:
+                self._patch(handler, hook, f'hook.{hook}.{handler.__name__}', static=True)
+        self._patch(Effect, 'apply_outcome', 'Effect.apply_outcome')
+        self._patch(calc, 'calc_damage', 'calc_damage')
+        self._patch(TemTemBase, 'start_turn', 'TemTem.start_turn')
+        self._patch(TemTemBase, 'end_turn', 'TemTem.end_turn')
+        self._handler_kinds = {
+            handler.__name__: 'trait' if issubclass(handler, Trait) else 'gear'
+            for handlers in HOOK_HANDLERS.values() for handler in handlers
+        }
+
+    def disable(self):
+        if Profiler._enabled is not self:
+            return
+        # In reverse, in case anything was patched twice
+        for owner, attr, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self._patches = []
+        Profiler._enabled = None
+
+    def phase(self, phase: Optional[str]):
+        '''
+        End the current turn phase, if any, and start timing phase (or none,
+        at the end of a turn). Called by Battle.process_turn.
+        '''
+        now = perf_counter()
+        if self._phase is not None:
+            self.record(f'phase.{self._phase}', now - self._phase_start)
+        self._phase, self._phase_start = phase, now
+
+    def stats(self) -> List[Tuple[str, int, float]]:
+        ''' (name, calls, seconds) for everything recorded, slowest first '''
+        return sorted(
+            ((name, int(calls), seconds) for name, (calls, seconds) in self.counters.items()
+             if calls),
+            key=lambda stat: stat[2],
+            reverse=True,
+        )
+
+    def _group(self, key):
+        groups = defaultdict(lambda: [0, 0.0])
+        for name, calls, seconds in self.stats():
+            if name.startswith('hook.'):
+                group = groups[key(*name.split('.')[1:])]
+                group[0] += calls
+                group[1] += seconds
+        return {name: tuple(group) for name, group in groups.items()}
+
+    def by_hook(self) -> Dict[str, Tuple[int, float]]:
+        ''' {hook: (calls, seconds)}, over all traits and gear '''
+        return self._group(lambda hook, handler: hook)
+
+    def by_handler(self) -> Dict[str, Tuple[int, float]]:
+        ''' {'trait.<name>' or 'gear.<name>': (calls, seconds)}, over all hooks '''
+        return self._group(lambda hook, handler: f'{self._handler_kinds[handler]}.{handler}')
+
+    def to_dict(self) -> dict:
+        def as_dict(stats):
+            return {
+                name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in stats
+            }
+
+        return {
+            'calls': as_dict((name, (calls, seconds)) for name, calls, seconds in self.stats()),
+            'hooks': as_dict(self.by_hook().items()),
+            'handlers': as_dict(self.by_handler().items()),
+        }
+
+    def dump(self, fp: Optional[TextIO] = None, as_json: bool = False) -> str:
+        '''
+        The stats as a table (or JSON), slowest first, also written to fp if
+        given.
+        '''
+        if as_json:
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            lines = [f'{"name":<48} {"calls":>10} {"total ms":>10} {"per call us":>12}']
+            for title, stats in (
+                ('', [(name, (calls, seconds)) for name, calls, seconds in self.stats()]),
+                ('by hook', self.by_hook().items()),
+                ('by trait/gear', self.by_handler().items()),
+            ):
+                if title:
+                    lines.append(f'-- {title}')
+                for name, (calls, seconds) in sorted(stats, key=lambda s: -s[1][1]):
+                    lines.append(
+                        f'{name:<48} {calls:>10} {seconds * 1e3:>10.3f} '
+                        f'{seconds / calls * 1e6:>12.2f}'
+                    )
+            text = '\n'.join(lines) + '\n'
+        if fp is not None:
+            fp.write(text)
+        return text
+
+
+# Tests
+def test_profiler():
+    from io import StringIO
+    from . import calc
+    from .effects import Effect
+    from .gear import Pillow
+    from .sim import Battle
+    from .static import Statuses
+    from .temtem import TemTem, TemTemBase, gen_tems
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+    from .traits import Aerobic
+
+    originals = (
+        Aerobic.__dict__['on_turn_end'], Pillow.__dict__['on_turn_start'],
+        Effect.apply_outcome, calc.calc_damage, TemTemBase.end_turn,
+    )
+
+    kinu = TemTem.from_importable(KINU_IMPORT)
+    kinu.trait, kinu.gear = Aerobic, Pillow
+    with Profiler() as profiler:
+        kinu.start_turn()
+        kinu.apply_status(Statuses.burned, 2)
+        kinu.end_turn(active=True)
+        kinu.end_turn(active=True)
+        calc.calc_damage(kinu, kinu, 'Beta Burst')
+
+        battle = Battle([list(gen_tems(GYALIS_IMPORT)), list(gen_tems(KINU_IMPORT))],
+                        [[0], [0]], 0)
+        battle.start_profile(profiler)
+        battle.process_turn([[None], [None]])
+
+    counters = profiler.counters
+    assert counters['hook.on_turn_end.Aerobic'][0] == 2
+    assert counters['hook.on_turn_start.Pillow'][0] == 1
+    assert counters['TemTem.end_turn'][0] == 2 + 2  # kinu, then both tems in the battle
+    assert counters['TemTem.start_turn'][0] == 1 + 2
+    assert counters['calc_damage'][0] == 1
+    assert counters['phase.start'][0] == counters['phase.end'][0] == 1
+    assert profiler.by_hook()['on_turn_end'][0] == 2
+    assert profiler.by_handler()['gear.Pillow'][0] == 1
+    assert profiler.by_handler()['trait.Aerobic'][0] == 2
+
+    # Everything is put back afterwards
+    assert originals == (
+        Aerobic.__dict__['on_turn_end'], Pillow.__dict__['on_turn_start'],
+        Effect.apply_outcome, calc.calc_damage, TemTemBase.end_turn,
+    )
+    assert 'end_turn' not in TemTem.__dict__
+
+    fp = StringIO()
+    assert 'hook.on_turn_end.Aerobic' in profiler.dump(fp)
+    assert fp.getvalue() == profiler.dump()
+    assert json.loads(profiler.dump(as_json=True))['handlers']['trait.Aerobic']['calls'] == 2
@@ -0,0 +1,257 @@
+# vim: set fileencoding=utf-8 :
+"""
+montecarlo.py: play many battles between two teams, in parallel
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+
+from .rng import Rng, battle_rng
+from .sim import Battle, Choice, other
+from .static import lookup_attack, shared_pool_kwargs
+from .temtem import gen_tems
+
+from typing import Callable, List, Optional
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_TURNS = 100
+
+
+def random_attacks(battle: Battle, side: int, rng: Rng) -> List[Choice]:
+    '''
+    The default policy: each active tem uses a random move that's ready,
+    against a random opposing tem, or rests if no move is ready.
+    '''
+    targets = [
+        (other(side), slot) for slot in (0, 1)
+        if battle.active_tem(other(side), slot) is not None
+    ]
+    choices = []
+    for slot in range(len(battle.active[side])):
+        tem = battle.active_tem(side, slot)
+        if tem is None:
+            choices.append(None)
+            continue
+        ready = [
+            move for move, hold in tem.moves.items() if hold >= lookup_attack(move).hold
+        ]
+        if not ready or not targets:
+            choices.append(Choice('rest'))
+            continue
+        choices.append(Choice('attack', rng.choice(ready), [rng.choice(targets)]))
+    return choices
+
+
+class MatchupResult:
+    '''
+    Aggregated outcomes of battles between teams 0 and 1.
+    '''
+
+    def __init__(self):
+        self.battles = 0
+        self.wins = [0, 0]
+        self.unfinished = 0  # hit max_turns
+        self.errors = Counter()  # {repr of exception: count}
+        self.turns = Counter()  # {turn count: battles}, for finished battles
+        self.kos = [Counter(), Counter()]  # per side, {tems KO'd: battles}
+
+    def __repr__(self):
+        return (
+            f'<MatchupResult {self.battles} battles: {self.wins[0]}-{self.wins[1]}, '
+            f'{self.unfinished} unfinished, {sum(self.errors.values())} errors>'
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, MatchupResult):
+            return NotImplemented
+        return vars(self) == vars(other)
+
+    def add(self, outcome):
+        winner, turns, kos, error = outcome
+        self.battles += 1
+        if error is not None:
+            self.errors[error] += 1
+            return
+        if winner is None:
+            self.unfinished += 1
+        else:
+            self.wins[winner] += 1
+            self.turns[turns] += 1
+        for side in (0, 1):
+            self.kos[side][kos[side]] += 1
+
+    def win_rate(self, side: int = 0) -> float:
+        decided = sum(self.wins)
+        return self.wins[side] / decided if decided else 0.0
+
+    def mean_turns(self) -> float:
+        finished = sum(self.turns.values())
+        if not finished:
+            return 0.0
+        return sum(turns * count for turns, count in self.turns.items()) / finished
+
+    def mean_kos(self, side: int) -> float:
+        battles = sum(self.kos[side].values())
+        if not battles:
+            return 0.0
+        return sum(kos * count for kos, count in self.kos[side].items()) / battles
+
+
+def _new_battle(teams):
+    battle = Battle(teams, [list(range(min(2, len(team)))) for team in teams], 0)
+    for team in teams:
+        if len(team) > 1:
+            team[0].ally, team[1].ally = team[1], team[0]
+    return battle
+
+
+def _play(battle, rng, choose, max_turns):
+    # Each battle gets its own stream (see rng.battle_rng), so results don't
+    # depend on how battles are split between workers
+    battle.rng = rng
+    battle.speed_arrow = rng.integers(2)
+    try:
+        for turn in range(1, max_turns + 1):
+            battle.process_turn([choose(battle, side, rng) for side in (0, 1)])
+            if battle.winner is not None:
+                break
+        else:
+            turn = max_turns
+    except NotImplementedError as err:
+        # A mechanic the simulator doesn't have yet, so the battle can't go on
+        return None, 0, (0, 0), repr(err)
+
+    kos = tuple(sum(tem.fainted for tem in team) for team in battle.teams)
+    return battle.winner, turn, kos, None
+
+
+def _run_chunk(importables, seed, start, stop, choose, max_turns):
+    # Teams are only built once per chunk, then reset between battles
+    teams = [list(gen_tems(importable)) for importable in importables]
+    battle = _new_battle(teams)
+    initial_state = battle.snapshot()
+
+    outcomes = []
+    for battle_no in range(start, stop):
+        battle.restore(initial_state)
+        outcomes.append(_play(battle, battle_rng(seed, battle_no), choose, max_turns))
+    return outcomes
+
+
+def run_matchup(
+    team0: str,
+    team1: str,
+    battles: int,
+    seed: int = 0,
+    choose: Callable[[Battle, int, Rng], List[Choice]] = random_attacks,
+    processes: Optional[int] = None,
+    max_turns: int = DEFAULT_MAX_TURNS,
+    chunk_size: Optional[int] = None,
+) -> MatchupResult:
+    '''
+    Play `battles` battles between two teams (given in the importable
+    format), spread over a pool of `processes` worker processes (default: one
+    per core, or run in this process if processes is 0 or 1).
+
+    choose(battle, side, rng) picks the choices for one side each turn. It
+    must be picklable, i.e. a module-level function, to be sent to workers.
+
+    For a given seed, the result is the same whatever the number of processes
+    or chunk size.
+    '''
+    importables = (team0, team1)
+    processes = os.cpu_count() if processes is None else processes
+    if chunk_size is None:
+        # A few chunks per worker evens out the load, while keeping the
+        # per-chunk overhead of building teams and pickling small
+        chunk_size = max(1, ceil(battles / (4 * max(processes, 1))))
+    chunks = [
+        (start, min(start + chunk_size, battles))
+        for start in range(0, battles, chunk_size)
+    ]
+
+    result = MatchupResult()
+    if processes <= 1:
+        for start, stop in chunks:
+            for outcome in _run_chunk(importables, seed, start, stop, choose, max_turns):
+                result.add(outcome)
+        return result
+
+    with ProcessPoolExecutor(max_workers=processes, **shared_pool_kwargs()) as pool:
+        futures = [
+            pool.submit(_run_chunk, importables, seed, start, stop, choose, max_turns)
+            for start, stop in chunks
+        ]
+        for future in futures:
+            for outcome in future.result():
+                result.add(outcome)
+    return result
+
+
+# Tests
+def _run_away(battle, side, rng):
+    return [Choice('run') for _ in battle.active[side]]
+
+
+def test_run_matchup():
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    team0 = f'{GYALIS_IMPORT}\n{KINU_IMPORT}'
+    team1 = f'{KINU_IMPORT}\n{GYALIS_IMPORT}'
+
+    result = run_matchup(team0, team1, 6, seed=3, processes=1, max_turns=5)
+    assert result.battles == 6
+    assert result == run_matchup(team0, team1, 6, seed=3, processes=2, chunk_size=2, max_turns=5)
+
+    # Battles are played to the end: a mirror matchup is close, and two tems
+    # beat one almost every time
+    result = run_matchup(team0, team1, 40, seed=3, processes=1)
+    assert not result.errors and sum(result.wins) + result.unfinished == 40
+    assert 0.3 < result.win_rate(0) < 0.7
+    assert result.mean_turns() > 1
+    assert result.kos[0][2] + result.kos[1][2] == sum(result.wins)
+    result = run_matchup(team0, KINU_IMPORT, 40, seed=3, processes=1)
+    assert not result.errors and result.win_rate(0) > 0.9
+
+    # Mechanics that aren't simulated yet end the battle as an error
+    result = run_matchup(team0, team1, 3, processes=1, choose=_run_away)
+    assert result.errors == {'NotImplementedError()': 3}
+    assert result.wins == [0, 0] and not result.unfinished
+
+
+def test_matchup_result():
+    result = MatchupResult()
+    for outcome in (
+        (0, 4, (1, 2), None),
+        (0, 6, (0, 2), None),
+        (1, 4, (2, 1), None),
+        (None, 100, (1, 1), None),
+        (None, 0, (0, 0), 'NotImplementedError()'),
+    ):
+        result.add(outcome)
+    assert result.battles == 5
+    assert result.wins == [2, 1] and result.unfinished == 1
+    assert result.errors == {'NotImplementedError()': 1}
+    assert result.win_rate(0) == 2 / 3 and result.win_rate(1) == 1 / 3
+    assert result.mean_turns() == (4 + 6 + 4) / 3
+    assert result.mean_kos(1) == (2 + 2 + 1 + 1) / 4
@@ -0,0 +1,222 @@
+# vim: set fileencoding=utf-8 :
+"""
+query.py: indexes over the temtem data, for quickly finding species
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from . import static
+from .static import DEFAULT_LEVEL, Stats, Types
+
+from typing import Dict, FrozenSet, Iterable, Optional, Union
+
+NOTHING = frozenset()
+
+
+class TemTemIndex:
+    """
+    Reverse indexes over TEMTEM_DATA, built on first use as static.TEMTEM_INDEX:
+    - learnsets: {species: every move it can learn}
+    - learners: {move: species that learn it}
+    - traits: {trait: species that can have it}
+    - types: {type: species of that type}
+    - stats: {stat: (base stats in ascending order, species in the same order)}
+    """
+
+    def __init__(self, data: Dict[str, Dict]):
+        learners = defaultdict(set)
+        traits = defaultdict(set)
+        types = defaultdict(set)
+        self.learnsets = {}
+
+        for species, tem_data in data.items():
+            learnset = frozenset(
+                move for moves in tem_data['Moves'].values() for move in moves
+            )
+            self.learnsets[species] = learnset
+            for move in learnset:
+                learners[move].add(species)
+            for trait in tem_data['Traits']:
+                traits[trait].add(species)
+            for type_ in tem_data['Types']:
+                if type_:
+                    types[type_].add(species)
+
+        self.learners = {move: frozenset(tems) for move, tems in learners.items()}
+        self.traits = {trait: frozenset(tems) for trait, tems in traits.items()}
+        self.types = {type_: frozenset(tems) for type_, tems in types.items()}
+
+        self.stats = {}
+        for stat in Stats:
+            column = sorted(
+                (tem_data['Stats'][stat], species) for species, tem_data in data.items()
+            )
+            self.stats[stat] = (
+                tuple(value for value, _ in column),
+                tuple(species for _, species in column),
+            )
+
+
+def _index() -> TemTemIndex:
+    # As static.static_tables(), only build the index under the lock
+    index = static.TEMTEM_INDEX
+    if index is None:
+        with static._LOCK:
+            if static.TEMTEM_DATA is None:
+                static.load_temtem_data()
+            if static.TEMTEM_INDEX is None:
+                static.TEMTEM_INDEX = TemTemIndex(static.TEMTEM_DATA)
+            index = static.TEMTEM_INDEX
+    return index
+
+
+def learnset(species: str) -> FrozenSet[str]:
+    ''' Every move species can learn, by any means '''
+    return _index().learnsets[species]
+
+
+def learners(move: str) -> FrozenSet[str]:
+    ''' Species that can learn move '''
+    return _index().learners.get(move, NOTHING)
+
+
+def with_trait(trait: str) -> FrozenSet[str]:
+    return _index().traits.get(trait, NOTHING)
+
+
+def of_type(type_: Union[Types, str]) -> FrozenSet[str]:
+    if isinstance(type_, str):
+        type_ = Types[type_]
+    return _index().types.get(type_, NOTHING)
+
+
+def base_stat_between(
+    stat: Stats, low: Optional[int] = None, high: Optional[int] = None
+) -> FrozenSet[str]:
+    ''' Species with low <= base stat <= high (either end can be left open) '''
+    values, species = _index().stats[stat]
+    start = 0 if low is None else bisect_left(values, low)
+    stop = len(values) if high is None else bisect_right(values, high)
+    return frozenset(species[start:stop])
+
+
+def stat_above(
+    stat: Stats,
+    value: int,
+    level: int = DEFAULT_LEVEL,
+    sv: int = 50,
+    tv: int = 0,
+) -> FrozenSet[str]:
+    '''
+    Species whose stat would be more than value with the given level, sv and
+    tv, e.g. which species outspeed 100 speed at level 58.
+
+    Stats only go up with the base stat, so this bisects the sorted base stats
+    rather than calculating a stat for every species.
+    '''
+    from .temtem import calc_stat
+
+    values, species = _index().stats[stat]
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if calc_stat(stat, values[mid], sv, tv, level) > value:
+            hi = mid
+        else:
+            lo = mid + 1
+    return frozenset(species[lo:])
+
+
+def find_species(
+    learns: Iterable[str] = (),
+    trait: Optional[str] = None,
+    types: Iterable[Union[Types, str]] = (),
+) -> FrozenSet[str]:
+    '''
+    Species that learn all of the moves in learns, can have trait, and have
+    all of types. Combine with the other queries using set operations, e.g.
+    find_species(trait='Fainted Curse') & stat_above(Stats.Spe, 100)
+    '''
+    result = frozenset(_index().learnsets)
+    for move in learns:
+        result &= learners(move)
+    if trait is not None:
+        result &= with_trait(trait)
+    for type_ in types:
+        result &= of_type(type_)
+    return result
+
+
+# Tests
+def test_queries():
+    from .temtem import calc_stat
+
+    _index()
+    data = static.TEMTEM_DATA
+
+    def scan(predicate):
+        return frozenset(species for species, tem_data in data.items() if predicate(tem_data))
+
+    def all_moves(tem_data):
+        return {move for moves in tem_data['Moves'].values() for move in moves}
+
+    assert learnset('Gyalis') == all_moves(data['Gyalis'])
+    assert 'Gyalis' in learners('Crystal Bite')
+    assert learners('Crystal Bite') == scan(lambda tem: 'Crystal Bite' in all_moves(tem))
+    assert learners('Not a move') == frozenset()
+
+    assert with_trait('Synergy Master') == scan(lambda tem: 'Synergy Master' in tem['Traits'])
+    assert of_type('toxic') == of_type(Types.toxic) == scan(lambda tem: Types.toxic in tem['Types'])
+    assert find_species(trait='Synergy Master', types=['toxic', 'mental']) == scan(
+        lambda tem: 'Synergy Master' in tem['Traits']
+        and {Types.toxic, Types.mental} <= set(tem['Types'])
+    )
+    assert find_species(learns=['Crystal Bite', 'Tail Strike']) == (
+        learners('Crystal Bite') & learners('Tail Strike')
+    )
+
+    assert base_stat_between(Stats.Spe, 60, 80) == scan(
+        lambda tem: 60 <= tem['Stats'][Stats.Spe] <= 80
+    )
+    assert base_stat_between(Stats.HP) == frozenset(data)
+    for speed in (0, 100, 150, 1000):
+        for sv, tv in ((50, 0), (50, 500), (1, 0)):
+            assert stat_above(Stats.Spe, speed, sv=sv, tv=tv) == scan(
+                lambda tem: speed < calc_stat(
+                    Stats.Spe, tem['Stats'][Stats.Spe], sv, tv, DEFAULT_LEVEL
+                )
+            )
+
+
+def test_index_threads(monkeypatch):
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    built = []
+
+    class CountingIndex(TemTemIndex):
+        def __init__(self, data):
+            built.append(self)
+            super().__init__(data)
+
+    monkeypatch.setattr(static, 'TEMTEM_INDEX', None)
+    monkeypatch.setattr(sys.modules[__name__], 'TemTemIndex', CountingIndex)
+    with ThreadPoolExecutor(8) as pool:
+        indexes = list(pool.map(lambda _: _index(), range(32)))
+    assert len(built) == 1 and all(index is built[0] for index in indexes)
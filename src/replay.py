@@ -0,0 +1,472 @@
+# vim: set fileencoding=utf-8 :
+"""
+replay.py: a compact binary log of battles, that can be replayed
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+A log is a header followed by a stream of events, each a one byte kind then
+a fixed layout (see EVENT_FORMATS). Strings (tem sets and move names) are
+written once, in a STRING event, and referred to by id after that, so a
+turn costs a few dozen bytes. Many battles can be written to one log.
+
+A battle is:
+    BATTLE: speed arrow, the rng's seed, active tems (or NONE for an empty
+        slot), the teams (as exported sets)
+    then for each turn:
+        TURN, and a CHOICE for each choice made (none for empty slots)
+        ACTION for each tem acting, in the order they acted
+        HP, STATUS and KO for each change to a tem, as it happened
+    END: the winner, if there was one
+"""
+
+import io
+import struct
+
+import numpy as np
+
+from .rng import Rng
+from .sim import Battle, Choice
+from .static import Statuses
+from .temtem import STATUS_INDEX, STATUS_LIST, TemTem
+
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+MAGIC = b'TTRP'
+VERSION = 3
+
+STRING, BATTLE, TURN, CHOICE, ACTION, HP, STATUS, KO, END = range(9)
+EVENT_NAMES = ('STRING', 'BATTLE', 'TURN', 'CHOICE', 'ACTION', 'HP', 'STATUS', 'KO', 'END')
+EVENT_FORMATS = {
+    STRING: struct.Struct('<H'),  # length, followed by utf-8
+    BATTLE: struct.Struct('<B2B2B16sB'),  # speed arrow, active slots per side, team
+                                          # sizes, seed entropy, spawn key length,
+                                          # followed by the spawn key, a byte per
+                                          # active slot and a string id for each tem
+    TURN: struct.Struct('<H'),  # turn number
+    CHOICE: struct.Struct('<BBBIB'),  # side, slot, action, detail, target kind,
+                                      # followed by the targets
+    ACTION: struct.Struct('<BB'),  # side, slot
+    HP: struct.Struct('<BBh'),  # side, team index, change in HP
+    STATUS: struct.Struct('<BBBh'),  # side, team index, status, turns
+    KO: struct.Struct('<BB'),  # side, team index
+    END: struct.Struct('<b'),  # winner, or -1
+}
+_KIND = struct.Struct('<B')
+_STRING_ID = struct.Struct('<I')
+_TARGET = struct.Struct('<BB')
+_SPAWN_KEY = struct.Struct('<I')
+_HEADER = struct.Struct('<4sB')
+
+NONE = 255  # for empty active slots
+NO_STRING = 0xFFFFFFFF
+ACTIONS = ('run', 'item', 'switch', 'rest', 'attack')
+# Choice targets are either a team index (switches) or a list of (side, slot)
+NO_TARGET, TEAM_TARGET, FIELD_TARGETS = range(3)
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayWriter:
+    '''
+    Streams battles to a binary file object. Give it to Battle.start_log()
+    to record a battle.
+    '''
+
+    def __init__(self, fp: BinaryIO):
+        self._fp = fp
+        self._strings = {}
+        self._tem_states = None
+        self._turn = 0
+        fp.write(_HEADER.pack(MAGIC, VERSION))
+
+    def _write(self, kind, *fields, extra=b''):
+        self._fp.write(_KIND.pack(kind) + EVENT_FORMATS[kind].pack(*fields) + extra)
+
+    def _string_id(self, string):
+        if string is None:
+            return NO_STRING
+        if (string_id := self._strings.get(string)) is None:
+            string_id = self._strings[string] = len(self._strings)
+            encoded = string.encode('utf-8')
+            self._write(STRING, len(encoded), extra=encoded)
+        return string_id
+
+    @staticmethod
+    def _tem_state(battle):
+        return [
+            [(tem.HP, tem._status_mask, tem.fainted) for tem in team]
+            for team in battle.teams
+        ]
+
+    def start_battle(self, battle: Battle):
+        '''
+        Record the battle's starting state. Its rng is recorded by its seed,
+        so this must be called before any rolls are made.
+        '''
+        seed_seq = battle.rng.seed_seq
+        try:
+            entropy = int(seed_seq.entropy).to_bytes(16, 'little')
+        except (TypeError, OverflowError):
+            raise ReplayError(
+                f'Only 128 bit integer seeds can be logged, not {seed_seq.entropy!r}'
+            ) from None
+        spawn_key = b''.join(_SPAWN_KEY.pack(key) for key in seed_seq.spawn_key)
+        tem_ids = [self._string_id(tem.export()) for team in battle.teams for tem in team]
+        active = [NONE if slot is None else slot for side in battle.active for slot in side]
+        self._write(
+            BATTLE,
+            battle.speed_arrow,
+            *(len(side) for side in battle.active),
+            *(len(team) for team in battle.teams),
+            entropy,
+            len(seed_seq.spawn_key),
+            extra=(
+                spawn_key + bytes(active)
+                + b''.join(_STRING_ID.pack(tem_id) for tem_id in tem_ids)
+            ),
+        )
+        self._tem_states = self._tem_state(battle)
+        self._turn = 0
+
+    def turn(self, choices: List[List[Choice]]):
+        self._turn += 1
+        self._write(TURN, self._turn)
+        for side, side_choices in enumerate(choices):
+            for slot, choice in enumerate(side_choices):
+                if choice is None:  # no tem in the slot, or it can't act
+                    continue
+                targets = choice.targets
+                if targets is None:
+                    kind, extra = NO_TARGET, b''
+                elif isinstance(targets, int):
+                    kind, extra = TEAM_TARGET, bytes([targets])
+                else:
+                    kind = FIELD_TARGETS
+                    extra = bytes([len(targets)]) + b''.join(
+                        _TARGET.pack(*target) for target in targets
+                    )
+                self._write(
+                    CHOICE,
+                    side,
+                    slot,
+                    ACTIONS.index(choice.action),
+                    self._string_id(choice.detail),
+                    kind,
+                    extra=extra,
+                )
+
+    def action(self, side: int, slot: int):
+        self._write(ACTION, side, slot)
+
+    def changes(self, battle: Battle):
+        '''
+        Record HP changes, new statuses and KOs since the last call.
+        '''
+        for side, team in enumerate(battle.teams):
+            states = self._tem_states[side]
+            for idx, tem in enumerate(team):
+                hp, mask, fainted = states[idx]
+                if tem.HP == hp and tem._status_mask == mask and tem.fainted == fainted:
+                    continue
+                if tem.HP != hp:
+                    self._write(HP, side, idx, tem.HP - hp)
+                if new := tem._status_mask & ~mask:
+                    for status in tem.statuses:
+                        if new & (1 << STATUS_INDEX[status]):
+                            self._write(
+                                STATUS, side, idx, STATUS_INDEX[status],
+                                tem.statuses[status]['remaining'],
+                            )
+                if tem.fainted and not fainted:
+                    self._write(KO, side, idx)
+                states[idx] = (tem.HP, tem._status_mask, tem.fainted)
+
+    def end_battle(self, winner: Optional[int]):
+        self._write(END, -1 if winner is None else winner)
+
+
+class BattleRecord:
+    '''
+    A battle read back from a log. turns is a list of (choices, events) with
+    events a list of (kind, fields) for the ACTION, HP, STATUS and KO events
+    in the turn.
+    '''
+
+    def __init__(self, importables, active, speed_arrow, seed=None):
+        self.importables = importables  # [[tem set, ...], [tem set, ...]]
+        self.active = active  # [[team index or None, ...], [...]]
+        self.speed_arrow = speed_arrow
+        self.seed = seed  # (entropy, spawn key) of the battle's rng
+        self.turns = []
+        self.winner = None
+        self.finished = False
+
+    def __repr__(self):
+        return f'<BattleRecord {len(self.turns)} turns, winner {self.winner}>'
+
+    def battle(self) -> Battle:
+        ''' A new Battle in the recorded starting state '''
+        teams = [
+            [TemTem.from_importable(importable) for importable in team]
+            for team in self.importables
+        ]
+        for team in teams:
+            if len(team) > 1:
+                team[0].ally, team[1].ally = team[1], team[0]
+        rng = None
+        if self.seed is not None:
+            entropy, spawn_key = self.seed
+            rng = Rng(np.random.SeedSequence(entropy, spawn_key=spawn_key))
+        return Battle(teams, [list(side) for side in self.active], self.speed_arrow, rng)
+
+
+def _read_exact(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ReplayError('Log ended part way through an event')
+    return data
+
+
+def read_events(fp: BinaryIO) -> Iterator[Tuple[int, tuple]]:
+    '''
+    Yield (kind, fields) for each event in a log, with string ids resolved
+    to strings and STRING events themselves left out. CHOICE events get their
+    targets as an extra field, and BATTLE events are (speed arrow, seed,
+    active tems, the teams' sets), with the seed as (entropy, spawn key).
+    '''
+    magic, version = _HEADER.unpack(_read_exact(fp, _HEADER.size))
+    if magic != MAGIC:
+        raise ReplayError('Not a replay log')
+    if version != VERSION:
+        raise ReplayError(f'Unsupported replay log version {version}')
+
+    strings = []
+
+    def string(string_id):
+        return None if string_id == NO_STRING else strings[string_id]
+
+    while kind_byte := fp.read(1):
+        kind = kind_byte[0]
+        try:
+            layout = EVENT_FORMATS[kind]
+        except KeyError:
+            raise ReplayError(f'Unknown event kind {kind}') from None
+        fields = layout.unpack(_read_exact(fp, layout.size))
+
+        if kind == STRING:
+            strings.append(_read_exact(fp, fields[0]).decode('utf-8'))
+            continue
+        if kind == BATTLE:
+            speed_arrow, slots, sizes = fields[0], fields[1:3], fields[3:5]
+            entropy, key_length = fields[5:]
+            spawn_key = tuple(
+                key for key, in _SPAWN_KEY.iter_unpack(
+                    _read_exact(fp, _SPAWN_KEY.size * key_length)
+                )
+            )
+            active = list(_read_exact(fp, sum(slots)))
+            tem_ids = struct.unpack(
+                f'<{sum(sizes)}I', _read_exact(fp, _STRING_ID.size * sum(sizes))
+            )
+            sets = [string(tem_id) for tem_id in tem_ids]
+            fields = (
+                speed_arrow,
+                (int.from_bytes(entropy, 'little'), spawn_key),
+                [active[:slots[0]], active[slots[0]:]],
+                [sets[:sizes[0]], sets[sizes[0]:]],
+            )
+        elif kind == CHOICE:
+            side, slot, action, detail, target_kind = fields
+            if target_kind == NO_TARGET:
+                targets = None
+            elif target_kind == TEAM_TARGET:
+                targets = _read_exact(fp, 1)[0]
+            else:
+                count = _read_exact(fp, 1)[0]
+                data = _read_exact(fp, _TARGET.size * count)
+                targets = [tuple(target) for target in _TARGET.iter_unpack(data)]
+            fields = (side, slot, ACTIONS[action], string(detail), targets)
+        yield kind, fields
+
+
+def read_battles(fp: BinaryIO) -> Iterator[BattleRecord]:
+    record = None
+    for kind, fields in read_events(fp):
+        if kind == BATTLE:
+            if record is not None:
+                yield record
+            speed_arrow, seed, active, importables = fields
+            active = [[None if slot == NONE else slot for slot in side] for side in active]
+            record = BattleRecord(importables, active, speed_arrow, seed)
+        elif record is None:
+            raise ReplayError(f'{EVENT_NAMES[kind]} event before any BATTLE')
+        elif kind == TURN:
+            record.turns.append(([[None] * len(side) for side in record.active], []))
+        elif kind == CHOICE:
+            side, slot, action, detail, targets = fields
+            record.turns[-1][0][side][slot] = Choice(action, detail, targets)
+        elif kind == END:
+            record.winner = None if fields[0] == -1 else fields[0]
+            record.finished = True
+        else:
+            record.turns[-1][1].append((kind, fields))
+    if record is not None:
+        yield record
+
+
+def replay(record: BattleRecord) -> BattleRecord:
+    '''
+    Play the recorded choices again from the recorded starting state, and
+    return the resulting record.
+    '''
+    buffer = io.BytesIO()
+    writer = ReplayWriter(buffer)
+    battle = record.battle()
+    battle.start_log(writer)
+    for choices, _ in record.turns:
+        battle.process_turn(choices)
+        if battle.winner is not None:
+            break
+    buffer.seek(0)
+    return next(read_battles(buffer))
+
+
+def verify(record: BattleRecord) -> bool:
+    '''
+    Whether replaying the battle gives exactly the recorded events.
+    '''
+    replayed = replay(record)
+    return (
+        [events for _, events in replayed.turns] == [events for _, events in record.turns]
+        and replayed.winner == record.winner
+    )
+
+
+# Tests
+def test_replay_log():
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    record = BattleRecord(
+        [[GYALIS_IMPORT, KINU_IMPORT], [KINU_IMPORT, GYALIS_IMPORT]], [[0, 1], [0, 1]], 1
+    )
+    buffer = io.BytesIO()
+    writer = ReplayWriter(buffer)
+
+    # The simulator can't get through a turn yet, so make the changes a turn
+    # would here
+    for battle_no in range(2):
+        battle = record.battle()
+        battle.start_log(writer)
+        choices = [
+            [Choice('attack', 'Crystal Bite', [(1, 0)]), Choice('switch', None, 2)],
+            [Choice('rest'), Choice('attack', 'Beta Burst', [(0, 0), (0, 1)])],
+        ]
+        writer.turn(choices)
+        writer.action(1, 1)
+        battle.teams[0][0].take_damage(50)
+        battle.teams[0][1].apply_status(Statuses.burned, 2)
+        writer.changes(battle)
+        writer.action(0, 0)
+        battle.teams[1][0].take_damage(battle.teams[1][0].HP)
+        writer.changes(battle)
+        writer.end_battle(0)
+
+    size = buffer.tell()
+    buffer.seek(0)
+    battles = list(read_battles(buffer))
+    assert len(battles) == 2
+
+    for replayed in battles:
+        assert replayed.importables == [
+            [tem.export() for tem in team] for team in record.battle().teams
+        ]
+        assert replayed.active == record.active and replayed.speed_arrow == 1
+        assert replayed.winner == 0 and replayed.finished
+        (turn_choices, events), = replayed.turns
+        assert [
+            [(choice.action, choice.detail, choice.targets) for choice in side]
+            for side in turn_choices
+        ] == [
+            [(choice.action, choice.detail, choice.targets) for choice in side]
+            for side in choices
+        ]
+        assert events == [
+            (ACTION, (1, 1)),
+            (HP, (0, 0, -50)),
+            (STATUS, (0, 1, STATUS_INDEX[Statuses.burned], 2)),
+            (ACTION, (0, 0)),
+            (HP, (1, 0, -battles[0].battle().teams[1][0].HP)),
+            (KO, (1, 0)),
+        ]
+    assert STATUS_LIST[events[2][1][2]] is Statuses.burned
+
+    # Sets are only written once, so both battles take less space than one
+    # battle's sets as text
+    assert size < len(''.join(record.importables[0] + record.importables[1]))
+
+
+def test_record_and_replay():
+    from .montecarlo import random_attacks
+    from .rng import battle_rng
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    # With no tems on the bench, slots are left empty once a tem is KO'd
+    start = BattleRecord(
+        [[GYALIS_IMPORT, KINU_IMPORT], [KINU_IMPORT, GYALIS_IMPORT]], [[0, 1], [0, 1]], 0,
+        seed=(5, (0, 7)),
+    )
+    buffer = io.BytesIO()
+    battle = start.battle()
+    battle.start_log(ReplayWriter(buffer))
+    rng = battle_rng(0, 0)
+    turns = 0
+    while battle.winner is None and turns < 100:
+        battle.process_turn([random_attacks(battle, side, rng) for side in (0, 1)])
+        turns += 1
+    assert battle.winner is not None
+
+    buffer.seek(0)
+    record, = read_battles(buffer)
+    assert record.finished and record.winner == battle.winner
+    assert record.active == [[0, 1], [0, 1]] and len(record.turns) == turns
+    # The replayed battle rolls the same numbers
+    assert record.seed == (5, (0, 7))
+    assert record.battle().rng.random() == battle_rng(5, 7).random()
+    kinds = {kind for _, events in record.turns for kind, _ in events}
+    assert {ACTION, HP, KO} <= kinds
+    assert any(None in side for choices, _ in record.turns for side in choices)
+
+    assert verify(record)
+    replayed = replay(record)
+    assert [events for _, events in replayed.turns] == [events for _, events in record.turns]
+
+    # A log that doesn't match the simulator doesn't verify
+    (_, events), *_ = record.turns
+    kind, (side, idx, change) = next(event for event in events if event[0] == HP)
+    events[events.index((kind, (side, idx, change)))] = (kind, (side, idx, change + 1))
+    assert not verify(record)
+
+    # Sides can have any number of active slots, and empty ones
+    buffer = io.BytesIO()
+    start = BattleRecord([[KINU_IMPORT], [GYALIS_IMPORT, KINU_IMPORT]], [[0], [None, 1]], 1)
+    battle = start.battle()
+    battle.start_log(ReplayWriter(buffer))
+    buffer.seek(0)
+    record, = read_battles(buffer)
+    assert record.active == [[0], [None, 1]] and record.speed_arrow == 1
+    assert record.seed == (battle.rng.seed_seq.entropy, ())
@@ -0,0 +1,202 @@
+# vim: set fileencoding=utf-8 :
+"""
+rng.py: reproducible random numbers for simulating battles
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+
+from typing import Iterator, List, Optional, Sequence, TypeVar
+
+T = TypeVar('T')
+
+BUFFER_SIZE = 256  # uniform floats drawn at a time for scalar rolls
+# First element of the spawn key, so battle and worker streams never overlap
+BATTLE_KEY, WORKER_KEY = range(2)
+
+
+class Rng:
+    '''
+    A stream of random rolls. Scalar rolls (random(), chance() etc.) come from
+    a buffer of uniform floats, drawn BUFFER_SIZE at a time, as a call into
+    numpy costs far more than a draw. For batch draws, use generator, a
+    numpy Generator on the same stream.
+
+    Streams are derived from a SeedSequence, so spawn() gives independent
+    child streams, and the same seed always gives the same rolls.
+    '''
+    __slots__ = ('seed_seq', 'generator', '_buffer', '_pos', '_buffer_state')
+
+    def __init__(self, seed_seq: Optional[np.random.SeedSequence] = None):
+        self.seed_seq = np.random.SeedSequence() if seed_seq is None else seed_seq
+        self.generator = np.random.default_rng(self.seed_seq)
+        self._buffer = []
+        self._pos = 0
+        self._buffer_state = None  # the generator's state before _buffer was drawn
+
+    def __repr__(self):
+        return f'<Rng {self.seed_seq.entropy} {self.seed_seq.spawn_key}>'
+
+    def random(self) -> float:
+        ''' A float in [0, 1) '''
+        if self._pos == len(self._buffer):
+            self._buffer_state = self.generator.bit_generator.state
+            self._buffer = self.generator.random(BUFFER_SIZE).tolist()
+            self._pos = 0
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+    def chance(self, probability: float) -> bool:
+        ''' True with the given probability, e.g. for a 30% chance to burn '''
+        return self.random() < probability
+
+    def integers(self, high: int) -> int:
+        ''' An int in [0, high) '''
+        return int(self.random() * high)
+
+    def choice(self, options: Sequence[T]) -> T:
+        return options[self.integers(len(options))]
+
+    def snapshot(self) -> tuple:
+        '''
+        The state of the stream, as a hashable tuple for restore(). Buffered
+        rolls aren't stored, but redrawn from the state they were drawn from.
+        '''
+        return (
+            _freeze(self.generator.bit_generator.state),
+            _freeze(self._buffer_state) if self._pos else None,
+            self._pos,
+        )
+
+    def restore(self, state: tuple):
+        generator_state, buffer_state, self._pos = state
+        if buffer_state is None:
+            self._buffer, self._buffer_state = [], None
+        else:
+            self._buffer_state = _thaw(buffer_state)
+            self.generator.bit_generator.state = self._buffer_state
+            self._buffer = self.generator.random(BUFFER_SIZE).tolist()
+        self.generator.bit_generator.state = _thaw(generator_state)
+
+    def spawn(self, n: int) -> List['Rng']:
+        ''' n independent child streams '''
+        return [Rng(child) for child in self.seed_seq.spawn(n)]
+
+
+def _freeze(state):
+    # A bit generator's state dict, as nested tuples
+    return tuple(
+        (key, _freeze(value) if isinstance(value, dict) else value)
+        for key, value in state.items()
+    )
+
+
+def _thaw(state):
+    return {
+        key: _thaw(value) if isinstance(value, tuple) else value for key, value in state
+    }
+
+
+def battle_rng(seed: int, battle_no: int) -> Rng:
+    '''
+    The stream for one battle, derived from the master seed and the battle's
+    number, so results don't depend on how battles are split between
+    workers.
+    '''
+    return Rng(np.random.SeedSequence(seed, spawn_key=(BATTLE_KEY, battle_no)))
+
+
+def worker_rng(seed: int, worker_no: int) -> Rng:
+    '''
+    The stream for one worker, for anything not tied to a single battle.
+    '''
+    return Rng(np.random.SeedSequence(seed, spawn_key=(WORKER_KEY, worker_no)))
+
+
+_CURRENT = ContextVar('rng')
+
+
+def current_rng() -> Rng:
+    '''
+    The Rng of the battle being processed, for traits and gear, which don't
+    get the battle itself. Raises LookupError outside of a battle.
+    '''
+    return _CURRENT.get()
+
+
+@contextmanager
+def using(rng: Rng) -> Iterator[Rng]:
+    ''' Make rng the current_rng() for the duration '''
+    token = _CURRENT.set(rng)
+    try:
+        yield rng
+    finally:
+        _CURRENT.reset(token)
+
+
+# Tests
+def test_rng():
+    rolls = [battle_rng(1, 2).random() for _ in range(2)]
+    assert rolls[0] == rolls[1]
+
+    # Buffered scalar rolls are the generator's own stream
+    rng = battle_rng(1, 2)
+    expected = np.random.default_rng(np.random.SeedSequence(1, spawn_key=(BATTLE_KEY, 2)))
+    assert [rng.random() for _ in range(BUFFER_SIZE + 10)] == (
+        expected.random(2 * BUFFER_SIZE).tolist()[:BUFFER_SIZE + 10]
+    )
+
+    # Streams are independent of each other
+    first = battle_rng(1, 2).generator.random(4).tolist()
+    assert first != battle_rng(1, 3).generator.random(4).tolist()
+    assert first != worker_rng(1, 2).generator.random(4).tolist()
+    assert first != battle_rng(2, 2).generator.random(4).tolist()
+
+    # Snapshots reproduce the rolls that follow, mid-buffer or not
+    for rolls in (0, 5, BUFFER_SIZE):
+        rng = battle_rng(1, 2)
+        for _ in range(rolls):
+            rng.random()
+        state = rng.snapshot()
+        hash(state)
+        expected = [rng.random() for _ in range(BUFFER_SIZE + 3)]
+        expected.append(rng.generator.random())
+        rng.restore(state)
+        assert [rng.random() for _ in range(BUFFER_SIZE + 3)] + [rng.generator.random()] == (
+            expected
+        )
+
+    children = [child.random() for child in battle_rng(1, 2).spawn(3)]
+    assert children == [child.random() for child in battle_rng(1, 2).spawn(3)]
+    assert len(set(children)) == 3
+
+    rng = worker_rng(0, 0)
+    assert all(0 <= rng.integers(3) < 3 for _ in range(100))
+    assert rng.choice('ab') in 'ab'
+    assert rng.chance(1.0) and not rng.chance(0.0)
+
+    try:
+        current_rng()
+        assert False, 'there should be no current rng outside a battle'
+    except LookupError:
+        pass
+    with using(rng):
+        assert current_rng() is rng
@@ -0,0 +1,400 @@
+# vim: set fileencoding=utf-8 :
+"""
+search.py: a battle AI that searches over simultaneous turns
+Copyright (C) 2020 DoW
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from math import inf, isinf, tanh
+from time import perf_counter
+
+import numpy as np
+
+from .calc import calc_damage, n_hko
+from .rng import Rng
+from .sim import Battle, Choice, other
+from .static import lookup_attack
+from .validation import legal_choices
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_TIME_BUDGET = 0.1  # seconds per decision
+DEFAULT_WIDTH = 6  # combinations of choices searched per side at each node
+MAX_DEPTH = 8
+GAME_ITERATIONS = 200  # of fictitious play, for mixed strategies
+
+STA_WEIGHT = 0.25  # of a tem's stamina ratio, relative to its HP ratio
+THREAT_WEIGHT = 0.5  # of how quickly the active tems can KO each other
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def solve_matrix_game(
+    payoff: np.ndarray, iterations: int = GAME_ITERATIONS
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    '''
+    Solve a zero-sum game where the row player maximises payoff[row, col].
+    Returns (value, row strategy, column strategy), with the strategies as
+    probabilities for each row/column.
+
+    A pure saddle point is returned exactly. Otherwise mixed strategies are
+    approximated by fictitious play: each player repeatedly plays the best
+    response to the other's moves so far.
+    '''
+    payoff = np.asarray(payoff, dtype=float)
+    rows, cols = payoff.shape
+    maximin = payoff.min(axis=1)
+    minimax = payoff.max(axis=0)
+    row, col = int(maximin.argmax()), int(minimax.argmin())
+    if maximin[row] == minimax[col]:
+        row_strategy, col_strategy = np.zeros(rows), np.zeros(cols)
+        row_strategy[row] = col_strategy[col] = 1.0
+        return float(payoff[row, col]), row_strategy, col_strategy
+
+    row_counts, col_counts = np.zeros(rows), np.zeros(cols)
+    row_totals, col_totals = np.zeros(rows), np.zeros(cols)
+    for _ in range(iterations):
+        row_counts[row] += 1
+        col_counts[col] += 1
+        row_totals += payoff[:, col]
+        col_totals += payoff[row]
+        row, col = int(row_totals.argmax()), int(col_totals.argmin())
+
+    row_strategy, col_strategy = row_counts / iterations, col_counts / iterations
+    return float(row_strategy @ payoff @ col_strategy), row_strategy, col_strategy
+
+
+def _ready_moves(tem):
+    return [move for move, hold in tem.moves.items() if hold >= lookup_attack(move).hold]
+
+
+def _threat(battle, side):
+    # How quickly side's active tems can KO the opposing active tems, as the
+    # sum of 1 / (fewest hits to KO) over each pair
+    threat = 0.0
+    for attacker_idx in battle.active[side]:
+        if attacker_idx is None or (attacker := battle.teams[side][attacker_idx]).fainted:
+            continue
+        moves = _ready_moves(attacker)
+        for target_idx in battle.active[other(side)]:
+            if target_idx is None:
+                continue
+            target = battle.teams[other(side)][target_idx]
+            if target.fainted or not moves:
+                continue
+            hits = min(n_hko(attacker, target, move) for move in moves)
+            threat += 0.0 if isinf(hits) else 1 / hits
+    return threat
+
+
+def evaluate(battle: Battle, side: int = 0) -> float:
+    '''
+    Heuristic value of the battle for side, from -1 (lost) to 1 (won).
+
+    Compares each team's remaining HP and stamina ratios, plus how quickly
+    the active tems can KO each other (using calc.n_hko).
+    '''
+    if battle.winner is not None:
+        return 1.0 if battle.winner == side else -1.0
+
+    material = []
+    for team in battle.teams:
+        material.append(sum(
+            tem.HP / tem.max_hp + STA_WEIGHT * tem.Sta / tem.max_sta
+            for tem in team if not tem.fainted
+        ) / (1 + STA_WEIGHT) / max(len(team), 1))
+
+    score = material[side] - material[other(side)]
+    score += THREAT_WEIGHT * (_threat(battle, side) - _threat(battle, other(side)))
+    return tanh(score)
+
+
+def _choice_score(battle, side, choices):
+    # A cheap guess at how good a combination of choices is, to order them
+    # and decide which to search: damage dealt to the other side as a
+    # fraction of the targets' HP, less any dealt to our own side
+    score = 0.0
+    for slot, choice in enumerate(choices):
+        if choice is None:
+            continue
+        tem = battle.active_tem(side, slot)
+        if choice.action == 'rest':
+            score += 0.1 * (1 - tem.Sta / tem.max_sta)
+        if choice.action != 'attack':
+            continue
+        for target_side, target_slot in choice.targets:
+            target = battle.active_tem(target_side, target_slot)
+            damage = min(calc_damage(tem, target, choice.detail), target.HP) / target.max_hp
+            score += damage if target_side != side else -damage
+    return score
+
+
+class SearchAI:
+    '''
+    Picks the choices for one side by searching over the turns both sides
+    could play, to a depth that fits in time_budget seconds.
+
+    Each turn is a simultaneous-move game, so each node of the search solves
+    the matrix of (our choices x their choices) with solve_matrix_game(), and
+    the AI plays the resulting mixed strategy. Only the `width` most
+    promising combinations of choices for each side are searched (by a
+    heuristic ordering), and leaves are valued with evaluate().
+
+    Searches deepen one turn at a time until time_budget runs out, keeping
+    values in a transposition table keyed by Battle.snapshot(), so states reached
+    by different orders of turns aren't searched twice. Each turn is played
+    `samples` times with different rolls and averaged, for chance
+    (expectimax).
+
+    Turns that use a mechanic the simulator doesn't have yet (i.e. raise
+    NotImplementedError) are valued as leaves, on whatever state they left
+    the battle in.
+
+    Instances can be used as a montecarlo.run_matchup() policy. A finite
+    time_budget makes the choices depend on how fast the machine is at the
+    time, so for run_matchup()'s same-results-whatever-the-processes
+    guarantee use time_budget=inf, leaving max_depth to limit the search.
+
+    The table is cleared at the start of each choose(), so an instance's
+    memory doesn't grow over a battle.
+    '''
+
+    def __init__(
+        self,
+        time_budget: float = DEFAULT_TIME_BUDGET,
+        width: int = DEFAULT_WIDTH,
+        max_depth: int = MAX_DEPTH,
+        samples: int = 1,
+        seed: int = 0,
+    ):
+        self.time_budget = time_budget
+        self.width = width
+        self.max_depth = max_depth
+        self.samples = samples
+        self.seed = seed
+        # {(Battle.snapshot(with_rng=False), side): (depth searched, value for side)}
+        self.table: Dict[Tuple[tuple, int], Tuple[int, float]] = {}
+        self.depth_reached = 0
+        self._deadline = inf
+
+    def __call__(self, battle: Battle, side: int, rng: Rng) -> List[Choice]:
+        return self.choose(battle, side, rng)
+
+    def choose(self, battle: Battle, side: int, rng: Optional[Rng] = None) -> List[Choice]:
+        '''
+        The choices for side this turn. rng is used to pick from a mixed
+        strategy, so with rng=None the most likely choices are played.
+        '''
+        self._deadline = perf_counter() + self.time_budget
+        self.depth_reached = 0
+        self.table.clear()
+        candidates = self._candidates(battle, side)
+        if len(candidates) == 1:
+            return candidates[0]
+
+        strategy = None
+        saved = battle.snapshot(), battle.rng, battle.log
+        battle.log = None
+        try:
+            for depth in range(1, self.max_depth + 1):
+                try:
+                    _, strategy, candidates = self._root(battle, side, depth)
+                except _OutOfTime:
+                    break
+                self.depth_reached = depth
+        finally:
+            battle.restore(saved[0])
+            battle.rng, battle.log = saved[1], saved[2]
+
+        if strategy is None:  # not even one turn deep in time
+            return candidates[0]
+        if rng is None:
+            return candidates[int(strategy.argmax())]
+        roll = rng.random()
+        return candidates[min(
+            int(np.searchsorted(np.cumsum(strategy), roll, side='right')), len(candidates) - 1
+        )]
+
+    def _candidates(self, battle, side):
+        choices = list(legal_choices(battle, side)) or [[None] * len(battle.active[side])]
+        choices.sort(key=lambda choices: _choice_score(battle, side, choices), reverse=True)
+        return choices[:self.width]
+
+    def _root(self, battle, side, depth):
+        state = battle.snapshot(with_rng=False)
+        ours = self._candidates(battle, side)
+        theirs = self._candidates(battle, other(side))
+        payoff = self._payoff(battle, state, side, ours, theirs, depth)
+        value, strategy, _ = solve_matrix_game(payoff)
+        return value, strategy, ours
+
+    def _payoff(self, battle, state, side, ours, theirs, depth):
+        payoff = np.empty((len(ours), len(theirs)))
+        for i, our_choices in enumerate(ours):
+            for j, their_choices in enumerate(theirs):
+                turn = [None, None]
+                turn[side], turn[other(side)] = our_choices, their_choices
+                payoff[i, j] = self._play(battle, state, turn, side, depth)
+        return payoff
+
+    def _play(self, battle, state, turn, side, depth):
+        # The value for side of playing turn from state, averaged over samples
+        total = 0.0
+        rng = battle.rng
+        for sample in range(self.samples):
+            if perf_counter() > self._deadline:
+                raise _OutOfTime()
+            battle.restore(state)
+            battle.rng = Rng(np.random.SeedSequence(self.seed, spawn_key=(depth, sample)))
+            try:
+                battle.process_turn(turn)
+            except NotImplementedError as err:
+                log.debug('Turn could not be processed, so treated as a leaf: %r', err)
+                total += evaluate(battle, side)
+                continue
+            total += self._value(battle, side, depth - 1)
+        battle.restore(state)
+        battle.rng = rng
+        return total / self.samples
+
+    def _value(self, battle, side, depth):
+        if depth <= 0 or battle.winner is not None:
+            return evaluate(battle, side)
+
+        # Each sample gets its own rng, so the battle's isn't part of the state
+        state = battle.snapshot(with_rng=False)
+        key = (state, side)
+        if (entry := self.table.get(key)) is not None and entry[0] >= depth:
+            return entry[1]
+
+        ours = self._candidates(battle, side)
+        theirs = self._candidates(battle, other(side))
+        value, _, _ = solve_matrix_game(
+            self._payoff(battle, state, side, ours, theirs, depth)
+        )
+        self.table[key] = (depth, value)
+        return value
+
+
+def search_choices(battle: Battle, side: int, rng: Rng) -> List[Choice]:
+    '''
+    A montecarlo.run_matchup() policy using SearchAI with its defaults.
+    '''
+    return SearchAI().choose(battle, side, rng)
+
+
+# Tests
+def _choices_summary(choices: Sequence[Optional[Choice]]):
+    return [
+        None if choice is None else (choice.action, choice.detail, choice.targets)
+        for choice in choices
+    ]
+
+
+def test_solve_matrix_game():
+    # Saddle point
+    value, rows, cols = solve_matrix_game([[3, 1], [4, 2]])
+    assert value == 2 and rows.tolist() == [0, 1] and cols.tolist() == [0, 1]
+
+    # Matching pennies: both players should mix evenly
+    value, rows, cols = solve_matrix_game([[1, -1], [-1, 1]], iterations=1000)
+    assert abs(value) < 0.01
+    assert np.allclose(rows, 0.5, atol=0.05) and np.allclose(cols, 0.5, atol=0.05)
+
+
+def test_search_ai():
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+    from .temtem import gen_tems
+    from .rng import worker_rng
+
+    teams = [
+        list(gen_tems(f'{GYALIS_IMPORT}\n\n{KINU_IMPORT}')),
+        list(gen_tems(f'{KINU_IMPORT}\n\n{GYALIS_IMPORT}')),
+    ]
+    battle = Battle(teams, [[0, 1], [0, 1]], 0)
+    for team in teams:
+        team[0].ally, team[1].ally = team[1], team[0]
+        for tem in team:
+            for move in tem.moves:
+                tem.moves[move] = 5
+
+    # Symmetric teams are even, and a KO'd tem makes it uneven
+    assert abs(evaluate(battle, 0)) < 1e-9
+    assert evaluate(battle, 0) == -evaluate(battle, 1)
+    state = battle.snapshot()
+    teams[1][0].take_damage(teams[1][0].max_hp)
+    assert evaluate(battle, 0) > 0 > evaluate(battle, 1)
+    battle.winner = 0
+    assert evaluate(battle, 0) == 1.0
+    battle.restore(state)
+
+    ai = SearchAI(time_budget=0.1, width=4, samples=1)
+    start = perf_counter()
+    choices = ai.choose(battle, 0, worker_rng(0, 0))
+    assert perf_counter() - start < 0.5
+    assert ai.depth_reached >= 1
+    assert _choices_summary(choices) in [
+        _choices_summary(legal) for legal in legal_choices(battle, 0)
+    ]
+    # The search leaves the battle as it found it
+    assert battle.snapshot() == state
+    assert ai.choose(battle, 0) is not None
+
+    # Without a time limit, the search goes to max_depth
+    ai = SearchAI(time_budget=inf, width=2, max_depth=2)
+    ai.choose(battle, 1)
+    assert ai.depth_reached == 2
+
+    # Values are kept in the transposition table
+    ai._deadline = inf
+    key = battle.snapshot(with_rng=False)
+    assert ai._value(battle, 0, 1) == ai.table[(key, 0)][1]
+    ai.table[(key, 0)] = (1, 0.5)
+    assert ai._value(battle, 0, 1) == 0.5
+    assert battle.snapshot() == state
+
+    # Each choose() starts with an empty table, and without a time limit the
+    # choices don't depend on timing
+    ai.table[('stale', 0)] = (9, 1.0)
+    first = _choices_summary(ai.choose(battle, 1))
+    assert ('stale', 0) not in ai.table
+    again = SearchAI(time_budget=inf, width=2, max_depth=2).choose(battle, 1)
+    assert _choices_summary(again) == first
+
+
+def test_search_depth():
+    from .temtem import gen_tems
+    from .test_data import GYALIS_IMPORT
+
+    # A mirror match, where our Gyalis hasn't the stamina for any attack.
+    # One turn deep, overexerting to hit hardest looks best, but two turns
+    # deep the search sees it then can't act, so rests instead
+    teams = [list(gen_tems(GYALIS_IMPORT)), list(gen_tems(GYALIS_IMPORT))]
+    for tem in (teams[0][0], teams[1][0]):
+        for move in tem.moves:
+            tem.moves[move] = 5
+    teams[0][0].Sta = 5
+    battle = Battle(teams, [[0], [0]], 0)
+
+    shallow = SearchAI(time_budget=inf, width=8, max_depth=1).choose(battle, 0)
+    deep = SearchAI(time_budget=inf, width=8, max_depth=2).choose(battle, 0)
+    assert shallow[0].action == 'attack'
+    assert deep[0].action == 'rest'
@@ -18,7 +18,7 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
-from .static import lookup_attack
+from .static import STATUS, lookup_attack
 
 
 class Choice:
@@ -60,17 +60,84 @@ class Choice:
 
 class Battle:
 
-    def __init__(self, teams, active, speed_arrow):
+    def __init__(self, teams, active, speed_arrow, rng=None):
+        from .rng import Rng
+
         self.teams = teams
         self.active = active
         self.speed_arrow = speed_arrow  # 0 or 1
         self.winner = None
+        # an rng.Rng for any random rolls, which is also rng.current_rng()
+        # while a turn is processed
+        self.rng = Rng() if rng is None else rng
+        self.log = None  # a replay.ReplayWriter, if recording
+        self.profiler = None  # an instrument.Profiler, if timing turn phases
+
+    def start_log(self, writer):
+        '''
+        Record the battle from its current state with writer, a
+        replay.ReplayWriter.
+        '''
+        self.log = writer
+        writer.start_battle(self)
+
+    def start_profile(self, profiler):
+        '''
+        Time each phase of every turn with profiler, an instrument.Profiler.
+        '''
+        self.profiler = profiler
+
+    def _log_changes(self):
+        if self.log is not None:
+            self.log.changes(self)
+
+    def snapshot(self, with_rng=True):
+        '''
+        Capture the mutable state of the battle as nested tuples, to be
+        restored with restore(), and which can be hashed. Tems are
+        snapshotted in team order, with their allies as (side, team index).
+
+        The rng's state is included unless with_rng is False, e.g. to compare
+        positions regardless of the rolls to come.
+        '''
+        positions = {
+            id(tem): (side, idx)
+            for side, team in enumerate(self.teams) for idx, tem in enumerate(team)
+        }
+        return (
+            tuple(tuple(side) for side in self.active),
+            self.speed_arrow,
+            self.winner,
+            tuple(tem.snapshot() for team in self.teams for tem in team),
+            tuple(
+                None if tem.ally is None else positions[id(tem.ally)]
+                for team in self.teams for tem in team
+            ),
+            self.rng.snapshot() if with_rng else None,
+        )
+
+    def restore(self, state):
+        '''
+        Return the battle to a state from snapshot(). The rng is left as it is
+        if the snapshot doesn't include it.
+        '''
+        active, self.speed_arrow, self.winner, tem_states, allies, rng_state = state
+        self.active = [list(side) for side in active]
+        tems = [tem for team in self.teams for tem in team]
+        for tem, tem_state, ally in zip(tems, tem_states, allies):
+            tem.restore(tem_state)
+            tem.ally = None if ally is None else self.teams[ally[0]][ally[1]]
+        if rng_state is not None:
+            self.rng.restore(rng_state)
 
     def active_tem(self, side, slot):
         try:
-            return self.teams[side][self.active[side][slot]]
-        except KeyError:  # tem has probably been KO'd
+            tem_idx = self.active[side][slot]
+        except IndexError:  # e.g. a 1v1 battle
             return None
+        if tem_idx is None:  # tem has been KO'd, with no replacement
+            return None
+        return self.teams[side][tem_idx]
 
     def _check_win(self, sides=(0, 1)):
         # TODO: consider situation where all remaining tems faint
@@ -78,6 +145,9 @@ class Battle:
         for side in sides:
             if all(tem.fainted for tem in self.teams[side]):
                 self.winner = other(side)
+                if self.log is not None:
+                    self.log.changes(self)
+                    self.log.end_battle(self.winner)
                 return True
 
         return False
@@ -87,6 +157,8 @@ class Battle:
         tem_speeds = {}
         for side in (0, 1):
             for field_slot, tem_slot in enumerate(self.active[side]):
+                if tem_slot is None:
+                    continue
                 tem_speeds[(side, tem_slot)] = (
                     self.teams[side][tem_slot].Spe,
                     side == self.speed_arrow,
@@ -96,26 +168,25 @@ class Battle:
         yield from sorted(tem_speeds, key=lambda pos: tem_speeds[pos])
 
     def _actions_gen(self, choices):
-        from collections import defaultdict
-
         # TODO: handle plethoric, last rush
-        attacks = defaultdict(
-            lambda: {'priority': 0},
-            {choice.detail: lookup_attack(choice.detail) for choice in choices},
-        )
-        moves = {
-            (side, tem): choice.priority(
-                self.active_tem(side, tem), attacks[choice.detail]['priority']
-            )
-            for side, side_choices in enumerate(choices)
-            for tem, choice in enumerate(side_choices)
-        }
+        moves = {}
+        for side, side_choices in enumerate(choices):
+            for tem, choice in enumerate(side_choices):
+                if choice is None or self.active_tem(side, tem) is None:
+                    continue
+                attack_prio = (
+                    lookup_attack(choice.detail).priority if choice.action == 'attack' else 0
+                )
+                moves[(side, tem)] = tuple(
+                    choice.priority(self.active_tem(side, tem), attack_prio)
+                )
         priorities = {
             prio: [slot for slot in moves if moves[slot] == prio]
             for prio in set(moves.values())
         }
 
-        for prio in sorted(priorities):
+        # Highest priority (then speed) first
+        for prio in sorted(priorities, reverse=True):
             tems = priorities[prio]
             arrow_tems = [tem for tem in tems if tem[0] == self.speed_arrow]
             non_arrow_tems = [tem for tem in tems if tem[0] != self.speed_arrow]
@@ -126,26 +197,30 @@ class Battle:
             yield from sorted(arrow_tems)
             yield from sorted(non_arrow_tems)
 
-    def _fix_attack_targetting(self, side, tem_slot, choice):
+    def _fix_attack_targetting(self, side, tem_slot, targets, attack):
         '''
         A few things need to be fixed with targetting before a move is used.
         First, if the target tems are KO'd, we need to choose new targets, or
         not use the move.
         Then, we need to work out which secondary targets are hit by 'clockwise'
         targetting (e.g. chain lightning)
+
+        Returns the [(side, slot)] targets to hit, or None if there are none.
+        The choice's own targets are left alone, as choices may be replayed.
         '''
         # First, handle KO'd targets
-        if all(self.active[side_][slot] for side_, slot in choice.target):
-            orig_targ = choice.target[0]
+        remaining = [target for target in targets if self.active_tem(*target) is not None]
+        if not remaining:
+            orig_targ = targets[0]
             if (
-                choice.detail['target'] in {'single', 'clockwise', 'other'}
+                attack.target in {'single', 'clockwise', 'other'}
                 and orig_targ[0] != side
-                and self.active[orig_targ[0]][other(orig_targ[1])] is not None
+                and self.active_tem(orig_targ[0], other(orig_targ[1])) is not None
             ):
-                choice.target = ((orig_targ[0], other(orig_targ[1])))
+                remaining = [(orig_targ[0], other(orig_targ[1]))]
             else:
                 # No remaining targets for the move
-                return False
+                return None
 
         # Work out all targets for 'clockwise' targetting
         def next_tem_clockwise(battle, side, tem_slot):
@@ -153,64 +228,122 @@ class Battle:
                 (side, 1), (other(side), 0), (other(side), 1), (side, 0), (side, 1)
             )
             for side, slot in ordering[tem_slot:]:
-                if battle.active[side][slot] is not None:
+                if battle.active_tem(side, slot) is not None:
                     return (side, slot)
 
-        if choice.detail['target'] == 'clockwise':
-            next_tem = choice.target[0]
-            choice.target = [next_tem]
+        if attack.target == 'clockwise':
+            next_tem = remaining[0]
+            remaining = [next_tem]
             for _ in range(2):
                 next_tem = next_tem_clockwise(self, *next_tem)
-                choice.target.append(next_tem)
+                if next_tem is None or next_tem in remaining:
+                    break
+                remaining.append(next_tem)
 
-        return True
+        return remaining
 
     def _process_switch(self, side, tem_slot, choice):
         switcher = self.active_tem(side, tem_slot)
         if switcher.trapped:
             return
-        target = self.teams[side][choice.target]
-        if (ally := switcher.ally) is not None:
+        self._switch_in(side, tem_slot, choice.targets)
+
+    def _switch_in(self, side, tem_slot, tem_idx):
+        '''
+        Put the tem at tem_idx in side's team into tem_slot on the field,
+        linking it with its ally and running switch-in effects.
+        '''
+        target = self.teams[side][tem_idx]
+        if (switcher := self.active_tem(side, tem_slot)) is not None:
+            switcher.ally = None
+        ally = self.active_tem(side, other(tem_slot))
+        target.ally = ally
+        if ally is not None:
             ally.ally = target
-        self.active[side][tem_slot] = choice.target
+        self.active[side][tem_slot] = tem_idx
 
-        opposing_team = [
-            self.active_tem(other(side), 0), self.active_tem(other(side), 1)
-        ]
+        opposing_team = self._opposing_team(side)
 
         for handler in (target.trait, target.gear):
-            handler.on_switch_in(target=target).apply(
+            if 'on_switch_in' not in handler.hooks:
+                continue
+            handler.on_switch_in(target=target).apply_outcome(
                 target=target, ally=ally, opposing_team=opposing_team
             )
+        if ally is None:
+            return
         for handler in (ally.trait, ally.gear):
-            handler.on_ally_switch_in(target=ally, ally=target).apply(
+            if 'on_ally_switch_in' not in handler.hooks:
+                continue
+            handler.on_ally_switch_in(target=ally, ally=target).apply_outcome(
                 target=ally, ally=target, opposing_team=opposing_team
             )
 
+    def _opposing_team(self, side):
+        return [
+            tem for tem in (self.active_tem(other(side), 0), self.active_tem(other(side), 1))
+            if tem is not None
+        ]
+
     def _handle_ko(self, tem, side, tem_slot):
         tem.fainted = True
         if (ally := tem.ally) is not None:
             ally.ally = None
-        del self.active[side][tem_slot]
-        # TODO: handle wins here?
+        tem.ally = None
+        # The slot stays empty until the end of the turn
+        self.active[side][tem_slot] = None
+
+    def _handle_kos(self):
+        for side, side_active in enumerate(self.active):
+            for tem_slot, tem_idx in enumerate(side_active):
+                if tem_idx is not None and (tem := self.teams[side][tem_idx]).fainted:
+                    self._handle_ko(tem, side, tem_slot)
+
+    def _replace_fainted(self):
+        '''
+        Fill any empty slots on the field with the first tems on the bench
+        that can still battle, in team order.
+        '''
+        for side, side_active in enumerate(self.active):
+            bench = [
+                idx for idx, tem in enumerate(self.teams[side])
+                if idx not in side_active and not tem.fainted
+            ]
+            for tem_slot, tem_idx in enumerate(side_active):
+                if tem_idx is None and bench:
+                    self._switch_in(side, tem_slot, bench.pop(0))
+
+    def _process_rest(self, side, tem_slot):
+        tem = self.active_tem(side, tem_slot)
+        tem.resting = True
+        for handler in (tem.trait, tem.gear):
+            if 'on_rest' in handler.hooks:
+                handler.on_rest(tem).apply_outcome(target=tem, ally=tem.ally)
 
     def _process_attack(self, side, tem_slot, choice):
-        from .effects import Unaffected, RedirectAttack
+        from .effects import (
+            REDIRECT_TO_ALLY,
+            UNAFFECTED,
+            RedirectAttack,
+            Unaffected,
+            redirect_to_ally,
+            unaffected,
+        )
         from .calc import calc_damage
 
         attacker = self.active_tem(side, tem_slot)
         attack = attacker.lookup_attack(choice.detail)
-        if not self._fix_attack_targetting(side, tem_slot, choice):
+        target_slots = self._fix_attack_targetting(side, tem_slot, choice.targets, attack)
+        if target_slots is None:
             # No remaining targets for the move - just return
             return
 
-        attacker.use_stamina(attack['stamina'])
+        attacker.use_stamina(attack.stamina)
         # This is done before the attack for e.g. vigorous.
 
         # Deal damage
-        targets = [
-            self.active_tem(target_side, tem) for target_side, tem in choice.target
-        ]
+        targets = [self.active_tem(target_side, tem) for target_side, tem in target_slots]
+        opposing_team = self._opposing_team(side)
         clockwise_mod = 1.0
         for target in targets:
             # First, handle effects from traits, gear, and the move itself
@@ -221,58 +354,83 @@ class Battle:
             continue_flag = False
             # TODO: test redirects happen once, similar to magic coat in mons
             effects = []
-            handlers = [target.trait.on_hit, target.gear.on_hit]
+            handlers = [
+                handler.on_hit for handler in (target.trait, target.gear)
+                if 'on_hit' in handler.hooks
+            ]
             if ally:
-                handlers.extend([ally.trait.on_ally_hit, ally.gear.on_ally_hit])
+                handlers.extend(
+                    handler.on_ally_hit for handler in (ally.trait, ally.gear)
+                    if 'on_ally_hit' in handler.hooks
+                )
             for handler in handlers:
                 # handle these separately due to possible redirects or
                 # being unaffected by the moves
                 try:
-                    effects.append(handler(attacker, target, attack))
+                    effect = handler(attacker, target, attack)
                 except Unaffected:
-                    continue_flag = True
-                    break
+                    # handlers may still use the old exception-based API
+                    effect = unaffected
                 except RedirectAttack as redir:
-                    if not can_redirect:
-                        continue
                     if redir.new_target != 'ally':
                         raise RuntimeError(
                             'Don\'t know how to handle new target '
                             f'{redir.new_target} from handler {handler}'
                         )
+                    effect = redirect_to_ally
+
+                if effect.outcome & UNAFFECTED:
+                    continue_flag = True
+                    break
+                if effect.outcome & REDIRECT_TO_ALLY:
+                    if not can_redirect:
+                        continue
                     if (not ally) or ally in targets:
                         # spread moves will continue to hit both
                         continue
                     targets.append(ally)
                     continue_flag = True
+                    continue
+                effects.append(effect)
             if continue_flag:
                 continue
 
-            effects.extend([
-                attacker.trait.on_attack(attacker, target, attack),
-                attacker.gear.on_attack(attacker, target, attack),
-                attack['effects'],
-            ])
-            mod = 1
+            effects.extend(
+                handler.on_attack(attacker, target, attack)
+                for handler in (attacker.trait, attacker.gear)
+                if 'on_attack' in handler.hooks
+            )
+            effects.append(attack.effects)
+            mod, outcome = 1, 0
             for effect in effects:
-                mod = effect.apply(
+                mod, outcome = effect.apply_outcome(
                     attacker=attacker,
                     target=target,
                     ally=ally,
                     damage=mod,
                 )
+                if outcome & UNAFFECTED:
+                    # e.g. individualist
+                    break
+            if outcome & UNAFFECTED:
+                continue
 
             # Now apply damage
-            if attacker['class'] != 'Status':
-                damage = calc_damage(attacker, target, attack, mod)
-                opposing_team = [
-                    self.active_tem(other(side), 0), self.active_tem(other(side), 1)
+            if attack.class_id != STATUS:
+                damage = calc_damage(attacker, target, attack, mod * clockwise_mod)
+                damage_effects = [
+                    handler.on_take_damage(attacker, target, attack, damage)
+                    for handler in (target.trait, target.gear)
+                    if 'on_take_damage' in handler.hooks
                 ]
-                for effect in (
-                    target.on_take_damage(attacker, target, attack, damage),
-                    ally.on_ally_damage(attacker, target, ally, attack, damage),
-                ):
-                    effect.apply(
+                if ally:
+                    damage_effects.extend(
+                        handler.on_ally_damage(attacker, target, ally, attack, damage)
+                        for handler in (ally.trait, ally.gear)
+                        if 'on_ally_damage' in handler.hooks
+                    )
+                for effect in damage_effects:
+                    effect.apply_outcome(
                         attacker=attacker,
                         target=target,
                         ally=ally,
@@ -281,73 +439,183 @@ class Battle:
 
                 target.take_damage(damage)
 
-                if damage > 0 and attack['target'] == 'clockwise' and clockwise_mod != 0.6:
+                if damage > 0 and attack.target == 'clockwise' and clockwise_mod != 0.6:
                     clockwise_mod = {
                         1.0: 0.7,
                         0.7: 0.6,
                     }[clockwise_mod]
 
-        effects = []
         for target in targets:
-
-            for effect in (
-                attacker.trait.after_attack(attacker, target, attack),
-                attacker.gear.after_attack(attacker, target, attack),
-            ):
-                effect.apply(
+            for handler in (attacker.trait, attacker.gear):
+                if 'after_attack' not in handler.hooks:
+                    continue
+                handler.after_attack(attacker, target, attack).apply_outcome(
                     attacker=attacker,
                     target=target,
-                    ally=ally,
+                    ally=target.ally,
                     opposing_team=opposing_team,
                 )
 
-            if target.HP <= 0:
-                self._handle_ko(target)
-
+        # KO'd tems are taken off the field by Battle._process_turn
         attacker.moves[choice.detail] = -1  # incremented in TemTem.end_turn()
 
     def process_turn(self, choices):
+        from .rng import using
+
+        with using(self.rng):
+            if self.profiler is None:
+                self._process_turn(choices)
+                return
+            try:
+                self._process_turn(choices)
+            finally:
+                self.profiler.phase(None)
+
+    def _process_turn(self, choices):
+        if self.log is not None:
+            self.log.turn(choices)
+
         # Start-of-turn effects
+        if self.profiler is not None:
+            self.profiler.phase('start')
         for side, tem_slot in self._active_tems_by_speed():
             (tem := self.teams[side][tem_slot]).start_turn()
             if tem.fainted and self._check_win(sides=(side,)):
                 return
+        self._handle_kos()
+        self._log_changes()
 
         # Run actions that result from choices
+        if self.profiler is not None:
+            self.profiler.phase('actions')
         for side, tem_slot in self._actions_gen(choices):
+            if self.active_tem(side, tem_slot) is None:  # KO'd earlier this turn
+                continue
             choice = choices[side][tem_slot]
+            if self.log is not None:
+                self.log.action(side, tem_slot)
 
             if choice.action == 'run':
                 raise NotImplementedError()
             elif choice.action == 'item':
                 raise NotImplementedError()
             elif choice.action == 'switch':
-                self._process_switch(choice, side, tem_slot, choice)
+                self._process_switch(side, tem_slot, choice)
             elif choice.action == 'rest':
-                raise NotImplementedError()
+                self._process_rest(side, tem_slot)
             else:
-                self._process_attack(choice, side, tem_slot, choice)
+                self._process_attack(side, tem_slot, choice)
 
+            self._handle_kos()
             if self._check_win():
                 return
+            self._log_changes()
 
         # End-of-turn effects
+        if self.profiler is not None:
+            self.profiler.phase('end')
         ended_turn = []
         for side, tem_slot in self._active_tems_by_speed():
             (tem := self.teams[side][tem_slot]).end_turn(active=True)
             if tem.fainted and self._check_win(sides=(side,)):
                 return
-            ended_turn.append(tem)
+            ended_turn.append(id(tem))
 
         for side in (0, 1):
             for tem in self.teams[side]:
-                if tem not in ended_turn:
+                if id(tem) not in ended_turn:
                     tem.end_turn(active=False)
+        self._handle_kos()
 
         # Finally, replace tems that fainted
-        raise NotImplementedError()
+        self._replace_fainted()
+        self._log_changes()
 
 
 def other(x, /):
     ''' Improves readability for e.g. other(side), other(tem_slot) '''
     return 1 - x
+
+
+# Tests
+def test_battle_snapshot():
+    from .static import Stats, Statuses
+    from .temtem import CompactTemTem, TemTem
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    teams = [
+        [TemTem.from_importable(GYALIS_IMPORT), TemTem.from_importable(KINU_IMPORT)],
+        [
+            CompactTemTem.from_importable(KINU_IMPORT),
+            CompactTemTem.from_importable(GYALIS_IMPORT),
+        ],
+    ]
+    for team in teams:
+        team[0].ally, team[1].ally = team[1], team[0]
+    battle = Battle(teams, [[0, 1], [0, 1]], 0)
+    state = battle.snapshot()
+    assert hash(state) == hash(battle.snapshot())
+    atk = teams[0][0].Atk
+    rolls = [battle.rng.random() for _ in range(3)]
+
+    battle.active[1][0] = None
+    battle.speed_arrow = 1
+    for team in teams:
+        tem = team[0]
+        tem.take_damage(50)
+        tem.use_stamina(10)
+        tem.apply_boost(Stats.Atk, 2)
+        tem.apply_status(Statuses.burned, 2)
+        tem.moves['Beta Burst' if 'Beta Burst' in tem.moves else 'Crystal Bite'] = -1
+        tem.ally = None
+    assert battle.snapshot() != state
+
+    battle.restore(state)
+    assert battle.snapshot() == state
+    assert battle.active == [[0, 1], [0, 1]]
+    assert teams[0][0].Atk == atk
+    assert not teams[1][0].burned
+    assert teams[1][0].ally is teams[1][1]
+    assert [battle.rng.random() for _ in range(3)] == rolls
+
+    # Without the rng, positions compare equal whatever the rolls to come
+    position = battle.snapshot(with_rng=False)
+    battle.rng.random()
+    assert battle.snapshot(with_rng=False) == position != battle.snapshot()
+
+
+def test_process_turn():
+    from .temtem import gen_tems
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    teams = [
+        list(gen_tems(f'{GYALIS_IMPORT}\n\n{KINU_IMPORT}\n\n{KINU_IMPORT}')),
+        list(gen_tems(f'{KINU_IMPORT}\n\n{GYALIS_IMPORT}')),
+    ]
+    for team in teams:
+        team[0].ally, team[1].ally = team[1], team[0]
+    battle = Battle(teams, [[0, 1], [0, 1]], 0)
+
+    # A KO'd tem is replaced from the bench at the end of the turn
+    teams[0][0].take_damage(teams[0][0].max_hp)
+    rest = [Choice('rest'), Choice('rest')]
+    battle.process_turn([[None, rest[0]], rest])
+    assert battle.active == [[2, 1], [0, 1]]
+    assert teams[0][2].ally is teams[0][1] and teams[0][1].ally is teams[0][2]
+    assert teams[0][0].ally is None
+    assert battle.winner is None
+
+    # Attacks hit their targets, and the side with tems left wins
+    kinu, target = teams[0][1], teams[1][0]
+    kinu.moves['Beta Burst'] = 5
+    hp = target.HP
+    battle.process_turn([
+        [Choice('rest'), Choice('attack', 'Beta Burst', [(1, 0)])],
+        [Choice('rest'), Choice('rest')],
+    ])
+    assert target.HP < hp
+    assert kinu.moves['Beta Burst'] == 0  # the hold restarts after use
+    for tem in teams[1]:
+        tem.take_damage(tem.max_hp)
+    battle.process_turn([rest, rest])
+    assert battle.winner == 0
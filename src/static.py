@@ -19,18 +19,43 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import os
+import hashlib
+import pickle
+import sys
+import threading
 
+from collections.abc import Mapping
+from contextlib import suppress
 from enum import Enum, unique, auto
+import numpy as np
 import yaml
 
 import logging
 log = logging.getLogger(__name__)
 
 TEMTEM_DATA = None
+TEMTEM_INDEX = None  # query.TemTemIndex over TEMTEM_DATA
+STATIC_TABLES = None  # StaticTables over TEMTEM_DATA
 TEMTEM_YAML = os.path.join('data', 'temtem.yaml')
 ATTACK_DATA = None
+# {attack name: (synergy type, attacks)}, filled in by resolve_attack()
+ATTACK_RESOLUTION = None
 ATTACK_YAML = os.path.join('data', 'attacks.yaml')
 
+# Held while loading data or compiling entries, so lookups are thread-safe
+_LOCK = threading.RLock()
+# The multiprocessing.shared_memory segment from share_static_data() or
+# attach_static_data(), if any, and (process id, whether it created it)
+SHARED_SEGMENT = None
+_SHARED_BY = None
+
+# The compiled entries of each yaml file are pickled next to it, e.g.
+# data/temtem.yaml.cache, so only the first process to see a change to the
+# yaml pays for parsing it. Bump CACHE_VERSION whenever the compiled form of
+# the data changes, so that stale caches are rebuilt.
+USE_CACHE = True
+CACHE_VERSION = 7
+
 
 class _ReprEnum(Enum):
     def __repr__(self):
@@ -272,6 +297,39 @@ TYPE_EFFECTIVENESS = {
     },
 }
 
+# Integer ids for types, for indexing tables. NO_TYPE stands in for the
+# missing second type of single-typed tems.
+TYPE_IDS = {type_: idx for idx, type_ in enumerate(Types)}
+NO_TYPE = len(TYPE_IDS)
+N_TYPE_COMBOS = len(TYPE_IDS) * (NO_TYPE + 1)
+
+
+def type_combo(types) -> int:
+    """
+    An id for a tem's (type1, type2) pair, where type2 may be None.
+    """
+    type1, type2 = types
+    return TYPE_IDS[type1] * (NO_TYPE + 1) + (TYPE_IDS[type2] if type2 else NO_TYPE)
+
+
+# lookup table: COMBO_EFFECTIVENESS[attack type id][type_combo(target types)]
+# = effectiveness, with the product for dual types already taken. This has
+# every pair of types, so covers any tem in temtem.yaml.
+COMBO_EFFECTIVENESS = tuple(
+    tuple(
+        TYPE_EFFECTIVENESS[attack][type1]
+        * (TYPE_EFFECTIVENESS[attack][type2] if type2 else 1.0)
+        for type1 in Types for type2 in (*Types, None)
+    )
+    for attack in Types
+)
+
+# Integer codes for attack classes and targets
+ATTACK_CLASSES = ('Physical', 'Special', 'Status')
+PHYSICAL, SPECIAL, STATUS = range(len(ATTACK_CLASSES))
+ATTACK_TARGETS = ('single', 'other', 'all other', 'all', 'self', 'team', 'team or ally')
+ATTACK_TARGET_IDS = {target: idx for idx, target in enumerate(ATTACK_TARGETS)}
+
 DEFAULT_LEVEL = 58
 
 STATUS_CATCH_BONUS = {
@@ -289,83 +347,692 @@ STATUS_CATCH_BONUS = {
 }
 
 
+def _cache_path(yaml_path):
+    return f'{yaml_path}.cache'
+
+
+def _split_entries(raw):
+    """
+    {name: yaml text} for each top-level entry of a yaml file, without
+    parsing the entries themselves.
+    """
+    entries = {}
+    name = None
+    for line in raw.decode('utf-8').splitlines(keepends=True):
+        if line[:1] not in ('', ' ', '\t', '\n', '#', '-'):
+            name = line.split(':', 1)[0]
+            if name[:1] in ('"', "'"):
+                # Only scan as far as the key, as its value may go on to
+                # later lines
+                name = next(
+                    token.value for token in yaml.scan(line)
+                    if isinstance(token, yaml.ScalarToken)
+                )
+            entries[name] = line
+        elif name is not None:
+            entries[name] += line
+    return entries
+
+
+def _read_cache(cache_path, yaml_stat):
+    """
+    Returns (header, entries) from the cache, where entries holds each
+    pickled entry at header['index'][name] = (offset, length). Returns
+    (header, None) if the cache can't be used without first checking the
+    hash of the yaml file.
+    """
+    with open(cache_path, 'rb') as fp:
+        header = pickle.load(fp)
+        if header.get('version') != CACHE_VERSION:
+            return None, None
+        entries = memoryview(fp.read())
+    if (header['mtime'], header['size']) == (yaml_stat.st_mtime_ns, yaml_stat.st_size):
+        return header, entries
+    return header, None
+
+
+def _write_cache(cache_path, header, entries):
+    # Write to a temporary file first, so that other processes never see a
+    # half-written cache.
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump(header, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            fp.write(entries)
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        log.warning('Unable to write cache %s: %r', cache_path, err)
+        with suppress(OSError):
+            os.remove(tmp_path)
+
+
+def _pickle_entries(entries):
+    """ ({name: (offset, length)}, the pickled entries end to end) """
+    chunks, index, offset = [], {}, 0
+    for name, entry in entries.items():
+        chunks.append(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        index[name] = (offset, len(chunks[-1]))
+        offset += len(chunks[-1])
+    return index, b''.join(chunks)
+
+
+class LazyData(dict):
+    """
+    The compiled entries of a yaml file, keyed by name, where each entry is
+    only compiled (or unpickled from the cache) when it's first looked up.
+
+    Loaded entries are stored in the dict itself, so looking them up again is
+    a plain dict lookup, and only the first lookup of a name goes through
+    __missing__(). Names that aren't in the file are answered by the index
+    of the file's entries, so misses cost a dict lookup and aren't stored.
+    Iterating, len() and `in` cover every entry in the file, loaded or not.
+
+    compile_entry(name, data, names) compiles one entry, given the names of
+    every entry (e.g. to link an attack to its synergy variant).
+
+    The cache is trusted if the yaml's mtime and size match those recorded
+    when it was built; otherwise the yaml is hashed, and it's only recompiled
+    if the contents really have changed. Building the cache compiles every
+    entry, so only the first process to see a change to the yaml pays for
+    that.
+
+    Lookups are thread-safe. With index and cached given, entries are read
+    from those (see attach_static_data()) rather than from the yaml or cache.
+    """
+
+    def __init__(self, yaml_path, compile_entry, index=None, cached=None):
+        super().__init__()
+        self.yaml_path = yaml_path
+        self._compile_entry = compile_entry
+        # Where uncompiled entries come from: the cache's index and pickled
+        # entries, or {name: yaml text}
+        self._index = {}
+        self._cached = None
+        if cached is None:
+            self._open()
+        else:
+            self._index, self._cached = index, cached
+
+    def __repr__(self):
+        return f'<LazyData {self.yaml_path}: {dict.__len__(self)}/{len(self._index)} loaded>'
+
+    def _compile(self, name, text):
+        data = yaml.load(text, Loader=yaml.FullLoader)[name]
+        return self._compile_entry(name, data, self._index)
+
+    def _open(self):
+        yaml_stat = os.stat(self.yaml_path)
+        cache_path = _cache_path(self.yaml_path)
+        header = None
+        if USE_CACHE:
+            try:
+                header, cached = _read_cache(cache_path, yaml_stat)
+            except FileNotFoundError:
+                pass
+            except Exception as err:
+                log.warning('Ignoring unreadable cache %s: %r', cache_path, err)
+            else:
+                if cached is not None:
+                    self._index, self._cached = header['index'], cached
+                    return
+
+        with open(self.yaml_path, 'rb') as fp:
+            raw = fp.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if not USE_CACHE:
+            self._index = _split_entries(raw)
+            return
+
+        entries = None
+        if header is not None and header['sha256'] == digest:
+            # Only the mtime changed, e.g. from a fresh checkout
+            with suppress(Exception), open(cache_path, 'rb') as fp:
+                pickle.load(fp)
+                entries = fp.read()
+                index = header['index']
+        if entries is None:
+            self._index = _split_entries(raw)
+            for name, text in self._index.items():
+                dict.__setitem__(self, name, self._compile(name, text))
+            index, entries = _pickle_entries(dict(self.items()))
+
+        header = {
+            'version': CACHE_VERSION,
+            'mtime': yaml_stat.st_mtime_ns,
+            'size': yaml_stat.st_size,
+            'sha256': digest,
+            'index': index,
+        }
+        _write_cache(cache_path, header, entries)
+        self._index, self._cached = index, memoryview(entries)
+
+    def __missing__(self, name):
+        # Called by dict.__getitem__ for entries that aren't loaded yet
+        try:
+            source = self._index[name]
+        except KeyError:
+            raise KeyError(name) from None
+
+        with _LOCK:
+            # Another thread may have got here first
+            if (entry := dict.get(self, name)) is not None:
+                return entry
+            if self._cached is not None:
+                offset, length = source
+                entry = pickle.loads(self._cached[offset:offset + length])
+            else:
+                entry = self._compile(name, source)
+            dict.__setitem__(self, name, entry)
+        return entry
+
+    def loaded(self):
+        """ The names of the entries that have been loaded so far """
+        return set(dict.keys(self))
+
+    def pickled(self):
+        """
+        ({name: (offset, length)}, every entry pickled end to end), as in the
+        cache. Entries are compiled if there's no cache.
+        """
+        if self._cached is not None:
+            return self._index, bytes(self._cached)
+        return _pickle_entries({name: self[name] for name in self})
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._index.keys()
+
+    def items(self):
+        return ((name, self[name]) for name in self._index)
+
+    def values(self):
+        return (self[name] for name in self._index)
+
+
+def _compile_temtem(name, tem_data, names):
+    for stat in Stats:
+        tem_data['Stats'][stat] = tem_data['Stats'][stat.name]
+        del tem_data['Stats'][stat.name]
+    tem_data['Types'] = tuple([
+        (Types[t] if t else None) for t in tem_data['Types']
+    ])
+    tem_data['Traits'] = tuple(tem_data['Traits'])
+    return tem_data
+
+
 def load_temtem_data():
     """
-    This function reads data from the TEMTEM_YAML, and manipulates it so that
-    stat names become stat enums, etc.
+    This function opens TEMTEM_YAML as a LazyData, which turns stat names
+    into stat enums, etc. as each species is looked up. TEMTEM_INDEX and
+    STATIC_TABLES are rebuilt when they're next needed.
     """
-    global TEMTEM_DATA
-    with open(TEMTEM_YAML, 'r') as fp:
-        data = yaml.load(fp, Loader=yaml.FullLoader)
-    for tem_data in data.values():
-        for stat in Stats:
-            tem_data['Stats'][stat] = tem_data['Stats'][stat.name]
-            del tem_data['Stats'][stat.name]
-        tem_data['Types'] = tuple([
-            (Types[t] if t else None) for t in tem_data['Types']
-        ])
-        tem_data['Traits'] = tuple(tem_data['Traits'])
-
-    # sanity checks
-    if TEMTEM_DATA is not None:
-        for tem in TEMTEM_DATA:
-            if tem not in data:
-                log.error('Lost data on %s when reloading %s', tem, TEMTEM_YAML)
-
-    TEMTEM_DATA = data
+    global TEMTEM_DATA, TEMTEM_INDEX, STATIC_TABLES
+    with _LOCK:
+        data = LazyData(TEMTEM_YAML, _compile_temtem)
 
+        # sanity checks
+        if TEMTEM_DATA is not None:
+            for tem in TEMTEM_DATA:
+                if tem not in data:
+                    log.error('Lost data on %s when reloading %s', tem, TEMTEM_YAML)
 
-def load_attack_data():
-    from .effects import Effect
+        TEMTEM_DATA = data
+        TEMTEM_INDEX = STATIC_TABLES = None
+
+
+class Attack(Mapping):
+    """
+    An immutable compiled attack. Fields are attributes, with integer codes
+    for the class, type and target, and the synergy variant of a move (e.g.
+    'Aqua Stone' -> 'Aqua Stone +earth') and back precomputed.
+
+    For existing code, it's also a read-only mapping with the same keys as the
+    attack's entry in attacks.yaml, e.g. attack['class'].
+    """
+    __slots__ = (
+        'name',
+        'type',
+        'type_id',
+        'attack_class',
+        'class_id',
+        'damage',
+        'stamina',
+        'hold',
+        'priority',
+        'target',
+        'target_id',
+        'effects',
+        'self_effects',
+        'synergy_type',
+        'synergy_move',
+        'synergy_variant',  # name of this move's synergy variant, if any
+        'synergy_base',  # for synergy variants, the name of the move without synergy
+        'extra',  # any other keys from the yaml
+        'defaulted',  # attributes given a default as they weren't in the yaml
+    )
+
+    # {mapping key: attribute}. Keys whose attribute is None or defaulted are
+    # left out of the mapping, as they were from the yaml.
+    KEYS = {
+        'name': 'name',
+        'type': 'type',
+        'class': 'attack_class',
+        'damage': 'damage',
+        'stamina': 'stamina',
+        'hold': 'hold',
+        'priority': 'priority',
+        'target': 'target',
+        'effects': 'effects',
+        'self': 'self_effects',
+        'synergy type': 'synergy_type',
+        'synergy move': 'synergy_move',
+    }
+
+    def __init__(self, atk_data, **links):
+        atk_data = dict(atk_data)
+        fields = {attr: atk_data.pop(key, None) for key, attr in self.KEYS.items()}
+        fields['type_id'] = TYPE_IDS[fields['type']]
+        fields['class_id'] = ATTACK_CLASSES.index(fields['attack_class'])
+        fields['target_id'] = ATTACK_TARGET_IDS.get(fields['target'])
+        fields['defaulted'] = frozenset(
+            attr for attr in ('damage', 'hold') if fields[attr] is None
+        )
+        for attr in fields['defaulted']:
+            fields[attr] = 0
+        fields['synergy_variant'] = links.get('synergy_variant')
+        fields['synergy_base'] = links.get('synergy_base')
+        fields['extra'] = atk_data
+        self.__setstate__(fields)
+
+    def replace(self, **changes) -> 'Attack':
+        """
+        A copy of this attack with some attributes changed, e.g.
+        attack.replace(type=Types.water).
+        """
+        if 'type' in changes:
+            changes.setdefault('type_id', TYPE_IDS[changes['type']])
+        attack = object.__new__(Attack)
+        attack.__setstate__({**self.__getstate__(), **changes})
+        return attack
 
-    global ATTACK_DATA
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def __setstate__(self, state):
+        for attr in self.__slots__:
+            object.__setattr__(self, attr, state[attr])
+
+    def __setattr__(self, attr, value):
+        raise AttributeError(f'{self.name} is read-only')
+
+    def __delattr__(self, attr):
+        raise AttributeError(f'{self.name} is read-only')
+
+    def __repr__(self):
+        return f'<Attack {self.name}>'
+
+    def __getitem__(self, key):
+        try:
+            attr = self.KEYS[key]
+        except KeyError:
+            return self.extra[key]
+        if (value := getattr(self, attr)) is None or attr in self.defaulted:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key, attr in self.KEYS.items():
+            if getattr(self, attr) is not None and attr not in self.defaulted:
+                yield key
+        yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    # Mapping would make these unhashable, but attacks are immutable
+    def __hash__(self):
+        return hash(self.name)
+
+
+def _compile_attack(attack, atk_data, names):
+    from .effects import HP_FRACTION, STA_FRACTION, Effect
 
     def gen_effect_dict(effects):
         tmp_dict = {}
         for key, value in effects.items():
             try:
-                tmp_dict[Stats[key]] = value
+                stat = Stats[key]
             except KeyError:
                 try:
                     tmp_dict[Statuses[key]] = value
                 except KeyError:
                     tmp_dict[key] = value
+                continue
+            # HP and stamina changes are a fraction of the tem's maximum, unless
+            # given as an 'HP amount' or 'Sta amount' (kept as they are above)
+            if stat == Stats.HP:
+                tmp_dict[HP_FRACTION] = value
+            elif stat == Stats.Sta:
+                tmp_dict[STA_FRACTION] = value
+            else:
+                tmp_dict[stat] = value
         return tmp_dict
 
-    with open(ATTACK_YAML, 'r') as fp:
-        data = yaml.load(fp, Loader=yaml.FullLoader)
+    atk_data['name'] = attack
+    atk_data['type'] = Types[atk_data['type']]
+    if 'synergy type' in atk_data:
+        atk_data['synergy type'] = Types[atk_data['synergy type']]
 
-    for attack, atk_data in data.items():
-        atk_data['name'] = attack
-        atk_data['type'] = Types[atk_data['type']]
-        if 'synergy type' in atk_data:
-            atk_data['synergy type'] = Types[atk_data['synergy type']]
+    atk_data['effects'] = Effect(
+        attacker=gen_effect_dict(atk_data.get('self', {})),
+        target=gen_effect_dict(atk_data.get('effects', {})),
+    )
 
-        if 'damage' not in atk_data:
-            atk_data['damage'] = 0
+    links = {}
+    if atk_data.get('synergy move'):
+        links['synergy_base'] = attack.split(' +')[0]
+    elif 'synergy type' in atk_data:
+        variant = f'{attack} +{atk_data["synergy type"].name}'
+        if variant in names:
+            links['synergy_variant'] = variant
+    return Attack(atk_data, **links)
 
-        atk_data['effects'] = Effect(
-            attacker=gen_effect_dict(atk_data.get('self', {})),
-            target=gen_effect_dict(atk_data.get('effects', {})),
-        )
 
-    ATTACK_DATA = data
+def _attack_resolution(attacks, name):
+    """
+    For the attack name, the attack actually used without and with synergy,
+    and without and with Shuine's Horn (which makes toxic moves water). A
+    move and its synergy variant share an entry.
+    """
+    def with_horn(attack):
+        return attack.replace(type=Types.water) if attack.type == Types.toxic else attack
+
+    attack = attacks[name]
+    if attack.synergy_base is not None:
+        attack = attacks[attack.synergy_base]
+    synergy = attacks[attack.synergy_variant] if attack.synergy_variant else attack
+    return (
+        attack.synergy_type,
+        (attack, synergy, with_horn(attack), with_horn(synergy)),
+    )
+
+
+def load_attack_data():
+    global ATTACK_DATA, ATTACK_RESOLUTION
+    with _LOCK:
+        ATTACK_DATA = LazyData(ATTACK_YAML, _compile_attack)
+        ATTACK_RESOLUTION = {}
 
 
 def lookup_temtem_data(name):
-    try:
-        return TEMTEM_DATA[name]
-    except (KeyError, TypeError):
-        load_temtem_data()
-        return TEMTEM_DATA[name]
+    if TEMTEM_DATA is None:
+        with _LOCK:
+            if TEMTEM_DATA is None:
+                load_temtem_data()
+    return TEMTEM_DATA[name]
 
 
 def lookup_attack(name):
+    if ATTACK_DATA is None:
+        with _LOCK:
+            if ATTACK_DATA is None:
+                load_attack_data()
+    return ATTACK_DATA[name]
+
+
+def resolve_attack(name, ally_types=(), shuines_horn=False):
+    """
+    The attack a tem actually uses when it chooses the move name (or its
+    synergy variant), given its ally's types and whether its Shuine's Horn is
+    in effect.
+    """
     try:
-        return ATTACK_DATA[name]
+        synergy_type, attacks = ATTACK_RESOLUTION[name]
     except (KeyError, TypeError):
-        load_attack_data()
-        return ATTACK_DATA[name]
+        lookup_attack(name)
+        with _LOCK:
+            synergy_type, attacks = entry = _attack_resolution(ATTACK_DATA, name)
+            ATTACK_RESOLUTION[attacks[0].name] = ATTACK_RESOLUTION[attacks[1].name] = entry
+    # Moves without synergy have the same attack in both slots, so it doesn't
+    # matter that None is in single-typed tems' types
+    return attacks[(synergy_type in ally_types) + 2 * shuines_horn]
+
+
+class StaticTables:
+    """
+    Numeric tables over every species in TEMTEM_DATA, for vectorised code:
+    - species: species names, where a species' id is its index
+    - base_stats[species id, stat id]: base stats, with stats in Stats order
+    - type_ids[species id]: the TYPE_IDS of its two types (NO_TYPE if it only
+      has one)
+    - moves: every move in a learnset, where a move's id is its index
+    - learnset_offsets, learnset_moves: the ids of the moves species id can
+      learn are learnset_moves[learnset_offsets[id]:learnset_offsets[id + 1]]
+
+    Built on first use as STATIC_TABLES by static_tables(). In workers
+    attached to shared static data, the arrays are read-only views on the
+    shared memory segment.
+    """
+    ARRAYS = ('base_stats', 'type_ids', 'learnset_offsets', 'learnset_moves')
+
+    def __init__(self, species, moves, arrays):
+        self.species = species
+        self.moves = moves
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __repr__(self):
+        return f'<StaticTables {len(self.species)} species, {len(self.moves)} moves>'
+
+    @classmethod
+    def build(cls, data):
+        species = tuple(data)
+        learnsets = [
+            sorted({move for moves in data[name]['Moves'].values() for move in moves})
+            for name in species
+        ]
+        moves = tuple(sorted({move for learnset in learnsets for move in learnset}))
+        move_ids = {move: idx for idx, move in enumerate(moves)}
+        arrays = {
+            'base_stats': np.array(
+                [[data[name]['Stats'][stat] for stat in Stats] for name in species],
+                dtype=np.int64,
+            ),
+            'type_ids': np.array([
+                ([TYPE_IDS[type_] for type_ in data[name]['Types'] if type_] + [NO_TYPE])[:2]
+                for name in species
+            ], dtype=np.int8),
+            'learnset_offsets': np.cumsum(
+                [0] + [len(learnset) for learnset in learnsets], dtype=np.int32
+            ),
+            'learnset_moves': np.array(
+                [move_ids[move] for learnset in learnsets for move in learnset], dtype=np.int32
+            ),
+        }
+        return cls(species, moves, arrays)
+
+    def learnset(self, species_id: int) -> np.ndarray:
+        """ The ids of the moves species_id can learn """
+        offsets = self.learnset_offsets
+        return self.learnset_moves[offsets[species_id]:offsets[species_id + 1]]
+
+
+def static_tables() -> StaticTables:
+    global STATIC_TABLES
+    if STATIC_TABLES is None:
+        with _LOCK:
+            if TEMTEM_DATA is None:
+                load_temtem_data()
+            if STATIC_TABLES is None:
+                STATIC_TABLES = StaticTables.build(TEMTEM_DATA)
+    return STATIC_TABLES
+
+
+class _AttachedSegment:
+    """
+    A shared memory segment mapped read-only, without registering it with
+    the resource tracker, like SharedMemory(name, track=False) in python
+    3.13+. Pool workers share their parent's tracker, and only the process
+    that created the segment should register and unlink it (see bpo-39959).
+    """
+
+    def __init__(self, name):
+        import mmap
+        import _posixshmem
+
+        fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+
+def _open_segment(name):
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    if os.name != 'posix':
+        # Only POSIX shared memory uses the resource tracker
+        return shared_memory.SharedMemory(name)
+    return _AttachedSegment(name)
+
+
+def share_static_data() -> str:
+    """
+    Put the compiled species and attacks (stats, types, learnsets, attack
+    records, etc.) and the StaticTables arrays into a read-only shared memory
+    segment, and return its name for attach_static_data().
+
+    Worker processes attach to the segment instead of each reading the yaml
+    or cache, and share its pages. Pools started by this library (e.g.
+    montecarlo.run_matchup()) attach automatically, see shared_pool_kwargs().
+    The segment lasts until release_static_data().
+    """
+    from multiprocessing import shared_memory
+
+    global SHARED_SEGMENT, _SHARED_BY
+    with _LOCK:
+        if SHARED_SEGMENT is not None and _SHARED_BY == (os.getpid(), True):
+            return SHARED_SEGMENT.name
+        if TEMTEM_DATA is None:
+            load_temtem_data()
+        if ATTACK_DATA is None:
+            load_attack_data()
+
+        directory, blobs, offset = {}, [], 0
+        for key, data in (('temtem', TEMTEM_DATA), ('attacks', ATTACK_DATA)):
+            index, entries = data.pickled()
+            directory[key] = (index, offset, len(entries))
+            blobs.append(entries)
+            offset += len(entries)
+
+        # Arrays are aligned, as numpy views on them are faster that way
+        tables, layout = static_tables(), {}
+        for name in StaticTables.ARRAYS:
+            array = np.ascontiguousarray(getattr(tables, name))
+            padding = -offset % 16
+            blobs.append(bytes(padding))
+            offset += padding
+            layout[name] = (offset, array.dtype.str, array.shape)
+            blobs.append(array.tobytes())
+            offset += array.nbytes
+        directory['tables'] = (tables.species, tables.moves, layout)
+        header = pickle.dumps(directory, protocol=pickle.HIGHEST_PROTOCOL)
+        # Offsets are from the end of the header, so pad it to keep the
+        # arrays aligned (unpickling ignores anything after the pickle)
+        header += bytes(-(8 + len(header)) % 16)
+        size = 8 + len(header) + offset
+
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        segment.buf[:8] = len(header).to_bytes(8, 'little')
+        segment.buf[8:8 + len(header)] = header
+        segment.buf[8 + len(header):size] = b''.join(blobs)
+        SHARED_SEGMENT, _SHARED_BY = segment, (os.getpid(), True)
+        return segment.name
+
+
+def attach_static_data(name: str):
+    """
+    Use the species and attacks in the shared memory segment name, from
+    share_static_data() in another process, in place of TEMTEM_DATA and
+    ATTACK_DATA. Entries are still only unpickled when they're looked up, and
+    STATIC_TABLES is made of views on the segment.
+    """
+    global SHARED_SEGMENT, _SHARED_BY
+    global TEMTEM_DATA, TEMTEM_INDEX, ATTACK_DATA, ATTACK_RESOLUTION, STATIC_TABLES
+    with _LOCK:
+        # A forked worker inherits its parent's SHARED_SEGMENT, but not its
+        # data's pages, so still needs to attach
+        if SHARED_SEGMENT is not None and _SHARED_BY[0] == os.getpid():
+            return
+        segment = _open_segment(name)
+        buf = segment.buf.toreadonly()
+        header_size = int.from_bytes(buf[:8], 'little')
+        directory = pickle.loads(buf[8:8 + header_size])
+
+        def shared_data(key, yaml_path, compile_entry):
+            index, offset, size = directory[key]
+            start = 8 + header_size + offset
+            return LazyData(yaml_path, compile_entry, index, buf[start:start + size])
+
+        TEMTEM_DATA = shared_data('temtem', TEMTEM_YAML, _compile_temtem)
+        ATTACK_DATA = shared_data('attacks', ATTACK_YAML, _compile_attack)
+        TEMTEM_INDEX = None
+
+        species, moves, layout = directory['tables']
+        STATIC_TABLES = StaticTables(species, moves, {
+            name: np.frombuffer(
+                buf, dtype, int(np.prod(shape)), 8 + header_size + offset
+            ).reshape(shape)
+            for name, (offset, dtype, shape) in layout.items()
+        })
+        ATTACK_RESOLUTION = {}
+        SHARED_SEGMENT, _SHARED_BY = segment, (os.getpid(), False)
+
+
+def release_static_data():
+    """
+    Stop sharing the segment from share_static_data(), in the process that
+    shared it. The data is reloaded from the yaml or cache when next needed.
+    """
+    global SHARED_SEGMENT, _SHARED_BY
+    global TEMTEM_DATA, TEMTEM_INDEX, ATTACK_DATA, ATTACK_RESOLUTION, STATIC_TABLES
+    with _LOCK:
+        if SHARED_SEGMENT is None or _SHARED_BY != (os.getpid(), True):
+            return
+        TEMTEM_DATA = TEMTEM_INDEX = ATTACK_DATA = ATTACK_RESOLUTION = STATIC_TABLES = None
+        segment, SHARED_SEGMENT, _SHARED_BY = SHARED_SEGMENT, None, None
+        segment.close()
+        segment.unlink()
+
+
+def shared_pool_kwargs() -> dict:
+    """
+    Keyword arguments for ProcessPoolExecutor, so that its workers attach to
+    the shared static data, if it's being shared.
+    """
+    if SHARED_SEGMENT is None or _SHARED_BY != (os.getpid(), True):
+        return {}
+    return {'initializer': attach_static_data, 'initargs': (SHARED_SEGMENT.name,)}
 
 
 # Tests
@@ -393,8 +1060,223 @@ def test_lookup_attack():
         ('Stone Wall', STONE_WALL_DATA),
         ('Stare', STARE_DATA),
     ):
-        lookup_data = lookup_attack(name)
+        lookup_data = dict(lookup_attack(name))
         del lookup_data['effects']
         with suppress(KeyError):
             del lookup_data['self']
         assert lookup_data == data
+
+
+def test_attack_record():
+    from copy import copy
+
+    attack = lookup_attack('Aqua Stone')
+    assert isinstance(attack, Attack)
+    assert attack['class'] == attack.attack_class == ATTACK_CLASSES[attack.class_id]
+    assert attack.type_id == TYPE_IDS[attack['type']]
+    assert attack.target == ATTACK_TARGETS[attack.target_id]
+    assert 'self' not in attack and 'synergy type' in attack
+    assert 'type_id' not in attack
+    assert dict(attack)['synergy type'] is attack.synergy_type
+
+    # Rainbow Guard has no hold in the yaml
+    rainbow_guard = lookup_attack('Rainbow Guard')
+    assert rainbow_guard.hold == 0 and 'hold' not in rainbow_guard
+    try:
+        rainbow_guard['hold']
+        assert False, 'hold should be missing, as in the yaml'
+    except KeyError:
+        pass
+
+    variant = lookup_attack(attack.synergy_variant)
+    assert variant.name == f'Aqua Stone +{attack.synergy_type.name}'
+    assert variant.synergy_base == 'Aqua Stone' and variant.synergy_variant is None
+
+    try:
+        attack.damage = 0
+        assert False, 'attacks should be read-only'
+    except AttributeError:
+        pass
+
+    toxic = attack.replace(type=Types.toxic)
+    assert toxic.type is Types.toxic and toxic.type_id == TYPE_IDS[Types.toxic]
+    assert attack['type'] is Types.water
+
+    def without_effects(attack):
+        return {key: value for key, value in attack.items() if key != 'effects'}
+
+    assert copy(attack) == attack
+    restored = pickle.loads(pickle.dumps(attack))
+    assert without_effects(restored) == without_effects(attack)
+    assert hash(restored) == hash(attack)
+
+
+def test_compiled_cache(tmp_path):
+    yaml_path = str(tmp_path / 'test.yaml')
+    compiled = []
+
+    def compile_entry(name, data, names):
+        compiled.append(name)
+        return data
+
+    with open(yaml_path, 'w') as fp:
+        fp.write('a: 1\n')
+    assert dict(LazyData(yaml_path, compile_entry)) == {'a': 1}
+    assert dict(LazyData(yaml_path, compile_entry)) == {'a': 1}
+    assert len(compiled) == 1
+
+    # touching the file means rehashing, but not recompiling
+    os.utime(yaml_path, ns=(0, 0))
+    assert dict(LazyData(yaml_path, compile_entry)) == {'a': 1}
+    assert len(compiled) == 1
+
+    with open(yaml_path, 'w') as fp:
+        fp.write('a: 2\n')
+    assert dict(LazyData(yaml_path, compile_entry)) == {'a': 2}
+    assert len(compiled) == 2
+
+
+def test_split_entries():
+    raw = b"""---
+# comment
+a: |
+    line 1
+
+    line 2
+b: >
+    folded
+    text
+c: [1,
+  2]
+"quoted: \\"key\\"": {x: 1,
+  y: 2}
+'single': 3
+d:
+- x
+- y
+e: plain
+  continued
+"""
+    files = []
+    for path in (TEMTEM_YAML, ATTACK_YAML):
+        with open(path, 'rb') as fp:
+            files.append(fp.read())
+    for raw in (raw, *files):
+        entries = _split_entries(raw)
+        # Each entry parses as LazyData._compile() does, to what loading the
+        # whole file gives
+        assert {
+            name: yaml.load(text, Loader=yaml.FullLoader)[name] for name, text in entries.items()
+        } == yaml.safe_load(raw)
+
+
+def test_lazy_data(tmp_path, monkeypatch):
+    yaml_path = str(tmp_path / 'test.yaml')
+    with open(yaml_path, 'w') as fp:
+        fp.write("a:\n    x: 1\n# comment\nb:\n  - 2\n  - 3\n'c: d':\n    x: 4\n")
+
+    for use_cache in (False, True, True):
+        monkeypatch.setattr(sys.modules[__name__], 'USE_CACHE', use_cache)
+        compiled = []
+
+        def compile_entry(name, data, names):
+            compiled.append(name)
+            return data, 'b' in names
+
+        data = LazyData(yaml_path, compile_entry)
+        assert list(data) == ['a', 'b', 'c: d'] and len(data) == 3
+        if use_cache and os.path.exists(f'{yaml_path}.cache') and not compiled:
+            # Only what's looked up is unpickled
+            assert not data.loaded()
+        assert data['b'] == ([2, 3], True)
+        assert data['c: d'] == ({'x': 4}, True)
+        assert 'a' in data and 'e' not in data
+
+        # Misses don't load or store anything
+        try:
+            data['e']
+            assert False, 'e should be missing'
+        except KeyError:
+            pass
+        assert data.get('e') is None and 'e' not in data.loaded()
+        assert data.loaded() <= {'a', 'b', 'c: d'}
+        assert dict(data) == {'a': ({'x': 1}, True), 'b': ([2, 3], True), 'c: d': ({'x': 4}, True)}
+        assert data.get('a') == ({'x': 1}, True) and data.loaded() == {'a', 'b', 'c: d'}
+
+    # The real data is only compiled as it's used
+    monkeypatch.setattr(sys.modules[__name__], 'USE_CACHE', False)
+    monkeypatch.setattr(sys.modules[__name__], 'ATTACK_DATA', None)
+    monkeypatch.setattr(sys.modules[__name__], 'ATTACK_RESOLUTION', None)
+    assert resolve_attack('Aqua Stone', (Types.earth,)).name == 'Aqua Stone +earth'
+    assert ATTACK_DATA.loaded() == {'Aqua Stone', 'Aqua Stone +earth'}
+    assert ATTACK_RESOLUTION['Aqua Stone +earth'] is ATTACK_RESOLUTION['Aqua Stone']
+
+
+def _shared_lookups(attack, species):
+    # Run in workers by test_shared_static_data()
+    tables = static_tables()
+    species_id = tables.species.index(species)
+    return (
+        SHARED_SEGMENT is not None and _SHARED_BY == (os.getpid(), False),
+        lookup_attack(attack).damage,
+        lookup_temtem_data(species)['Types'],
+        ATTACK_DATA.loaded() | TEMTEM_DATA.loaded(),
+        # The tables are read-only views on the segment
+        all(
+            not array.flags.writeable and not array.flags.owndata
+            for array in (getattr(tables, name) for name in StaticTables.ARRAYS)
+        ),
+        tables.base_stats[species_id].tolist(),
+        tables.type_ids[species_id].tolist(),
+        {tables.moves[move] for move in tables.learnset(species_id)},
+    )
+
+
+def test_shared_static_data():
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    # Threads looking up the same entries compile each of them once
+    compiled = []
+
+    def compile_attack(*args):
+        compiled.append(args[0])
+        return _compile_attack(*args)
+
+    data = LazyData(ATTACK_YAML, compile_attack)
+    names = list(data)[:20]
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(data.__getitem__, names * 8))
+    assert all(result is data[result.name] for result in results)
+    assert len(compiled) == len(set(compiled))
+
+    # Single-typed species have NO_TYPE for their second type
+    tables = static_tables()
+    types = [lookup_temtem_data(species)['Types'] for species in tables.species]
+    single = [idx for idx, tem_types in enumerate(types) if not all(tem_types[:2])]
+    assert single and all(tables.type_ids[idx, 1] == NO_TYPE for idx in single)
+
+    assert shared_pool_kwargs() == {}
+    name = share_static_data()
+    try:
+        assert share_static_data() == name
+        kwargs = shared_pool_kwargs()
+        assert kwargs['initargs'] == (name,)
+        with ProcessPoolExecutor(max_workers=2, **kwargs) as pool:
+            attached, damage, types, loaded, views, stats, type_ids, learnset = pool.submit(
+                _shared_lookups, 'Crystal Bite', 'Gyalis'
+            ).result()
+        assert attached
+        assert damage == lookup_attack('Crystal Bite').damage
+        assert types == lookup_temtem_data('Gyalis')['Types']
+        # Workers only unpickle what they use
+        assert loaded == {'Crystal Bite', 'Gyalis'}
+        gyalis = lookup_temtem_data('Gyalis')
+        assert views
+        assert stats == [gyalis['Stats'][stat] for stat in Stats]
+        assert type_ids == [TYPE_IDS[type_] for type_ in gyalis['Types']]
+        assert 'Crystal Bite' in learnset
+        assert learnset == {move for moves in gyalis['Moves'].values() for move in moves}
+    finally:
+        release_static_data()
+    assert SHARED_SEGMENT is None and ATTACK_DATA is None
+    assert lookup_attack('Crystal Bite').damage == damage
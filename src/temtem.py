@@ -19,7 +19,10 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import os
+import sys
 
+from array import array
+from collections.abc import Mapping, MutableMapping
 from math import ceil, floor
 
 from .static import (
@@ -29,79 +32,128 @@ from .static import (
     STAT_CONSTS,
     DEFAULT_LEVEL,
     STATUS_CATCH_BONUS,
+    Attack,
     lookup_temtem_data,
     lookup_attack,
+    resolve_attack,
+    type_combo,
 )
 
-from typing import Iterable, Dict, Any
+from typing import Iterable, Iterator, Dict, List, Tuple, Type
 
 import logging
 log = logging.getLogger(__name__)
 
 SAMPLE_SETS = os.path.join('data', 'sets.txt')
 
+BOOSTED_STATS = tuple(stat for stat in Stats if stat not in (Stats.HP, Stats.Sta))
+
+# Statuses are stored as a bitmask in _status_mask, with each status's
+# remaining turns, turns existed and the order it was applied in in blocks of
+# the array _status_data, all indexed in Statuses order.
+STATUS_LIST = tuple(Statuses)
+STATUS_INDEX = {status: idx for idx, status in enumerate(STATUS_LIST)}
+STATUS_BITS = {status: 1 << idx for status, idx in STATUS_INDEX.items()}
+_REMAINING, _EXISTED, _ORDER = (block * len(STATUS_LIST) for block in range(3))
+_POISONED, _BURNED, _REGENERATED, _DOOMED, _ASLEEP = (
+    STATUS_INDEX[status] for status in (
+        Statuses.poisoned,
+        Statuses.burned,
+        Statuses.regenerated,
+        Statuses.doomed,
+        Statuses.asleep,
+    )
+)
 
-class TemTem:
-    def __init__(
-            self,
-            species: str,
-            moves: Iterable[str] = [],
-            trait: str = '',
-            svs: Dict[str, int] = {},
-            tvs: Dict[str, int] = {},
-            gear: str = '',
-            level: int = DEFAULT_LEVEL,
-    ):
-        from .traits import lookup_trait
-        from .gear import lookup_gear
-
-        self.species = species
-        self.moves = {move: 0 for move in moves}  # {move: hold counter}
-        self.trait = lookup_trait(trait)
-        base_tem_data = lookup_temtem_data(species)
-        self.base_stats = base_tem_data['Stats']
-        self.types = base_tem_data['Types']
-        self.level = int(level)
-
-        self.svs = {}
-        self.tvs = {}
-        for stat in Stats:
-            if stat.name in svs:
-                self.svs[stat] = int(svs[stat.name])
-            elif stat in svs:
-                self.svs[stat] = int(svs[stat])
-            else:
-                self.svs[stat] = 50
-            if stat.name in tvs:
-                self.tvs[stat] = int(tvs[stat.name])
-            elif stat in tvs:
-                self.tvs[stat] = int(tvs[stat])
-            else:
-                self.tvs[stat] = 0
-        self._calc_stats()
-        self.HP = self.stats[Stats.HP]  # current hp
-        self.Sta = self.stats[Stats.Sta]  # current sta
 
-        self.gear = lookup_gear(gear)
-        self.boosts = {stat: 0 for stat in Stats if stat not in (Stats.HP, Stats.Sta)}
+def _active_statuses(mask: int, data: array) -> List[int]:
+    """
+    Indexes of the statuses in mask, in the order they were applied.
+    """
+    active = []
+    while mask:
+        bit = mask & -mask
+        active.append(bit.bit_length() - 1)
+        mask ^= bit
+    if len(active) > 1:
+        active.sort(key=lambda idx: data[_ORDER + idx])
+    return active
+
+
+def _has_status(status: Statuses) -> property:
+    bit = STATUS_BITS[status]
+
+    def has_status(self) -> bool:
+        return bool(self._status_mask & bit)
+    return property(has_status)
+
+
+class _StatusView(Mapping):
+    """
+    A tem's statuses as a read-only {status: {'remaining': turns, 'existed':
+    turns}} mapping, in the order they were applied.
+    """
+    __slots__ = ('_tem',)
+
+    def __init__(self, tem):
+        self._tem = tem
+
+    def __contains__(self, status):
+        return bool(self._tem._status_mask & STATUS_BITS.get(status, 0))
+
+    def __getitem__(self, status):
+        if status not in self:
+            raise KeyError(status)
+        data, idx = self._tem._status_data, STATUS_INDEX[status]
+        return {'remaining': data[_REMAINING + idx], 'existed': data[_EXISTED + idx]}
+
+    def __iter__(self):
+        tem = self._tem
+        return (STATUS_LIST[idx] for idx in _active_statuses(tem._status_mask, tem._status_data))
+
+    def __len__(self):
+        return bin(self._tem._status_mask).count('1')
+
+
+def calc_stat(stat: Stats, base: int, sv: int, tv: int, level: int) -> int:
+    """
+    The stat formula, for any combination of base stat, sv, tv and level.
+    """
+    val1 = 1.5 * base + sv + tv / 5
+    val1 = (val1 * level) // STAT_CONSTS[stat][0]
+    val2 = sv * base * level
+    val2 //= STAT_CONSTS[stat][1]
+    const = STAT_CONSTS[stat][2] + (level if stat == Stats.HP else 0)
+    return int(val1 + val2 + const)
+
+
+def _stat_values(values, default):
+    """
+    Accepts stat values keyed by either stat names or Stats enums.
+    """
+    res = {}
+    for stat in Stats:
+        if stat.name in values:
+            res[stat] = int(values[stat.name])
+        elif stat in values:
+            res[stat] = int(values[stat])
+        else:
+            res[stat] = default
+    return res
 
-        self.statuses = {}
-        self.resting = False
-        self.overexerted = 0
-        # we can't just use a bool for overexerted, because there's one turn
-        # the tem uses too much sta, then one turn it can't move, so two
-        # non-normal states we need to represent at end of turn.
-        # So use 2 = used too much sta this turn, 1 = overexerted, 0 = normal
-        self.fainted = False
-        self.trait_counter = 0  # meaning is trait-specific
 
-        self.ally = None
+class TemTemBase:
+    """
+    Everything about a tem that doesn't depend on how its data is stored.
+    See TemTem and CompactTemTem for the concrete classes.
+    """
+    __slots__ = ()
 
     def __repr__(self) -> str:
         return f'<TemTem {self.species}>'
 
     def __eq__(self, other) -> bool:
-        if not isinstance(other, TemTem):
+        if not isinstance(other, TemTemBase):
             return NotImplemented
 
         return (
@@ -122,23 +174,32 @@ class TemTem:
         """
         Separated out into its own function for e.g. increasing one tv
         """
-        val1 = 1.5 * self.base_stats[stat] + self.svs[stat] + self.tvs[stat] / 5
-        val1 = (val1 * self.level) // STAT_CONSTS[stat][0]
-        val2 = self.svs[stat] * self.base_stats[stat] * self.level
-        val2 //= STAT_CONSTS[stat][1]
-        const = STAT_CONSTS[stat][2] + (self.level if stat == Stats.HP else 0)
-        return int(val1 + val2 + const)
+        return calc_stat(
+            stat, self.base_stats[stat], self.svs[stat], self.tvs[stat], self.level
+        )
 
     def _calc_stats(self):
         stats = {}
         for stat in Stats:
             stats[stat] = self._calc_stat(stat)
         self.stats = stats
+        self._clear_live_stats()
+
+    def _clear_live_stats(self):
+        """
+        Live stats are cached in _live_stats, with 0 meaning "not calculated".
+        This must be called whenever something they depend on changes, i.e.
+        stats, boosts or statuses.
+        """
+        self._live_stats = dict.fromkeys(BOOSTED_STATS, 0)
 
     def _live_stat(self, stat: Stats) -> int:
         if stat in (Stats.HP, Stats.Sta):
             raise ValueError(f"{self!r}._live_stat() called for stat {stat}")
 
+        if res := self._live_stats[stat]:
+            return res
+
         res = self.stats[stat]
         if (boost := self.boosts[stat]) > 0:
             res *= (2 + boost) / 2
@@ -150,13 +211,15 @@ class TemTem:
 
         # TODO: trait stat boosts, such as settling? I'll need to test in-game
 
-        return max(1, int(res))
+        res = self._live_stats[stat] = max(1, int(res))
+        return res
 
     # public funcs for use in simulating battles
 
     def clear_boosts(self):
         # TODO: check if determined applies here
-        self.boosts = {stat: 0 for stat in Stats if stat not in (Stats.HP, Stats.Sta)}
+        self.boosts = {stat: 0 for stat in BOOSTED_STATS}
+        self._clear_live_stats()
 
     def apply_boost(self, stat: Stats, boost: int):
         from .traits import Determined, Guardian
@@ -168,54 +231,56 @@ class TemTem:
             return
 
         self.boosts[stat] = max(-5, min(5, self.boosts[stat] + boost))
+        self._live_stats[stat] = 0
 
     def apply_status(self, status: Statuses, turns: int):
-        from contextlib import suppress
-        from .effects import DontApplyStatus
+        from .effects import STATUS_PREVENTED
+        from .traits import Receptive
+
+        if self.trait is Receptive and status in Receptive.STATUSES:
+            turns += 1
 
         # TODO: check gear applies before trait
-        if not self.seized:
+        if not self.seized and 'on_status' in self.gear.hooks:
             gear_effect = self.gear.on_status(self, status, turns)
-            try:
-                gear_effect.apply(target=self)
-            except DontApplyStatus:
+            if gear_effect.apply_outcome(target=self)[1] & STATUS_PREVENTED:
                 return
 
-        trait_effect = self.trait.on_status(self, status, turns)
-        try:
-            trait_effect.apply(target=self)
-        except DontApplyStatus:
-            return
+        if 'on_status' in self.trait.hooks:
+            trait_effect = self.trait.on_status(self, status, turns)
+            if trait_effect.apply_outcome(target=self)[1] & STATUS_PREVENTED:
+                return
 
-        if self.ally is not None:
+        if self.ally is not None and 'on_ally_status' in self.ally.trait.hooks:
             ally_effect = self.ally.trait.on_ally_status(
                 self.ally, self, status, turns
             )
-            try:
-                ally_effect.apply(target=self.ally, ally=self)
-            except DontApplyStatus:
+            if ally_effect.apply_outcome(target=self.ally, ally=self)[1] & STATUS_PREVENTED:
                 return
 
+        # Past this point, statuses may change
+        self._clear_live_stats()
+
         # Check if a type or current status changes what's being applied
-        if status in self.statuses:
+        if self._status_mask & STATUS_BITS[status]:
             if status != Statuses.cold:
                 return
-            self.statuses[Statuses.frozen] = self.statuses[Statuses.cold]
-            del self.statuses[Statuses.cold]
+            idx = STATUS_INDEX[Statuses.cold]
+            data = self._status_data
+            remaining, existed = data[_REMAINING + idx], data[_EXISTED + idx]
+            self._del_status(Statuses.cold)
+            self._add_status(Statuses.frozen, remaining, existed)
 
         elif status == Statuses.cold:
             if self.frozen:
                 return
-            with suppress(KeyError):
-                del self.statuses[Statuses.burned]
+            self._del_status(Statuses.burned)
 
         elif status == Statuses.burned:
             if Types.fire in self.types:
                 return
-            with suppress(KeyError):
-                del self.statuses[Statuses.cold]
-            with suppress(KeyError):
-                del self.statuses[Statuses.frozen]
+            self._del_status(Statuses.cold)
+            self._del_status(Statuses.frozen)
 
         elif status == Statuses.asleep:
             if Types.mental in self.types:
@@ -229,30 +294,71 @@ class TemTem:
 
         elif status == Statuses.exhausted:
             if self.vigorized:
-                del self.statuses[Statuses.vigorized]
+                self._del_status(Statuses.vigorized)
                 return
 
         elif status == Statuses.vigorized:
             if self.exhausted:
-                del self.statuses[Statuses.exhausted]
+                self._del_status(Statuses.exhausted)
                 return
 
         # Handle applying a status when there are already 2
-        if len(self.statuses) == 2:
+        active = _active_statuses(self._status_mask, self._status_data)
+        if len(active) == 2:
             # remove oldest status to replace with new status condition
-            del self.statuses[
-                sorted(self.statuses, key=lambda x: self.statuses[x]['existed'])[0]
-            ]
+            data = self._status_data
+            self._del_status(STATUS_LIST[min(active, key=lambda idx: data[_EXISTED + idx])])
+
+        self._add_status(status, turns, 0)
+
+    def remove_status(self, status: Statuses) -> bool:
+        """
+        Returns whether the tem had the status.
+        """
+        if not self._status_mask & STATUS_BITS[status]:
+            return False
+        self._del_status(status)
+        self._clear_live_stats()
+        return True
+
+    @property
+    def statuses(self) -> Mapping:
+        return _StatusView(self)
+
+    @statuses.setter
+    def statuses(self, statuses: Mapping):
+        self._status_mask = 0
+        self._status_data = array('h', [0]) * (3 * len(STATUS_LIST))
+        for status, details in statuses.items():
+            self._add_status(status, details['remaining'], details['existed'])
+        self._clear_live_stats()
+
+    def _add_status(self, status: Statuses, remaining: int, existed: int):
+        idx = STATUS_INDEX[status]
+        data = self._status_data
+        data[_REMAINING + idx] = remaining
+        data[_EXISTED + idx] = existed
+        data[_ORDER + idx] = 1 + max(
+            (data[_ORDER + other] for other in _active_statuses(self._status_mask, data)),
+            default=-1,
+        )
+        self._status_mask |= 1 << idx
 
-        self.statuses[status] = {'remaining': turns, 'existed': 0}
+    def _del_status(self, status: Statuses):
+        # Counters are zeroed too, so equal statuses give equal snapshots
+        idx = STATUS_INDEX[status]
+        data = self._status_data
+        data[_REMAINING + idx] = data[_EXISTED + idx] = data[_ORDER + idx] = 0
+        self._status_mask &= ~(1 << idx)
 
     def start_turn(self):
         '''
         Handle all effects that occur at the start of each turn.
         '''
-        if not self.seized:
-            self.gear.on_turn_start(self).apply(target=self)
-        self.trait.on_turn_start(self).apply(target=self)
+        if not self.seized and 'on_turn_start' in self.gear.hooks:
+            self.gear.on_turn_start(self).apply_outcome(target=self)
+        if 'on_turn_start' in self.trait.hooks:
+            self.trait.on_turn_start(self).apply_outcome(target=self)
 
     def end_turn(self, active: bool = False):
         '''
@@ -260,35 +366,39 @@ class TemTem:
           - status effects update / run out
           - handle stamina regeneration and overexertion
         '''
-        # update status conditions
-        new_statuses = {}
+        # update status conditions, in place
         apply_alerted = False
-        for status, details in self.statuses.items():
-            if status == Statuses.poisoned:
-                self.take_damage(ceil(self.max_hp / 8))
-            elif status == Statuses.burned:
-                self.take_damage(ceil(self.max_hp / 16))
-            elif status == Statuses.regenerated:
-                self.take_damage(floor(self.max_hp / 10))
-            elif status == Statuses.doomed and details['remaining'] == 1:
-                # TODO: do I want a different "become KO'd" method?
-                self.take_damage(self.max_hp)
-
-            if details['remaining'] > 1:
-                new_statuses[status] = {
-                    'remaining': details['remaining'] - 1,
-                    'existed': details['existed'] + 1,
-                }
-            elif status == Statuses.asleep:
-                apply_alerted = True
-
-        self.statuses = new_statuses
+        if mask := self._status_mask:
+            data = self._status_data
+            for idx in _active_statuses(mask, data):
+                remaining = data[_REMAINING + idx]
+                if idx == _POISONED:
+                    self.take_damage(ceil(self.max_hp / 8))
+                elif idx == _BURNED:
+                    self.take_damage(ceil(self.max_hp / 16))
+                elif idx == _REGENERATED:
+                    self.take_damage(floor(self.max_hp / 10))
+                elif idx == _DOOMED and remaining == 1:
+                    # TODO: do I want a different "become KO'd" method?
+                    self.take_damage(self.max_hp)
+
+                if remaining > 1:
+                    data[_REMAINING + idx] = remaining - 1
+                    data[_EXISTED + idx] += 1
+                else:
+                    self._del_status(STATUS_LIST[idx])
+                    if idx == _ASLEEP:
+                        apply_alerted = True
+
+            if self._status_mask != mask:
+                self._clear_live_stats()
         if apply_alerted:
             self.apply_status(Statuses.alerted, 1)
 
-        if not self.seized:
-            self.gear.on_turn_end(self).apply(target=self)
-        self.trait.on_turn_end(self).apply(target=self)
+        if not self.seized and 'on_turn_end' in self.gear.hooks:
+            self.gear.on_turn_end(self).apply_outcome(target=self)
+        if 'on_turn_end' in self.trait.hooks:
+            self.trait.on_turn_end(self).apply_outcome(target=self)
 
         # update overexertion
         if self.overexerted:
@@ -307,7 +417,7 @@ class TemTem:
 
         # update hold counts
         for move, hold in self.moves.items():
-            self.moves[move] = min(hold + 1, lookup_attack(move)['hold'])
+            self.moves[move] = min(hold + 1, lookup_attack(move).hold)
 
     def take_damage(self, damage: int):
         '''
@@ -330,14 +440,18 @@ class TemTem:
 
         # TODO: handle waking up, soft touch
 
+    def stamina_cost(self, stamina: int) -> int:
+        ''' The stamina actually used for a move costing stamina '''
+        if self.vigorized:
+            return stamina // 2  # TesTem uses floor here
+        if self.exhausted:
+            return floor(stamina * 1.5)  # TesTem uses floor here
+        return stamina
+
     def use_stamina(self, stamina: int):
         from .traits import Resiliant, Tireless, Vigorous
 
-        if self.vigorized:
-            stamina //= 2  # TesTem uses floor here
-        elif self.exhausted:
-            stamina = floor(stamina * 1.5)  # TesTem uses floor here
-
+        stamina = self.stamina_cost(stamina)
         if self.Sta >= stamina:
             self.Sta -= stamina
             return
@@ -353,39 +467,19 @@ class TemTem:
             if self.trait is Vigorous:
                 self.trait_counter = 1
 
-    def lookup_attack(self, atk_name: str) -> Dict[str, Any]:
+    def lookup_attack(self, atk_name: str) -> Attack:
         '''
-        Return the atk dict given by static.lookup_attack, but with fixed
+        Return the attack given by static.lookup_attack, but with fixed
         synergy (e.g. from KOs or switches), and handle a few other things
         like Shuine's Horn.
         '''
-        from copy import copy
         from .gear import ShuinesHorn
 
-        attack = lookup_attack(atk_name)
-        if 'synergy type' in attack:
-            syn_type = attack['synergy type']
-            if self.ally and syn_type in self.ally.types:
-                attack = lookup_attack(f'{attack["name"]} +{syn_type.detail}')
-        elif 'synergy attack' in attack:
-            synergy_type = attack['name'].split(' +')[1]
-            if (
-                (not self.ally)
-                or Types[synergy_type] not in self.ally.types
-            ):
-                attack = lookup_attack(attack['name'].split(' +')[0])
-
-        if (
-            attack['type'] == Types.toxic
-            and self.gear is ShuinesHorn
-            and not self.seized
-        ):
-            attack = copy.copy(attack)
-            # Don't need copy.deepcopy, as we only change a top-level
-            # property (type)
-            attack['type'] = Types.water
-
-        return attack
+        return resolve_attack(
+            atk_name,
+            self.ally.types if self.ally else (),
+            self.gear is ShuinesHorn and not self.seized,
+        )
 
     def catch_chance(self, card_rate: int = 1, four_leaf_clover: bool = False) -> float:
         """
@@ -407,8 +501,77 @@ class TemTem:
             return 1.0
         return (b / 50_000) ** 4
 
+    # saving and restoring battle state, e.g. for searching over battles
+
+    def snapshot(self) -> tuple:
+        """
+        Capture everything about the tem that can change during a battle, as
+        a flat tuple that's cheap to store, compare and hash. Pass it to
+        restore() to return the tem to this state.
+
+        The tem's ally isn't included, as it's another tem, so see
+        sim.Battle.snapshot() for that.
+        """
+        return (
+            self.HP,
+            self.Sta,
+            tuple(self.boosts.values()),
+            tuple(self.moves.values()),
+            self._status_mask,
+            self._status_data.tobytes(),
+            self.resting,
+            self.overexerted,
+            self.fainted,
+            self.trait_counter,
+            self.gear,
+        )
+
+    def restore(self, state: tuple):
+        """
+        Return the tem to a state from snapshot(). Boosts, holds and statuses
+        are only rewritten if they've changed.
+        """
+        (
+            self.HP,
+            self.Sta,
+            boosts,
+            holds,
+            status_mask,
+            status_data,
+            self.resting,
+            self.overexerted,
+            self.fainted,
+            self.trait_counter,
+            self.gear,
+        ) = state
+
+        changed = False
+        if boosts != tuple(self.boosts.values()):
+            self.boosts = dict(zip(BOOSTED_STATS, boosts))
+            changed = True
+        if holds != tuple(self.moves.values()):
+            moves = self.moves
+            for move, hold in zip(tuple(moves), holds):
+                moves[move] = hold
+        if status_mask != self._status_mask or status_data != self._status_data.tobytes():
+            self._status_mask = status_mask
+            self._status_data = array('h')
+            self._status_data.frombytes(status_data)
+            changed = True
+        if changed:
+            self._clear_live_stats()
+
     # methods to access important info about the tem
 
+    @property
+    def types(self) -> Tuple[Types, Types]:
+        return self._types
+
+    @types.setter
+    def types(self, types: Tuple[Types, Types]):
+        self._types = types
+        self.type_combo = type_combo(types)  # for COMBO_EFFECTIVENESS
+
     # stats
 
     @property
@@ -421,96 +584,55 @@ class TemTem:
 
     @property
     def Spe(self) -> int:
-        return self._live_stat(Stats.Spe)
+        return self._live_stats[Stats.Spe] or self._live_stat(Stats.Spe)
 
     @property
     def Atk(self) -> int:
-        return self._live_stat(Stats.Atk)
+        return self._live_stats[Stats.Atk] or self._live_stat(Stats.Atk)
 
     @property
     def Def(self) -> int:
-        return self._live_stat(Stats.Def)
+        return self._live_stats[Stats.Def] or self._live_stat(Stats.Def)
 
     @property
     def SpA(self) -> int:
-        return self._live_stat(Stats.SpA)
+        return self._live_stats[Stats.SpA] or self._live_stat(Stats.SpA)
 
     @property
     def SpD(self) -> int:
-        return self._live_stat(Stats.SpD)
+        return self._live_stats[Stats.SpD] or self._live_stat(Stats.SpD)
 
     # status conditions
 
-    @property
-    def cold(self):
-        return Statuses.cold in self.statuses
-
-    @property
-    def frozen(self):
-        return Statuses.frozen in self.statuses
-
-    @property
-    def asleep(self):
-        return Statuses.asleep in self.statuses
-
-    @property
-    def trapped(self):
-        return Statuses.trapped in self.statuses
-
-    @property
-    def doomed(self):
-        return Statuses.doomed in self.statuses
-
-    @property
-    def seized(self):
-        return Statuses.seized in self.statuses
-
-    @property
-    def poisoned(self):
-        return Statuses.poisoned in self.statuses
-
-    @property
-    def burned(self):
-        return Statuses.burned in self.statuses
-
-    @property
-    def exhausted(self):
-        return Statuses.exhausted in self.statuses
-
-    @property
-    def vigorized(self):
-        return Statuses.vigorized in self.statuses
-
-    @property
-    def immune(self):
-        return Statuses.immune in self.statuses
-
-    @property
-    def regenerated(self):
-        return Statuses.regenerated in self.statuses
-
-    @property
-    def nullified(self):
-        return Statuses.nullified in self.statuses
-
-    @property
-    def evading(self):
-        return Statuses.evading in self.statuses
-
-    @property
-    def alerted(self):
-        return Statuses.alerted in self.statuses
-
-    @property
-    def exiled(self):
-        return Statuses.exiled in self.statuses
+    cold = _has_status(Statuses.cold)
+    frozen = _has_status(Statuses.frozen)
+    asleep = _has_status(Statuses.asleep)
+    trapped = _has_status(Statuses.trapped)
+    doomed = _has_status(Statuses.doomed)
+    seized = _has_status(Statuses.seized)
+    poisoned = _has_status(Statuses.poisoned)
+    burned = _has_status(Statuses.burned)
+    exhausted = _has_status(Statuses.exhausted)
+    vigorized = _has_status(Statuses.vigorized)
+    immune = _has_status(Statuses.immune)
+    regenerated = _has_status(Statuses.regenerated)
+    nullified = _has_status(Statuses.nullified)
+    evading = _has_status(Statuses.evading)
+    alerted = _has_status(Statuses.alerted)
+    exiled = _has_status(Statuses.exiled)
 
     # import / export functions
 
     @classmethod
-    def from_importable(cls, importable: str) -> "TemTem":
+    def from_importable(cls, importable: str) -> "TemTemBase":
+        """ A tem from an importable, see parse_importable() for the format """
+        return cls(*cls.parse_importable(importable))
+
+    @staticmethod
+    def parse_importable(importable: str) -> tuple:
         """
-        e.g.
+        The (species, moves, trait, svs, tvs, gear, level) to construct a tem
+        from an importable with, without looking any of them up, e.g.
         Top Percentage (Rattata) @ Example Item
         Trait: Resistant
         Level: 48
@@ -551,6 +673,7 @@ class TemTem:
         # next lines: trait, level, tvs, svs
         tvs = {stat: 0 for stat in Stats}
         svs = {stat: 50 for stat in Stats}
+        trait = ''
         level = DEFAULT_LEVEL
         while not (line := next(lines).strip()).startswith('-'):
             if line.startswith('Trait:'):
@@ -573,11 +696,16 @@ class TemTem:
                 break  # ignore lines after the final move
             moves.append(line.lstrip('-').strip())
 
-        return cls(species, moves, trait, svs, tvs, gear, level)
+        return species, moves, trait, svs, tvs, gear, level
 
     def export(self) -> str:
-        res = f'{self.species} {f"@ {self.gear.__name__}" or ""}\n'
-        res += f'Trait: {self.trait.__name__}\n'
+        from .gear import NoGear
+        from .traits import NoTrait
+
+        res = f'{self.species}'
+        res += f' @ {self.gear.__name__}\n' if self.gear is not NoGear else '\n'
+        if self.trait is not NoTrait:
+            res += f'Trait: {self.trait.__name__}\n'
         if self.level != DEFAULT_LEVEL:
             res += f'Level: {self.level}\n'
 
@@ -598,31 +726,284 @@ class TemTem:
         return res
 
 
-def gen_tems(inpt: str) -> Iterable[TemTem]:
-    if isinstance(inpt, str):
-        inpt = inpt.split('\n')
+class TemTem(TemTemBase):
+    def __init__(
+            self,
+            species: str,
+            moves: Iterable[str] = [],
+            trait: str = '',
+            svs: Dict[str, int] = {},
+            tvs: Dict[str, int] = {},
+            gear: str = '',
+            level: int = DEFAULT_LEVEL,
+    ):
+        from .traits import lookup_trait
+        from .gear import lookup_gear
 
-    def try_yield_tem(next_tem):
-        try:
-            return TemTem.from_importable(next_tem)
-        except Exception as err:
-            log.error('Unable to parse the following lines:')
-            for line in next_tem:
-                log.error(line)
-            log.error('Saw the following exception: %r', err)
+        self.species = species
+        self.moves = {move: 0 for move in moves}  # {move: hold counter}
+        self.trait = lookup_trait(trait)
+        base_tem_data = lookup_temtem_data(species)
+        self.base_stats = base_tem_data['Stats']
+        self.types = base_tem_data['Types']
+        self.level = int(level)
+
+        self.svs = _stat_values(svs, 50)
+        self.tvs = _stat_values(tvs, 0)
+        self._calc_stats()
+        self.HP = self.stats[Stats.HP]  # current hp
+        self.Sta = self.stats[Stats.Sta]  # current sta
+
+        self.gear = lookup_gear(gear)
+        self.boosts = {stat: 0 for stat in BOOSTED_STATS}
 
+        self.statuses = {}
+        self.resting = False
+        self.overexerted = 0
+        # we can't just use a bool for overexerted, because there's one turn
+        # the tem uses too much sta, then one turn it can't move, so two
+        # non-normal states we need to represent at end of turn.
+        # So use 2 = used too much sta this turn, 1 = overexerted, 0 = normal
+        self.fainted = False
+        self.trait_counter = 0  # meaning is trait-specific
+
+        self.ally = None
+
+
+# Layout of CompactTemTem._data: svs, tvs, stats, boosts and cached live stats
+# each take a block indexed in Stats order, followed by current HP and Sta,
+# then move holds.
+_SVS, _TVS, _STATS, _BOOSTS, _LIVE_STATS = (block * len(Stats) for block in range(5))
+_HP = 5 * len(Stats)
+_STA = _HP + 1
+_HOLDS = _STA + 1
+
+_SV_INDEX = {stat: _SVS + idx for idx, stat in enumerate(Stats)}
+_TV_INDEX = {stat: _TVS + idx for idx, stat in enumerate(Stats)}
+_STAT_INDEX = {stat: _STATS + idx for idx, stat in enumerate(Stats)}
+_BOOST_INDEX = {stat: _BOOSTS + idx for idx, stat in enumerate(Stats) if stat in BOOSTED_STATS}
+_LIVE_STAT_INDEX = {
+    stat: _LIVE_STATS + idx for idx, stat in enumerate(Stats) if stat in BOOSTED_STATS
+}
+
+# {moveset: {move: index of its hold counter}}, shared between all
+# CompactTemTems with the same moves.
+_MOVESETS = {}
+
+
+def _moveset_index(moves):
+    moves = tuple(sys.intern(move) for move in dict.fromkeys(moves))
+    try:
+        return _MOVESETS[moves]
+    except KeyError:
+        return _MOVESETS.setdefault(
+            moves, {move: _HOLDS + idx for idx, move in enumerate(moves)}
+        )
+
+
+class _ArrayView(MutableMapping):
+    """
+    A dict-like view onto part of a CompactTemTem's data array, so code
+    written against TemTem's dicts works unchanged.
+    """
+    __slots__ = ('_data', '_index')
+
+    def __init__(self, data, index):
+        self._data = data
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._data[self._index[key]]
+
+    def __setitem__(self, key, value):
+        self._data[self._index[key]] = value
+
+    def __delitem__(self, key):
+        raise TypeError(f'Can\'t remove {key!r} from a CompactTemTem')
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CompactTemTem(TemTemBase):
+    """
+    A TemTem using __slots__, with its svs, tvs, stats, boosts, current HP/Sta
+    and move holds packed into a single array of shorts. Use this when a very
+    large number of tems need to be held in memory - it's roughly a fifth of
+    the size of a TemTem.
+
+    svs, tvs, stats, boosts and moves are dict-like views onto the array, so
+    behave the same as TemTem's dicts.
+    """
+    __slots__ = (
+        'species',
+        'level',
+        'trait',
+        'gear',
+        'base_stats',
+        '_types',
+        'type_combo',
+        '_status_mask',
+        '_status_data',
+        'resting',
+        'overexerted',
+        'fainted',
+        'trait_counter',
+        'ally',
+        '_moves',
+        '_data',
+    )
+
+    def __init__(
+            self,
+            species: str,
+            moves: Iterable[str] = [],
+            trait: str = '',
+            svs: Dict[str, int] = {},
+            tvs: Dict[str, int] = {},
+            gear: str = '',
+            level: int = DEFAULT_LEVEL,
+    ):
+        from .traits import lookup_trait
+        from .gear import lookup_gear
+
+        self.species = sys.intern(species)
+        self._moves = _moveset_index(moves)
+        self._data = array('h', [0]) * (_HOLDS + len(self._moves))
+        self.trait = lookup_trait(trait)
+        base_tem_data = lookup_temtem_data(species)
+        self.base_stats = base_tem_data['Stats']
+        self.types = base_tem_data['Types']
+        self.level = int(level)
+
+        self.svs = _stat_values(svs, 50)
+        self.tvs = _stat_values(tvs, 0)
+        self._calc_stats()
+        self.HP = self.stats[Stats.HP]
+        self.Sta = self.stats[Stats.Sta]
+
+        self.gear = lookup_gear(gear)
+        # boosts and move holds all start at 0
+
+        self.statuses = {}
+        self.resting = False
+        self.overexerted = 0
+        self.fainted = False
+        self.trait_counter = 0
+
+        self.ally = None
+
+    def _set_values(self, index, values):
+        data = self._data
+        for key, value in values.items():
+            data[index[key]] = value
+
+    @property
+    def svs(self):
+        return _ArrayView(self._data, _SV_INDEX)
+
+    @svs.setter
+    def svs(self, values):
+        self._set_values(_SV_INDEX, values)
+
+    @property
+    def tvs(self):
+        return _ArrayView(self._data, _TV_INDEX)
+
+    @tvs.setter
+    def tvs(self, values):
+        self._set_values(_TV_INDEX, values)
+
+    @property
+    def stats(self):
+        return _ArrayView(self._data, _STAT_INDEX)
+
+    @stats.setter
+    def stats(self, values):
+        self._set_values(_STAT_INDEX, values)
+
+    @property
+    def boosts(self):
+        return _ArrayView(self._data, _BOOST_INDEX)
+
+    @boosts.setter
+    def boosts(self, values):
+        self._set_values(_BOOST_INDEX, values)
+
+    @property
+    def _live_stats(self):
+        return _ArrayView(self._data, _LIVE_STAT_INDEX)
+
+    @_live_stats.setter
+    def _live_stats(self, values):
+        self._set_values(_LIVE_STAT_INDEX, values)
+
+    @property
+    def moves(self):
+        return _ArrayView(self._data, self._moves)
+
+    @property
+    def HP(self) -> int:
+        return self._data[_HP]
+
+    @HP.setter
+    def HP(self, value: int):
+        self._data[_HP] = value
+
+    @property
+    def Sta(self) -> int:
+        return self._data[_STA]
+
+    @Sta.setter
+    def Sta(self, value: int):
+        self._data[_STA] = value
+
+
+def split_importables(inpt: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Split lines of importables on blank lines, yielding (line number of the
+    first line, lines) for each, without reading more input than needed.
+    """
     next_tem = []
-    for line in inpt:
+    start = 0
+    for line_no, line in enumerate(inpt, 1):
         if not line.strip():
             if next_tem:
-                if tem := try_yield_tem(next_tem):
-                    yield tem
+                yield start, next_tem
                 next_tem = []
         else:
-            next_tem.append(line)
+            if not next_tem:
+                start = line_no
+            next_tem.append(line.rstrip('\n'))
 
     if next_tem:
-        try_yield_tem(next_tem)
+        yield start, next_tem
+
+
+def log_import_error(line_no: int, lines: List[str], err: Exception):
+    log.error('Unable to parse the following lines (from line %d):', line_no)
+    for line in lines:
+        log.error(line)
+    log.error('Saw the following exception: %r', err)
+
+
+def gen_tems(
+    inpt: str, tem_class: Type[TemTemBase] = TemTem
+) -> Iterable[TemTemBase]:
+    if isinstance(inpt, str):
+        inpt = inpt.split('\n')
+
+    for line_no, lines in split_importables(inpt):
+        try:
+            yield tem_class.from_importable(lines)
+        except Exception as err:
+            log_import_error(line_no, lines, err)
 
 
 # Tests
@@ -674,6 +1055,91 @@ def test_temtem_class():
         assert imported.level == tem.level
 
 
+def test_live_stat_cache():
+    from .test_data import KINU_IMPORT
+
+    for cls in TemTem, CompactTemTem:
+        kinu = cls.from_importable(KINU_IMPORT)
+        spa = kinu.SpA
+        kinu.apply_status(Statuses.burned, 1)
+        assert kinu.SpA == int(spa * 0.7)
+        kinu.end_turn()  # burn runs out
+        assert kinu.SpA == spa
+        kinu.apply_boost(Stats.SpA, 2)
+        assert kinu.SpA == spa * 2
+        kinu.clear_boosts()
+        assert kinu.SpA == spa
+        kinu.tvs[Stats.SpA] = 500
+        kinu._calc_stats()
+        assert kinu.SpA == kinu.stats[Stats.SpA] > spa
+
+
+def test_lookup_attack():
+    tem = TemTem('Gyalis', ['Hallucination'], gear="Shuine's Horn")
+    ally = TemTem('Kinu')
+    assert Types.mental in ally.types
+
+    for name in ('Hallucination', 'Hallucination +mental'):
+        # Shuine's Horn makes toxic moves water
+        assert tem.lookup_attack(name).name == 'Hallucination'
+        assert tem.lookup_attack(name).type == Types.water
+        tem.ally = ally
+        assert tem.lookup_attack(name).name == 'Hallucination +mental'
+        tem.apply_status(Statuses.seized, 2)
+        assert tem.lookup_attack(name).type == Types.toxic
+        tem.statuses = {}
+        tem.ally = None
+
+    # Resolving doesn't build new attacks each time
+    assert tem.lookup_attack('Hallucination') is tem.lookup_attack('Hallucination')
+    assert TemTem('Gyalis').lookup_attack('Crystal Bite') is lookup_attack('Crystal Bite')
+
+
+def test_statuses():
+    for tem_class in (TemTem, CompactTemTem):
+        tem = tem_class('Gyalis', ['Crystal Bite'])
+        assert not tem.statuses and not tem.burned
+
+        tem.apply_status(Statuses.burned, 2)
+        tem.apply_status(Statuses.trapped, 3)
+        status_data = tem._status_data
+        assert tem.burned and tem.trapped and not tem.cold
+        assert list(tem.statuses) == [Statuses.burned, Statuses.trapped]
+        assert tem.statuses[Statuses.trapped] == {'remaining': 3, 'existed': 0}
+
+        tem.end_turn()
+        assert tem._status_data is status_data  # updated in place
+        assert dict(tem.statuses) == {
+            Statuses.burned: {'remaining': 1, 'existed': 1},
+            Statuses.trapped: {'remaining': 2, 'existed': 1},
+        }
+        tem.end_turn()
+        assert list(tem.statuses) == [Statuses.trapped]
+
+        # A third status replaces the one that's existed for least time, or
+        # the first applied if they're tied
+        tem.apply_status(Statuses.seized, 2)
+        tem.apply_status(Statuses.poisoned, 2)
+        assert list(tem.statuses) == [Statuses.trapped, Statuses.poisoned]
+        tem.apply_status(Statuses.doomed, 2)
+        tem.apply_status(Statuses.evading, 2)
+        assert list(tem.statuses) == [Statuses.trapped, Statuses.evading]
+
+        # Cold becomes frozen
+        tem.statuses = {}
+        tem.apply_status(Statuses.cold, 2)
+        tem.end_turn()
+        tem.apply_status(Statuses.cold, 2)
+        assert tem.frozen and tem.statuses[Statuses.frozen]['existed'] == 1
+
+        state = tem.snapshot()
+        tem.remove_status(Statuses.frozen)
+        assert not tem.frozen and tem.snapshot() != state
+        tem.restore(state)
+        assert tem.frozen and tem.snapshot() == state
+        hash(state)
+
+
 def test_gen_tems():
     from .test_data import MULTI_IMPORT, GYALIS_TEM, KINU_TEM
 
@@ -683,3 +1149,54 @@ def test_gen_tems():
     gen = gen_tems(MULTI_IMPORT)
     assert next(gen) == GYALIS_TEM
     assert next(gen) == KINU_TEM
+
+
+def test_compact_temtem():
+    from .test_data import GYALIS_IMPORT, GYALIS_STATS, GYALIS_TEM, MULTI_IMPORT
+
+    compact = CompactTemTem.from_importable(GYALIS_IMPORT)
+    assert compact == GYALIS_TEM
+    assert compact.stats == GYALIS_STATS
+    assert compact.moves == {move: 0 for move in GYALIS_TEM.moves}
+    assert compact.export() == GYALIS_IMPORT
+    assert not hasattr(compact, '__dict__')
+
+    compact.apply_boost(Stats.Atk, 3)
+    assert compact.Atk == 377
+    compact.clear_boosts()
+    assert compact.Atk == GYALIS_STATS[Stats.Atk]
+
+    compact.take_damage(22)
+    assert compact.HP == GYALIS_STATS[Stats.HP] - 22
+    compact.apply_status(Statuses.burned, 2)
+    assert compact.burned
+    compact.moves['Crystal Bite'] = -1
+    compact.end_turn(active=True)
+    assert compact.moves['Crystal Bite'] == 0
+
+    assert list(gen_tems(MULTI_IMPORT, CompactTemTem)) == list(gen_tems(MULTI_IMPORT))
+
+
+def test_compact_temtem_size():
+    import gc
+    import tracemalloc
+    from .test_data import GYALIS_IMPORT
+
+    def size_per_tem(tem_class, count=200):
+        tem_class.from_importable(GYALIS_IMPORT)  # load the shared data first
+        gc.collect()
+        tracemalloc.start()
+        try:
+            tems = [tem_class.from_importable(GYALIS_IMPORT) for _ in range(count)]
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        assert len(tems) == count
+        return size / count
+
+    # ~500 bytes against ~2.5KB: a fifth of the size, not the tenth hoped for,
+    # as the object and its arrays have a fixed overhead.
+    ratio = size_per_tem(TemTem) / size_per_tem(CompactTemTem)
+    assert ratio > 4
+    assert sys.getsizeof(CompactTemTem.from_importable(GYALIS_IMPORT)) < 200
@@ -20,12 +20,16 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from .static import Statuses, Stats, Types
 from .effects import (
+    HP_AMOUNT,
+    HP_FRACTION,
+    STA_AMOUNT,
     Effect,
     Trait,
     no_effect,
+    redirect_to_ally,
+    register_hooks,
     string_to_class_name,
-    Unaffected,
-    RedirectAttack
+    unaffected,
 )
 from .temtem import TemTem
 
@@ -40,7 +44,7 @@ _ALL_TRAITS = {}
 def trait(cls: Type[Trait]) -> Type[Trait]:
     global _ALL_TRAITS
     _ALL_TRAITS[cls.__name__] = cls
-    return cls
+    return register_hooks(cls)
 
 
 def lookup_trait(name: str, /) -> Trait:
@@ -138,7 +142,7 @@ class Benefactor(Trait):
     def on_ally_damage(
         attacker: TemTem, target: TemTem, ally: TemTem, attack: Dict[str, Any], damage: int
     ) -> Effect:
-        return Effect(ally={Stats.HP: 0.1})
+        return Effect(ally={HP_FRACTION: 0.1})
 
 
 @trait
@@ -358,7 +362,7 @@ class FaintedCurse(Trait):
     ) -> Effect:
         if damage <= target.HP:
             return no_effect
-        return Effect(attacker={Statuses.HP: -int(attacker.max_hp * 0.3)})
+        return Effect(attacker={HP_AMOUNT: -int(attacker.max_hp * 0.3)})
 
 
 @trait
@@ -391,7 +395,7 @@ class Friendship(Trait):
     @staticmethod
     def on_hit(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if attacker is target.ally:
-            raise Unaffected()
+            return unaffected
         return no_effect
 
 
@@ -473,7 +477,7 @@ class Individualist(Trait):
     @staticmethod
     def on_attack(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if target is attacker.ally:
-            raise Unaffected()
+            return unaffected
         return no_effect
 
 # TODO: inductor, last rush, loneliness, marathonist
@@ -495,7 +499,7 @@ class Mirroring(Trait):
         attacker: TemTem, target: TemTem, attack: Dict[str, Any], damage: int
     ) -> Effect:
         if attack['class'] == 'Special':
-            return Effect(attacker={Stats.HP: -damage // 4})
+            return Effect(attacker={HP_AMOUNT: -damage // 4})
         return no_effect
 
 
@@ -549,7 +553,7 @@ class Patient(Trait):
         if attack['hold'] and not attacker.trait_counter:
             return Effect(
                 attacker={
-                    Stats.Sta: attacker.max_sta // 10,
+                    STA_AMOUNT: attacker.max_sta // 10,
                     'trait counter': 1
                 }
             )
@@ -569,7 +573,7 @@ class PowerNap(Trait):
     @staticmethod
     def on_turn_start(target: TemTem) -> Effect:
         if target.asleep:
-            return Effect(target={Stats.HP: int(target.max_hp * 1.15)})
+            return Effect(target={HP_AMOUNT: int(target.max_hp * 1.15)})
         return no_effect
 
 
@@ -586,7 +590,7 @@ class Prideful(Trait):
 class Protector(Trait):
     @staticmethod
     def on_switch_in(target: TemTem) -> Effect:
-        return Effect(ally={Stats.Def: 1, Stats.SpD: 1}, target={Stats.HP: -0.1})
+        return Effect(ally={Stats.Def: 1, Stats.SpD: 1}, target={HP_FRACTION: -0.1})
 
 
 @trait
@@ -614,7 +618,7 @@ class PuppetMaster(Trait):
     @staticmethod
     def on_hit(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if target.HP < target.max_hp * 0.4 and target.ally:
-            raise RedirectAttack('ally')
+            return redirect_to_ally
         return no_effect
 
 
@@ -629,17 +633,15 @@ class Pyromaniac(Trait):
 
 @trait
 class Receptive(Trait):
-    @staticmethod
-    def on_status(target: TemTem, status: Statuses, count: int) -> Effect:
-        if status in {
-            Statuses.vigorized,
-            Statuses.immune,
-            Statuses.regenerated,
-            Statuses.evading,
-            Statuses.alerted,
-        }:
-            return Effect(target={status: count + 1})
-        return no_effect
+    # handled in temtem.TemTem.apply_status(), as applying the longer status
+    # from on_status() would call on_status() again
+    STATUSES = frozenset({
+        Statuses.vigorized,
+        Statuses.immune,
+        Statuses.regenerated,
+        Statuses.evading,
+        Statuses.alerted,
+    })
 
 
 @trait
@@ -648,7 +650,7 @@ class Rejuvenate(Trait):
     def on_attack(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if attack['class'] != 'Physical':
             return no_effect
-        return Effect(attacker={Stats.HP: attacker.max_hp // 5})
+        return Effect(attacker={HP_AMOUNT: attacker.max_hp // 5})
 
 
 @trait
@@ -745,7 +747,7 @@ class SharedPain(Trait):
     @staticmethod
     def on_hit(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if target.trait_counter and target.ally:
-            raise RedirectAttack('ally')
+            return redirect_to_ally
         return Effect(target={'trait counter': 1})
 
 
@@ -830,7 +832,7 @@ class TeamElusive(Trait):
     @staticmethod
     def on_hit(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if attack['target'] in {'team or ally', 'whole team', 'all'}:
-            raise Unaffected()
+            return unaffected
         return no_effect
 
 
@@ -982,7 +984,7 @@ class WaterCustodian(Trait):
     @staticmethod
     def on_ally_hit(attacker: TemTem, target: TemTem, attack: Dict[str, Any]) -> Effect:
         if attack['type'] == Types.water:
-            raise RedirectAttack('ally')
+            return redirect_to_ally
         return no_effect
 
 
@@ -994,7 +996,7 @@ class Withdrawal(Trait):
             raise NotImplementedError()
             # TODO: work out what happens with sleep - does the tem get alerted
             # instead?
-        return Effect(target={Stats.HP: int(target.max_hp * 0.15)})
+        return Effect(target={HP_AMOUNT: int(target.max_hp * 0.15)})
 
 
 @trait
@@ -1006,7 +1008,7 @@ class WreckedFarewell(Trait):
         if damage >= target.HP and (
             attacker is None or attacker is target
         ):
-            return Effect(ally={Stats.HP: -0.25}, opposing_team={Stats.HP: -0.25})
+            return Effect(ally={HP_FRACTION: -0.25}, opposing_team={HP_FRACTION: -0.25})
 
 
 @trait
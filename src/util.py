@@ -18,57 +18,108 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
-from .static import Stats, lookup_attack
-from .temtem import gen_tems
+from math import ceil
+
+from .static import Stats, STAT_CONSTS, lookup_attack
+from .temtem import calc_stat, gen_tems
+
+MAX_STAT_TVS = 500
+MAX_TOTAL_TVS = 1000
+# The old incremental optimiser stopped one short of the per-stat cap, and
+# we keep that so optimised sets don't change
+TV_LIMIT = MAX_STAT_TVS - 1
+
+
+def min_tvs(tem, stat, target):
+    '''
+    The fewest TVs that give tem at least target in stat, or None if even
+    MAX_STAT_TVS isn't enough.
+
+    Only the first term of the stat formula depends on TVs, and it's linear
+    in them before rounding, so we can solve for TVs directly. Then we check
+    the neighbours in case float rounding put us one out.
+    '''
+    base, sv, level = tem.base_stats[stat], tem.svs[stat], tem.level
+    divisor = STAT_CONSTS[stat][0]
+
+    def stat_at(tvs):
+        return calc_stat(stat, base, sv, tvs, level)
+
+    if stat_at(MAX_STAT_TVS) < target:
+        return None
+
+    # Everything in the stat that isn't the TV-dependent term
+    rest = stat_at(0) - int((1.5 * base + sv) * level // divisor)
+    tvs = ceil(5 * ((target - rest) * divisor / level - 1.5 * base - sv))
+    tvs = min(max(tvs, 0), MAX_STAT_TVS)
+    while tvs > 0 and stat_at(tvs - 1) >= target:
+        tvs -= 1
+    while stat_at(tvs) < target:
+        tvs += 1
+    return tvs
 
 
 def remove_unuseful_tvs(tem):
+    '''
+    Drop any TVs that don't raise a stat. Stats that only reach their value
+    with more than MAX_STAT_TVS (e.g. a tem with invalid TVs) are left alone.
+    '''
     for stat in Stats:
-        cur_stat = tem.stats[stat]
-        while tem.stats[stat] == cur_stat and tem.tvs[stat] > -1:
-            tem.tvs[stat] -= 1
-            tem._calc_stats()
-        tem.tvs[stat] += 1
-        tem._calc_stats()
+        tvs = min_tvs(tem, stat, tem.stats[stat])
+        if tvs is not None:
+            tem.tvs[stat] = tvs
+    tem._calc_stats()
+
+
+def _set_tvs(tem, stat, tvs):
+    tem.tvs[stat] = tvs
+    tem.stats[stat] = tem._calc_stat(stat)
+    tem._clear_live_stats()
 
 
 def try_increase_stat(tem, stat, remaining_tvs):
+    '''
+    Put as many of remaining_tvs into stat as will raise it, and return how
+    many are left over.
+    '''
     cur_tvs = tem.tvs[stat]
-    cur_stat = tem.stats[stat]
-    last_tvs = (cur_tvs, remaining_tvs)
-    while remaining_tvs and tem.tvs[stat] < 499:
-        tem.tvs[stat] += 1
-        remaining_tvs -= 1
-        tem.stats[stat] = tem._calc_stat(stat)
-        if tem.stats[stat] != cur_stat:
-            cur_stat = tem.stats[stat]
-            last_tvs = (tem.tvs[stat], remaining_tvs)
-
-    tem.tvs[stat] = last_tvs[0]
-    tem.stats[stat] = tem._calc_stat(stat)
-    return last_tvs[1]
+    max_tvs = min(cur_tvs + remaining_tvs, TV_LIMIT)
+    if max_tvs <= cur_tvs:
+        return remaining_tvs
 
+    best = calc_stat(stat, tem.base_stats[stat], tem.svs[stat], max_tvs, tem.level)
+    if best <= tem.stats[stat]:
+        return remaining_tvs
 
-def try_increase_sta_regen(tem, remaining_tvs):
-    from math import ceil
+    new_tvs = min_tvs(tem, stat, best)
+    _set_tvs(tem, stat, new_tvs)
+    return remaining_tvs - (new_tvs - cur_tvs)
+
+
+def sta_regen(max_sta):
+    return ceil(max_sta / 5) + 1
 
-    def sta_regen(tem):
-        return ceil(tem.max_sta / 5) + 1
 
-    cur_sta_regen = sta_regen(tem)
-    cur_tvs = tem.tvs[Stats.Sta]
-    last_tvs = (cur_tvs, remaining_tvs)
-    while remaining_tvs and tem.tvs[Stats.Sta] < 499:
-        tem.tvs[Stats.Sta] += 1
-        remaining_tvs -= 1
-        tem.max_sta = tem._calc_stat(Stats.Sta)
-        if sta_regen(tem) > cur_sta_regen:
-            cur_sta_regen = sta_regen(tem)
-            last_tvs = (tem.tvs[Stats.Sta], remaining_tvs)
+def try_increase_sta_regen(tem, remaining_tvs):
+    '''
+    Like try_increase_stat(), but only spends TVs on Sta if they increase
+    the sta regen per turn.
+    '''
+    stat = Stats.Sta
+    cur_tvs = tem.tvs[stat]
+    max_tvs = min(cur_tvs + remaining_tvs, TV_LIMIT)
+    if max_tvs <= cur_tvs:
+        return remaining_tvs
+
+    best_sta = calc_stat(stat, tem.base_stats[stat], tem.svs[stat], max_tvs, tem.level)
+    best_regen = sta_regen(best_sta)
+    if best_regen <= sta_regen(tem.max_sta):
+        return remaining_tvs
 
-    tem.tvs[Stats.Sta] = last_tvs[0]
-    tem.max_sta = tem._calc_stat(Stats.Sta)
-    return last_tvs[1]
+    # The smallest max sta with that regen
+    new_tvs = min_tvs(tem, stat, 5 * (best_regen - 2) + 1)
+    _set_tvs(tem, stat, new_tvs)
+    return remaining_tvs - (new_tvs - cur_tvs)
 
 
 def optimise_tvs(tem):
@@ -89,7 +140,7 @@ def optimise_tvs(tem):
     '''
     remove_unuseful_tvs(tem)
 
-    remaining_tvs = 1000 - sum(tem.tvs[stat] for stat in Stats)
+    remaining_tvs = MAX_TOTAL_TVS - sum(tem.tvs[stat] for stat in Stats)
     if remaining_tvs < 1:
         return
 
@@ -120,3 +171,52 @@ def optimise_tvs(tem):
 def import_temtemstrat_sets():
     with open('sets.txt', 'r') as fp:
         return list(gen_tems(fp))
+
+
+# Tests
+def test_min_tvs():
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+
+    for tem in gen_tems(f'{GYALIS_IMPORT}\n{KINU_IMPORT}'):
+        for stat in Stats:
+            values = [
+                calc_stat(stat, tem.base_stats[stat], tem.svs[stat], tvs, tem.level)
+                for tvs in range(MAX_STAT_TVS + 1)
+            ]
+            for target in range(values[0] - 1, values[-1] + 2):
+                expected = next(
+                    (tvs for tvs, value in enumerate(values) if value >= target), None
+                )
+                assert min_tvs(tem, stat, target) == expected
+
+
+def test_remove_unuseful_tvs():
+    from .temtem import TemTem
+    from .test_data import GYALIS_IMPORT
+
+    tem = TemTem.from_importable(GYALIS_IMPORT)
+    tem.tvs[Stats.Atk] = MAX_STAT_TVS + 100  # more than min_tvs() will consider
+    tem._calc_stats()
+    before = dict(tem.stats)
+    remove_unuseful_tvs(tem)
+    assert tem.tvs[Stats.Atk] == MAX_STAT_TVS + 100
+    assert None not in tem.tvs.values()
+    assert tem.stats == before
+
+
+def test_optimise_tvs():
+    from .temtem import SAMPLE_SETS
+
+    with open(SAMPLE_SETS, 'r') as fp:
+        tems = list(gen_tems(fp))
+    for tem in tems:
+        try:
+            [lookup_attack(move) for move in tem.moves]
+        except KeyError:
+            continue
+        before = dict(tem.stats)
+        optimise_tvs(tem)
+        assert sum(tem.tvs.values()) <= MAX_TOTAL_TVS
+        assert all(0 <= tvs <= MAX_STAT_TVS for tvs in tem.tvs.values())
+        assert all(tem.stats[stat] >= before[stat] for stat in Stats)
+        assert tem.stats == {stat: tem._calc_stat(stat) for stat in Stats}
@@ -18,7 +18,8 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
-from .static import Types, lookup_attack, lookup_temtem_data
+from .query import learnset
+from .static import Statuses, Types, lookup_attack, lookup_temtem_data
 
 TEMTEM_CHECKS = {}
 TEAM_CHECKS = {}
@@ -74,7 +75,7 @@ def check_choices(choices, team_idx, battle, ignore_rules=[]):
         if rule not in ignore_rules:
             check(choices, team_idx, battle)
 
-    for tem_no, choice in enumerate(choices):
+    for tem_no, choice in _slot_choices(choices):
         if choice.action != 'attack':
             continue
         attack = lookup_attack(choice.detail)
@@ -103,8 +104,7 @@ def sv_limits(temtem):
 
 @temtem_check
 def tem_moves(temtem):
-    tem_data = lookup_temtem_data(temtem.species)
-    all_moves = {move for learnset in tem_data['Moves'].values() for move in learnset}
+    all_moves = learnset(temtem.species)
     for move in temtem.moves:
         if move not in all_moves:
             raise ValidationFailure(f'{temtem.species} does not learn {move}.')
@@ -153,23 +153,31 @@ def tem_count(team):
         )
 
 
+def _slot_choices(choices):
+    '''
+    (slot, choice) for each slot that has a choice - empty slots and fainted
+    tems get None
+    '''
+    return ((tem_no, choice) for tem_no, choice in enumerate(choices) if choice is not None)
+
+
 @choice_check
 def choice_actions(choices, team_idx, battle):
-    for choice in choices:
+    for _, choice in _slot_choices(choices):
         if choice.action not in ('run', 'item', 'switch', 'rest', 'attack'):
             raise ValidationFailure(f'Unknown choice action {choice.action}.')
 
 
 @choice_check
 def competitive_no_running(choices, team_idx, battle):
-    for choice in choices:
+    for _, choice in _slot_choices(choices):
         if choice.action == 'run':
             raise ValidationFailure('Can\'t run from a competitive battle.')
 
 
 @choice_check
 def competitive_no_items(choices, team_idx, battle):
-    for choice in choices:
+    for _, choice in _slot_choices(choices):
         if choice.action == 'item':
             raise ValidationFailure(
                 'Can\'t use items from the bag in a competitive battle.'
@@ -178,10 +186,11 @@ def competitive_no_items(choices, team_idx, battle):
 
 @choice_check
 def switch_fainted(choices, team_idx, battle):
-    for tem_no, choice in enumerate(choices):
+    for tem_no, choice in _slot_choices(choices):
         if choice.action != 'switch':
             continue
-        target = battle.active_tem(team_idx, choice.target)
+        # Switches target the team index of the tem to switch in
+        target = battle.teams[team_idx][choice.targets]
         if target.fainted:
             raise ValidationFailure(
                 f'{battle.active_tem(team_idx, tem_no).species} is attempting '
@@ -191,11 +200,11 @@ def switch_fainted(choices, team_idx, battle):
 
 @choice_check
 def switch_already_out(choices, team_idx, battle):
-    for choice in choices:
-        if choice.action == 'switch' and choice.target in battle.active[team_idx]:
+    for _, choice in _slot_choices(choices):
+        if choice.action == 'switch' and choice.targets in battle.active[team_idx]:
             raise ValidationFailure(
                 'Attempting to switch to '
-                f'{battle.active_tem(team_idx, choice.target).species}, which '
+                f'{battle.teams[team_idx][choice.targets].species}, which '
                 'is already out.'
             )
 
@@ -203,21 +212,20 @@ def switch_already_out(choices, team_idx, battle):
 @choice_check
 def switch_same_slot(choices, team_idx, battle):
     targets = set()
-    for choice in choices:
+    for _, choice in _slot_choices(choices):
         if choice.action != 'switch':
             continue
-        target = battle.active_tem(team_idx, choice.target)
-        if target in targets:
+        if choice.targets in targets:
             raise ValidationFailure(
                 'Multiple tems are trying to switch to the same slot.'
             )
-        targets.add(target)
+        targets.add(choice.targets)
 
 
 @choice_check
 def switch_already_trapped(choices, team_idx, battle):
     # TODO: check this is actually the case - it might just fail instead?
-    for choice, tem_no in enumerate(choices):
+    for tem_no, choice in _slot_choices(choices):
         if choice.action == 'switch':
             this_tem = battle.active_tem(team_idx, tem_no)
             if this_tem.trapped:
@@ -258,20 +266,16 @@ def hold_attack_read(choice, team_idx, tem_no, attack, battle):
 
 @attack_choice_check
 def correct_synergy(choice, team_idx, tem_no, attack, battle):
+    # Choosing a move without its synergy is fine, as the simulator works out
+    # synergy when the move is used. Choosing the synergy version needs the
+    # right ally.
     this_tem = battle.active_tem(team_idx, tem_no)
     if 'synergy attack' in attack:
         synergy_type = attack['name'].split(' +')[1]
-        if Types[synergy_type] not in this_tem.ally.types:
+        if this_tem.ally is None or Types[synergy_type] not in this_tem.ally.types:
             raise ValidationFailure(
-                f'Can\'t use synergy move {choice.detail} because ally '
-                f'{this_tem.ally.species} doesn\'t have type {synergy_type}.'
-            )
-    elif 'synergy type' in attack:
-        if attack['synergy type'] in this_tem.ally.types:
-            raise ValidationFailure(
-                f'Tem {this_tem.species} should choose synergy move '
-                f'{attack["name"] + " +" + attack["synergy type"].name} because '
-                f'of its ally {this_tem.ally.species}\'s typing.'
+                f'Can\'t use synergy move {choice.detail} because its ally '
+                f'doesn\'t have type {synergy_type}.'
             )
 
 
@@ -287,15 +291,30 @@ def valid_attack_target(choice, team_idx, tem_no, attack, battle):
             'based on non-synergy versions of moves.'
         )
 
-    num_targets = len(choice.targets)
+    # Targets are [(side, slot)], as produced by legal_choices()
+    try:
+        targets = [tuple(target) for target in choice.targets]
+    except TypeError:
+        raise ValidationFailure(
+            f'Targets of {choice.detail} should be [(side, slot)], not {choice.targets}.'
+        )
+    num_targets = len(targets)
     if not num_targets:
         raise ValidationFailure(f'{choice.detail} had no targets.')
 
-    if len({tuple(tar) for tar in choice.targets}) != num_targets:
+    if len(set(targets)) != num_targets:
         raise ValidationFailure(
             f'{choice.detail} targetted the same tem twice.'
         )
 
+    user = (team_idx, tem_no)
+    own = _field_slots(battle, team_idx)
+    opposing = _field_slots(battle, int(not team_idx))
+    if any(target not in own + opposing for target in targets):
+        raise ValidationFailure(
+            f'{choice.detail} targetted an empty slot or a fainted tem.'
+        )
+
     if targetting in ('single', 'clockwise', 'other'):
         # For clockwise, only specify the first target
         if num_targets != 1:
@@ -303,51 +322,240 @@ def valid_attack_target(choice, team_idx, tem_no, attack, battle):
                 f'Expected one target for {choice.detail}, but saw '
                 f'{num_targets}.'
             )
-        if targetting == 'other' and choice.targets == [team_idx, tem_no]:
+        if targetting == 'other' and targets == [user]:
             raise ValidationFailure(
                 f'Attack {choice.detail} can\'t target the tem using it.'
             )
 
     elif targetting == 'self':
-        if choice.targets != [team_idx, tem_no]:
+        if targets != [user]:
             raise ValidationFailure(
                 f'Move {choice.detail} must target the tem using it.'
             )
 
     elif targetting == 'team or ally':
-        if len({side for side, tem in choice.targets}) > 1:
+        if len({side for side, tem in targets}) > 1:
             raise ValidationFailure(
                 f'All targets of {choice.detail} must be on the same team.'
             )
-        if choice.targets[0][0] == team_idx:
+        if targets[0][0] == team_idx:
             if num_targets > 1:
                 raise ValidationFailure(
                     f'Can\'t target both yourself and your ally with move '
                     f'{choice.detail}.'
                 )
-        elif num_targets != len(battle.active[not team_idx]):
+        elif num_targets != len(opposing):
             raise ValidationFailure(
                 f'If targetting the opposing side with {choice.detail}, '
                 'must target all opposing tems.'
             )
 
-    elif targetting == 'whole team':
-        if len({side for side, tem in choice.targets}) > 1:
-            raise ValidationFailure(
-                f'All targets of {choice.detail} must be on the same team.'
-            )
-        if len(battle.active[choice.targets[0][0]]) != num_targets:
+    elif targetting in ('team', 'whole team'):
+        if sorted(targets) not in (own, opposing):
             raise ValidationFailure(
                 f'{choice.detail} must target all tems on a team.'
             )
 
     elif targetting == 'all':
-        if sum((len(battle.active[i]) for i in (0, 1))) != num_targets:
+        if num_targets != len(own) + len(opposing):
             raise ValidationFailure(
                 f'{choice.detail} must target all tems on the field.'
             )
 
+    elif targetting == 'all other':
+        if user in targets or num_targets != len(own) + len(opposing) - 1:
+            raise ValidationFailure(
+                f'{choice.detail} must target all other tems on the field.'
+            )
+
     else:
         raise RuntimeError(
             f'Unknown target {targetting} for move {choice.detail}'
         )
+
+
+# Enumerating legal choices, e.g. for searching over battles. This follows the
+# checks above, but builds only legal choices rather than checking candidates.
+
+def _field_slots(battle, side):
+    return [
+        (side, slot) for slot, tem_idx in enumerate(battle.active[side])
+        if tem_idx is not None and not battle.teams[side][tem_idx].fainted
+    ]
+
+
+def _attack_targets(battle, side, slot, targetting):
+    '''
+    Each legal list of targets for a move with the given targetting
+    '''
+    own = _field_slots(battle, side)
+    opposing = _field_slots(battle, int(not side))
+    everyone = own + opposing
+
+    if targetting in ('single', 'clockwise'):
+        # For clockwise, only the first target is chosen
+        return [[target] for target in everyone]
+    if targetting == 'other':
+        return [[target] for target in everyone if target != (side, slot)]
+    if targetting == 'self':
+        return [[(side, slot)]]
+    if targetting == 'team or ally':
+        return [[target] for target in own] + ([opposing] if opposing else [])
+    if targetting in ('team', 'whole team'):
+        return [targets for targets in (own, opposing) if targets]
+    if targetting == 'all':
+        return [everyone]
+    if targetting == 'all other':
+        others = [target for target in everyone if target != (side, slot)]
+        return [others] if others else []
+    raise RuntimeError(f'Unknown target {targetting}')
+
+
+def tem_choices(battle, side, slot, ignore_rules=[], overexert=True):
+    '''
+    Every legal choice for the tem in the given slot, or [None] if there's no
+    tem there that can act.
+
+    Attacks use the move's name without synergy (the simulator works out
+    synergy when the move is used), and a single target for clockwise moves.
+    With overexert=False, attacks the tem doesn't have the stamina for are
+    left out. Items aren't enumerated.
+    '''
+    from .sim import Choice
+
+    tem_idx = battle.active[side][slot]
+    if tem_idx is None or (tem := battle.teams[side][tem_idx]).fainted:
+        return [None]
+
+    choices = [Choice('rest')]
+    if 'competitive_no_running' in ignore_rules:
+        choices.append(Choice('run'))
+
+    if not tem.trapped or 'switch_already_trapped' in ignore_rules:
+        choices.extend(
+            Choice('switch', None, idx)
+            for idx, bench_tem in enumerate(battle.teams[side])
+            if idx not in battle.active[side] and not bench_tem.fainted
+        )
+
+    if tem.overexerted and 'overexerted_attack' not in ignore_rules:
+        return choices
+
+    for move, hold in tem.moves.items():
+        attack = lookup_attack(move)
+        if hold < attack.hold and 'hold_attack_read' not in ignore_rules:
+            continue
+        if not overexert and tem.stamina_cost(attack.stamina) > tem.Sta:
+            continue
+        choices.extend(
+            Choice('attack', move, targets)
+            for targets in _attack_targets(battle, side, slot, attack.target)
+        )
+    return choices
+
+
+def legal_choices(battle, side, ignore_rules=[], overexert=True):
+    '''
+    Yield every legal combination of choices for a side, as a list with a
+    choice (or None) per active slot, for use with Battle.process_turn.
+    '''
+    from itertools import product
+
+    per_slot = [
+        tem_choices(battle, side, slot, ignore_rules, overexert)
+        for slot in range(len(battle.active[side]))
+    ]
+    check_same_slot = 'switch_same_slot' not in ignore_rules
+    for choices in product(*per_slot):
+        if check_same_slot:
+            switches = [
+                choice.targets for choice in choices
+                if choice is not None and choice.action == 'switch'
+            ]
+            if len(switches) != len(set(switches)):
+                continue
+        yield list(choices)
+
+
+# Tests
+def test_legal_choices():
+    from .sim import Battle, Choice
+    from .test_data import GYALIS_IMPORT, KINU_IMPORT
+    from .temtem import gen_tems
+
+    teams = [
+        list(gen_tems(f'{GYALIS_IMPORT}\n\n{KINU_IMPORT}\n\n{KINU_IMPORT}')),
+        list(gen_tems(f'{KINU_IMPORT}\n\n{GYALIS_IMPORT}')),
+    ]
+    battle = Battle(teams, [[0, 1], [0, 1]], 0)
+    gyalis, kinu = teams[0][0], teams[0][1]
+    for tem in (gyalis, kinu):
+        for move in tem.moves:
+            tem.moves[move] = 5
+
+    def summary(choices):
+        return sorted(
+            (choice.action, choice.detail, str(choice.targets))
+            for choice in choices if choice is not None
+        )
+
+    # Gyalis: rest, switch to the bench Kinu, Heat Up on itself, and three
+    # 'other' moves at each of the 3 other tems
+    choices = tem_choices(battle, 0, 0)
+    assert len(choices) == 1 + 1 + 1 + 3 * 3
+    assert ('attack', 'Heat Up', str([(0, 0)])) in summary(choices)
+    assert ('switch', None, '2') in summary(choices)
+    # Kinu's Turbo Choreography can hit either whole team
+    kinu_choices = summary(tem_choices(battle, 0, 1))
+    assert ('attack', 'Turbo Choreography', str([(0, 0), (0, 1)])) in kinu_choices
+    assert ('attack', 'Turbo Choreography', str([(1, 0), (1, 1)])) in kinu_choices
+
+    # Both tems can't switch to the same bench tem
+    assert all(
+        not all(choice.action == 'switch' for choice in side_choices)
+        for side_choices in legal_choices(battle, 0)
+    )
+    assert len(list(legal_choices(battle, 0))) == len(choices) * len(kinu_choices) - 1
+
+    # Every enumerated combination passes the checks
+    for side in (0, 1):
+        for side_choices in legal_choices(battle, side):
+            check_choices(side_choices, side, battle)
+    for bad_targets in ([0, 0], [(0, 0), (0, 0)], [(0, 2)]):
+        try:
+            valid_attack_target(
+                Choice('attack', 'Crystal Bite', bad_targets), 0, 0,
+                lookup_attack('Crystal Bite'), battle,
+            )
+        except ValidationFailure:
+            pass
+        else:
+            assert False, bad_targets
+
+    # Holds, trapped, overexertion, stamina and fainted tems
+    gyalis.moves['Crystal Bite'] = 0
+    assert 'Crystal Bite' not in {choice.detail for choice in tem_choices(battle, 0, 0)}
+    gyalis.apply_status(Statuses.trapped, 2)
+    assert 'switch' not in {choice.action for choice in tem_choices(battle, 0, 0)}
+    gyalis.overexerted = 1
+    assert summary(tem_choices(battle, 0, 0)) == [('rest', None, 'None')]
+    gyalis.overexerted = 0
+    gyalis.Sta = 21
+    assert {choice.detail for choice in tem_choices(battle, 0, 0, overexert=False)} == {
+        None, 'Sharp Stabs', 'Haito Uchi'
+    }
+    # Costs are floored, as in use_stamina: Heat Up costs 11 when vigorized
+    gyalis.Sta = 11
+    gyalis.apply_status(Statuses.vigorized, 2)
+    assert 'Heat Up' in {choice.detail for choice in tem_choices(battle, 0, 0, overexert=False)}
+    gyalis.remove_status(Statuses.vigorized)
+    teams[1][0].fainted = True
+    assert all(
+        (1, 0) not in (choice.targets or [])
+        for choice in tem_choices(battle, 0, 0) if choice.action == 'attack'
+    )
+    kinu.fainted = True
+    assert tem_choices(battle, 0, 1) == [None]
+    for side_choices in legal_choices(battle, 0):
+        assert side_choices[1] is None
+        check_choices(side_choices, 0, battle)